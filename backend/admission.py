@@ -0,0 +1,208 @@
+import os
+import math
+import time
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+import metrics
+from metrics import Counter, Gauge, Histogram
+
+from dotenv import load_dotenv
+load_dotenv()
+
+# Concurrent LLM calls across the process; further questions queue for a slot (0 = no limit).
+# A full queue is rejected at once (429), a request that waits too long gets 503; both carry Retry-After
+LLM_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", "8"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "32"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))
+# Same for embedding calls (question embeddings and ingestion batches; ingestion waits without limits)
+EMBED_MAX_IN_FLIGHT = int(os.getenv("EMBED_MAX_IN_FLIGHT", "16"))
+EMBED_MAX_QUEUE = int(os.getenv("EMBED_MAX_QUEUE", "64"))
+EMBED_QUEUE_TIMEOUT = float(os.getenv("EMBED_QUEUE_TIMEOUT", "10"))
+
+class Overloaded(Exception):
+    """A request was turned away by an AdmissionLimiter.
+
+    ``reason`` is "queue_full" (429, rejected without waiting) or "timeout"
+    (503, no slot freed up in time); ``retry_after`` is in whole seconds.
+    """
+
+    def __init__(self, limiter, reason, retry_after):
+        super().__init__(f"Too many requests for the {limiter} provider, please retry in {retry_after}s.")
+        self.limiter = limiter
+        self.reason = reason
+        self.retry_after = retry_after
+
+    @property
+    def status_code(self):
+        return 429 if self.reason == "queue_full" else 503
+
+class AdmissionLimiter:
+    """At most ``max_in_flight`` concurrent calls, with a bounded queue in front.
+
+    Callers take a slot with ``slot()``. When all slots are busy they wait, up to
+    ``queue_timeout`` seconds and behind at most ``max_queue`` others; beyond that
+    they get Overloaded. Background work (ingestion) waits without either limit,
+    so it never fails because of interactive load, but still counts as in flight.
+    """
+
+    def __init__(self, name, max_in_flight, max_queue, queue_timeout):
+        self.name = name
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._condition = threading.Condition()
+        self.in_flight = 0
+        self.waiting = 0
+        # Moving average of how long a slot is held, for Retry-After
+        self.hold_seconds = 1.0
+        self.counters = {'admitted': 0, 'queued': 0, 'queue_full': 0, 'timeout': 0}
+
+    def _full(self):
+        return 0 < self.max_in_flight <= self.in_flight
+
+    def retry_after(self):
+        # Time for the queue ahead (and this request) to drain at the recent pace
+        slots = max(1, self.max_in_flight)
+        return max(1, math.ceil(self.hold_seconds * (self.waiting + 1) / slots))
+
+    def _reject(self, reason):
+        self.counters[reason] += 1
+        ADMISSION_REJECTIONS.inc(limiter=self.name, reason=reason)
+        return Overloaded(self.name, reason, self.retry_after())
+
+    def check(self):
+        # Fail fast before starting work that will need a slot (e.g. before a stream's headers go out)
+        with self._condition:
+            if self._full() and self.waiting >= self.max_queue:
+                raise self._reject("queue_full")
+
+    def acquire(self, background=False):
+        started = time.perf_counter()
+        with self._condition:
+            if self._full():
+                if not background and self.waiting >= self.max_queue:
+                    raise self._reject("queue_full")
+                self.counters['queued'] += 1
+                self.waiting += 1
+                deadline = None if background else started + self.queue_timeout
+                try:
+                    while self._full():
+                        remaining = None if deadline is None else deadline - time.perf_counter()
+                        if remaining is not None and remaining <= 0:
+                            raise self._reject("timeout")
+                        self._condition.wait(remaining)
+                finally:
+                    self.waiting -= 1
+            self.in_flight += 1
+            self.counters['admitted'] += 1
+        waited = time.perf_counter() - started
+        ADMISSION_WAIT_SECONDS.observe(waited, limiter=self.name)
+        return waited
+
+    def release(self, held):
+        with self._condition:
+            self.in_flight -= 1
+            self.hold_seconds = 0.8 * self.hold_seconds + 0.2 * held
+            self._condition.notify()
+
+    @contextmanager
+    def slot(self, pipeline="ask", background=False):
+        waited = self.acquire(background)
+        # The wait shows up in the request's stage breakdown (e.g. llm_queue)
+        metrics.record(pipeline, f"{self.name}_queue", waited)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(time.perf_counter() - started)
+
+    def stats(self):
+        with self._condition:
+            stats = dict(self.counters)
+            stats.update(in_flight=self.in_flight, waiting=self.waiting, max_in_flight=self.max_in_flight,
+                         max_queue=self.max_queue, queue_timeout=self.queue_timeout,
+                         hold_seconds=round(self.hold_seconds, 3))
+        return stats
+
+class LeaderAborted(RuntimeError):
+    """The caller doing the work of a SingleFlight key stopped without a result (e.g. its client left)."""
+
+class SingleFlight:
+    """Runs one call per key at a time; callers arriving meanwhile share its result (or its error).
+
+    If the caller doing the work is aborted (GeneratorExit, KeyboardInterrupt), the waiting
+    callers are not handed that exception: one of them takes the work over.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.coalesced = 0
+
+    def begin(self, key):
+        # (True, future) for the caller that must do the work, (False, future) for the others
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self.coalesced += 1
+                SINGLEFLIGHT_COALESCED.inc(flight=self.name)
+                return False, future
+            future = self._calls[key] = Future()
+            return True, future
+
+    def finish(self, key, result=None, error=None):
+        with self._lock:
+            future = self._calls.pop(key, None)
+        if future is None:
+            return
+        if error is not None:
+            if not isinstance(error, Exception):
+                error = LeaderAborted(f"{self.name}: {type(error).__name__}")
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def join(self, key):
+        # (True, None) when the caller must do the work, else (False, result of the caller doing it)
+        while True:
+            leader, future = self.begin(key)
+            if leader:
+                return True, None
+            try:
+                return False, future.result()
+            except LeaderAborted:
+                continue  # the first waiter to get here becomes the leader
+
+    def do(self, key, call):
+        leader, result = self.join(key)
+        if not leader:
+            return result
+        try:
+            result = call()
+        except BaseException as e:
+            self.finish(key, error=e)
+            raise
+        self.finish(key, result)
+        return result
+
+    def __len__(self):
+        return len(self._calls)
+
+llm_limiter = AdmissionLimiter("llm", LLM_MAX_IN_FLIGHT, LLM_MAX_QUEUE, LLM_QUEUE_TIMEOUT)
+embedding_limiter = AdmissionLimiter("embedding", EMBED_MAX_IN_FLIGHT, EMBED_MAX_QUEUE, EMBED_QUEUE_TIMEOUT)
+LIMITERS = (llm_limiter, embedding_limiter)
+
+def stats():
+    return {limiter.name: limiter.stats() for limiter in LIMITERS}
+
+ADMISSION_WAIT_SECONDS = Histogram('admission_wait_seconds', 'Time spent queued for a provider slot', ('limiter',))
+ADMISSION_REJECTIONS = Counter('admission_rejections_total', 'Requests turned away by the admission limiters',
+                               ('limiter', 'reason'))
+ADMISSION_IN_FLIGHT = Gauge('admission_in_flight', 'Provider calls in flight', ('limiter',),
+                            collect=lambda: {(limiter.name,): limiter.in_flight for limiter in LIMITERS})
+ADMISSION_QUEUE_DEPTH = Gauge('admission_queue_depth', 'Requests waiting for a provider slot', ('limiter',),
+                              collect=lambda: {(limiter.name,): limiter.waiting for limiter in LIMITERS})
+SINGLEFLIGHT_COALESCED = Counter('singleflight_coalesced_total',
+                                 'Requests that shared the result of an identical request in flight', ('flight',))
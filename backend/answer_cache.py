@@ -0,0 +1,234 @@
+import os
+import time
+import hashlib
+import threading
+import numpy as np
+from database import db
+from datetime import timedelta
+from collections import OrderedDict
+from sqlalchemy import select, or_, func
+from models import IngestionJob, AnswerCacheEntry
+from providers import registry
+from metrics import Gauge, CollectedCounter
+
+from dotenv import load_dotenv
+load_dotenv()
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+# "memory" keeps answers per process, "postgres" also shares them across workers
+ANSWER_CACHE_BACKEND = os.getenv("ANSWER_CACHE_BACKEND", "memory")
+# Cosine similarity above which two questions are treated as the same question
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1024"))
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", "86400"))
+QUESTION_CACHE_SIZE = int(os.getenv("QUESTION_CACHE_SIZE", "4096"))
+QUESTION_CACHE_TTL = int(os.getenv("QUESTION_CACHE_TTL", "86400"))
+# Similar questions remembered per source selection
+ANSWERS_PER_KEY = 32
+
+class TTLCache:
+    """Small thread-safe LRU dict whose entries also expire after ``ttl`` seconds."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop_where(self, predicate):
+        with self._lock:
+            for key in [key for key in self._data if predicate(key)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+def normalize_question(question):
+    return ' '.join(question.lower().split()).rstrip(' ?.!')
+
+def unit_vector(embedding):
+    vector = np.asarray(embedding, dtype='float32')
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+class AnswerCache:
+    """Two-level cache in front of retrieval and the LLM.
+
+    Level 1 maps a normalised question to its embedding. Level 2 maps
+    (session, selected sources, corpus version) to recent answers and returns one
+    when the new question embedding is close enough to a cached question.
+    """
+
+    def __init__(self):
+        self.embeddings = TTLCache(QUESTION_CACHE_SIZE, QUESTION_CACHE_TTL)
+        self.answers = TTLCache(ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL)
+        self._lock = threading.Lock()
+        self.counters = {
+            'embedding_hits': 0, 'embedding_misses': 0,
+            'answer_hits': 0, 'answer_misses': 0, 'answer_shared_hits': 0, 'shared_stores': 0,
+        }
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    # Level 1: question embeddings
+    def embed_question(self, question, embed):
+        key = normalize_question(question)
+        embedding = self.embeddings.get(key)
+        if embedding is not None:
+            self._count('embedding_hits')
+            return embedding
+        self._count('embedding_misses')
+        embedding = embed(question)
+        self.embeddings.set(key, embedding)
+        return embedding
+
+    # Level 2: answers
+    def key(self, session_id, file_ids, link_ids):
+        file_ids = tuple(sorted({int(i) for i in file_ids}))
+        link_ids = tuple(sorted({int(i) for i in link_ids}))
+        # Question vectors of different embedding models must not be compared
+        return (int(session_id), file_ids, link_ids, corpus_version(file_ids, link_ids),
+                registry.embedding_backend.model_name)
+
+    def lookup(self, key, question_embedding):
+        if not ANSWER_CACHE_ENABLED:
+            return None
+        query = unit_vector(question_embedding)
+        entries = self.answers.get(key) or []
+        best = None
+        for vector, answer, sources in entries:
+            score = float(np.dot(vector, query))
+            if score >= ANSWER_CACHE_THRESHOLD and (best is None or score > best[0]):
+                best = (score, answer, sources)
+        if best is not None:
+            self._count('answer_hits')
+            return best[1], best[2]
+        if ANSWER_CACHE_BACKEND == "postgres":
+            shared = self._lookup_shared(key, query)
+            if shared is not None:
+                self._count('answer_shared_hits')
+                self._remember(key, query, *shared)
+                return shared
+        self._count('answer_misses')
+        return None
+
+    def store(self, key, question, question_embedding, answer, sources):
+        if not ANSWER_CACHE_ENABLED:
+            return
+        vector = unit_vector(question_embedding)
+        self._remember(key, vector, answer, sources)
+        if ANSWER_CACHE_BACKEND == "postgres":
+            db.session.add(AnswerCacheEntry(
+                session_id=key[0],
+                cache_key=key_digest(key),
+                question=question,
+                question_embedding=vector.tolist(),
+                answer=answer,
+                sources=[list(source) for source in sources],
+                expires_at=func.current_timestamp() + timedelta(seconds=ANSWER_CACHE_TTL),
+            ))
+            db.session.commit()
+            # Expired rows are skipped by lookups; delete them now and then
+            self._count('shared_stores')
+            if self.counters['shared_stores'] % 100 == 0:
+                self.purge_expired()
+
+    def _remember(self, key, vector, answer, sources):
+        entries = list(self.answers.get(key) or [])
+        entries.append((vector, answer, sources))
+        self.answers.set(key, entries[-ANSWERS_PER_KEY:])
+
+    def _lookup_shared(self, key, query):
+        distance = AnswerCacheEntry.question_embedding.cosine_distance(query.tolist())
+        row = db.session.execute(
+            select(AnswerCacheEntry.answer, AnswerCacheEntry.sources, distance.label('distance'))
+            .where(AnswerCacheEntry.cache_key == key_digest(key), AnswerCacheEntry.expires_at > func.current_timestamp())
+            .order_by(distance)
+            .limit(1)
+        ).first()
+        if row is None or 1 - row.distance < ANSWER_CACHE_THRESHOLD:
+            return None
+        return row.answer, [tuple(source) for source in row.sources]
+
+    # Invalidation
+    def invalidate_source(self, source_type, source_id):
+        # Answers that used a re-ingested or deleted source must not be served again
+        position = 1 if source_type == "file" else 2
+        self.answers.pop_where(lambda key: int(source_id) in key[position])
+
+    def invalidate_session(self, session_id):
+        self.answers.pop_where(lambda key: key[0] == int(session_id))
+        if ANSWER_CACHE_BACKEND == "postgres":
+            AnswerCacheEntry.query.filter_by(session_id=session_id).delete()
+
+    def purge_expired(self):
+        if ANSWER_CACHE_BACKEND == "postgres":
+            AnswerCacheEntry.query.filter(AnswerCacheEntry.expires_at <= func.current_timestamp()).delete()
+            db.session.commit()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+        stats['embeddings'] = len(self.embeddings)
+        stats['answer_keys'] = len(self.answers)
+        stats['backend'] = ANSWER_CACHE_BACKEND
+        return stats
+
+def corpus_version(file_ids, link_ids):
+    # Every (re-)ingestion finishes a new job, so the newest finished job id among the
+    # selected sources changes whenever any of their chunks change (summary jobs do not)
+    if not file_ids and not link_ids:
+        return 0
+    return db.session.scalar(
+        select(func.max(IngestionJob.id)).where(
+            IngestionJob.status == 'done',
+            IngestionJob.kind != 'summary',
+            or_(IngestionJob.document_id.in_(file_ids), IngestionJob.link_id.in_(link_ids)),
+        )
+    ) or 0
+
+def key_digest(key):
+    return hashlib.sha256(repr(key).encode('utf-8')).hexdigest()
+
+answer_cache = AnswerCache()
+
+def _hit_rates():
+    counters = answer_cache.stats()
+    rates = {}
+    for level, hits in (('embedding', counters['embedding_hits']),
+                        ('answer', counters['answer_hits'] + counters['answer_shared_hits'])):
+        lookups = hits + counters[f'{level}_misses']
+        rates[(level,)] = round(hits / lookups, 4) if lookups else 0.0
+    return rates
+
+ANSWER_CACHE_EVENTS = CollectedCounter(
+    'answer_cache_events_total', 'Question embedding and answer cache hits and misses', ('event',),
+    collect=lambda: {(name,): value for name, value in answer_cache.stats().items() if isinstance(value, int)
+                     and name not in ('embeddings', 'answer_keys')},
+)
+ANSWER_CACHE_HIT_RATE = Gauge('answer_cache_hit_rate', 'Hit rate per cache level', ('level',), collect=_hit_rates)
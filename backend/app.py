@@ -1,40 +1,82 @@
 import os
+import json
 import shutil
+import logging
 from database import db
+from sqlalchemy import select
 from flask_cors import CORS
-from chat_service import chatbot
+from chat_service import chatbot, chatbot_stream
+from jobs import ingestion_queue, job_to_dict
+from vector_cache import vector_cache
+from process_documents import file_hash, purge_unused_contents, staging_path
+from answer_cache import answer_cache
+from summaries import purge_unused_summaries
+import admission
+from admission import Overloaded, llm_limiter
+from vector_storage import vectors_cli
+from pagination import InvalidCursor, keyset_page, page_size
+import metrics
+from providers import registry, PROVIDER_WARMUP
+from embedding_backends import EMBEDDING_BACKEND
 from flask_migrate import Migrate
-from flask import Flask, request, jsonify
-from process_documents import process_and_store_chunks
-from models import ChatSession, DBDocument, Link, ChatHistory, DocumentChunk
+from flask import Blueprint, Flask, Response, current_app, g, request, jsonify, stream_with_context
+from models import ChatSession, DBDocument, Link, ChatHistory, DocumentChunk, IngestionJob
 
 from dotenv import load_dotenv
 # Load environment variables from .env
 load_dotenv()
 
-app = Flask(__name__)
-# CORS(app) # Add CORS to allow frontend from diff port send requests
-CORS(app, resources={r"/*": {
-    "origins": "http://127.0.0.1:8000",
-    "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-    "allow_headers": ["Content-Type"]
-}})  # Allow frontend to send request
-    
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+)
+logger = logging.getLogger(__name__)
+
 # Configure uploads folder
 UPLOAD_FOLDER = "uploads"
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-if not os.path.exists(UPLOAD_FOLDER):
-    os.makedirs(UPLOAD_FOLDER)
 
-# Configure PostgreSQL database
-app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv("DATABASE_URL")
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# SQLAlchemy pool per process: one connection per concurrent request (gunicorn threads) plus the
+# ingestion workers and their embedding threads; overflow absorbs bursts (see gunicorn.conf.py)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Recycle connections before server-side idle timeouts (or a pooler) close them
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+# Every HTTP endpoint; create_app() registers it
+api = Blueprint('api', __name__)
+
+# Request latency and per-stage traces (slow requests are logged with their breakdown)
+@api.before_app_request
+def start_request_trace():
+    g.trace = metrics.start_trace(f"{request.method} {request.path}")
+
+@api.after_app_request
+def observe_request(response):
+    trace = g.pop('trace', None)
+    if trace is None:
+        return response
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    method, status = request.method, response.status_code
 
-# Attach db with Flask app
-db.init_app(app)
+    # Streamed bodies are still being generated here, so measure when the response is closed
+    def finish():
+        seconds = metrics.finish_trace(trace)
+        metrics.HTTP_REQUEST_SECONDS.observe(seconds, method=method, endpoint=endpoint, status=status)
+    response.call_on_close(finish)
+    return response
 
-# Initialize Migrate
-migrate = Migrate(app, db)
+# Provider admission control: rejected requests get 429 (queue full) or 503 (timed out) with Retry-After
+@api.app_errorhandler(Overloaded)
+def overloaded(e):
+    response = jsonify({'error': str(e), 'retry_after': e.retry_after})
+    response.status_code = e.status_code
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+@api.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
 
 # Allowed extensions
 ALLOWED_EXTENSIONS = {'pdf', 'docx', 'doc', 'xlsx', 'pptx', 'png', 'jpg', 'jpeg', 'heic'}
@@ -42,21 +84,42 @@ ALLOWED_EXTENSIONS = {'pdf', 'docx', 'doc', 'xlsx', 'pptx', 'png', 'jpg', 'jpeg'
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+# List endpoints return one page as a JSON array; X-Next-Cursor carries the cursor of the next page
+def list_page(stmt, keys, serialize, descending=False, reverse=False):
+    try:
+        rows, next_cursor = keyset_page(
+            db.session, stmt, keys,
+            page_size(request.args.get('limit')),
+            request.args.get('cursor'),
+            descending=descending,
+        )
+    except InvalidCursor:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    if reverse:
+        rows = rows[::-1]
+    response = jsonify([serialize(row) for row in rows])
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
+
 # Manage chat sessions
-@app.route('/sessions', methods=['GET', 'POST'])
+@api.route('/sessions', methods=['GET', 'POST'])
 def sessions():
     if request.method == 'GET':
-        sessions = ChatSession.query.all()
-        return jsonify([{'id': s.id, 'name': s.name, 'created_at': s.created_at} for s in sessions])
+        return list_page(
+            select(ChatSession.id, ChatSession.name, ChatSession.created_at),
+            [ChatSession.id],
+            lambda s: {'id': s.id, 'name': s.name, 'created_at': s.created_at},
+        )
     elif request.method == 'POST':
         name = request.json.get('name', 'New Chat')
         session = ChatSession(name=name)
         db.session.add(session)
         db.session.commit()
-        os.makedirs(os.path.join(app.config['UPLOAD_FOLDER'], str(session.id)), exist_ok=True)
+        os.makedirs(os.path.join(current_app.config['UPLOAD_FOLDER'], str(session.id)), exist_ok=True)
         return  jsonify({'id': session.id, 'name': session.name}), 201
     
-@app.route('/sessions/<int:session_id>', methods=['PUT'])
+@api.route('/sessions/<int:session_id>', methods=['PUT'])
 def rename_session(session_id):
     session = ChatSession.query.get_or_404(session_id)
     new_name = request.json.get('name')
@@ -66,17 +129,21 @@ def rename_session(session_id):
     db.session.commit()
     return jsonify({'id': session.id, 'name': session.name})
 
-@app.route('/sessions/<int:session_id>', methods=['DELETE'])
+@api.route('/sessions/<int:session_id>', methods=['DELETE'])
 def delete_session(session_id):
     try:
-        # 1. Delete related DocumentChunk
+        # 1. Delete related DocumentChunk and ingestion jobs
         DocumentChunk.query.filter_by(session_id=session_id).delete()
+        purge_unused_contents()
+        IngestionJob.query.filter_by(session_id=session_id).delete()
         # 2. Delete related DBDocument
         DBDocument.query.filter_by(session_id=session_id).delete()
         # 3. Delete related links
         Link.query.filter_by(session_id=session_id).delete()
-        # 4. Delete related ChatHistory
+        purge_unused_summaries()
+        # 4. Delete related ChatHistory and cached answers
         ChatHistory.query.filter_by(session_id=session_id).delete()
+        answer_cache.invalidate_session(session_id)
         # 5. Delete ChatSession
         session = ChatSession.query.get_or_404(session_id)
         db.session.delete(session)
@@ -84,8 +151,11 @@ def delete_session(session_id):
         # Commit all changes to database
         db.session.commit()
         
+        # Drop the session's in-memory vector index
+        vector_cache.invalidate(session_id)
+        
         # Delete ChatSession's subfolder (if any)
-        session_folder = os.path.join(app.config['UPLOAD_FOLDER'], str(session_id))
+        session_folder = os.path.join(current_app.config['UPLOAD_FOLDER'], str(session_id))
         if os.path.exists(session_folder):
             shutil.rmtree(session_folder)
         
@@ -95,12 +165,15 @@ def delete_session(session_id):
         return jsonify({'error': str(e)}), 500 # Return error code 500 if there is a problem
     
 # Manage document
-@app.route('/sessions/<int:session_id>/files', methods=['GET'])
+@api.route('/sessions/<int:session_id>/files', methods=['GET'])
 def get_files(session_id):
-    files = DBDocument.query.filter_by(session_id=session_id).all()
-    return jsonify([{'id': f.id, 'filename': f.filename} for f in files])
+    return list_page(
+        select(DBDocument.id, DBDocument.filename, DBDocument.status).where(DBDocument.session_id == session_id),
+        [DBDocument.id],
+        lambda f: {'id': f.id, 'filename': f.filename, 'status': f.status},
+    )
 
-@app.route('/sessions/<int:session_id>/upload', methods=['POST'])
+@api.route('/sessions/<int:session_id>/upload', methods=['POST'])
 def upload_file(session_id):
     if 'file' not in request.files:
         return jsonify({'error': 'No file part'}), 400
@@ -108,44 +181,170 @@ def upload_file(session_id):
     if file.filename == '':
         return jsonify({'error': 'No selected file'}), 400
     if file and allowed_file(file.filename):
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], str(session_id), file.filename)
+        filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], str(session_id), file.filename)
         os.makedirs(os.path.dirname(filepath), exist_ok=True)
         file.save(filepath)
-        document = DBDocument(session_id=session_id, filename=file.filename, filepath=filepath)
+        document = DBDocument(session_id=session_id, filename=file.filename, filepath=filepath,
+                              content_hash=file_hash(filepath), status='processing')
         db.session.add(document)
         db.session.commit()
-        # Save chunks
-        process_and_store_chunks(filepath, 'file', session_id)
-        return jsonify({'id': document.id, 'filename': document.filename}), 201
+        # Extract, embed and save chunks in the background
+        job = ingestion_queue.enqueue(filepath, 'file', session_id, document_id=document.id)
+        return jsonify({'id': document.id, 'filename': document.filename, 'status': document.status, 'job_id': job.id}), 202
     return jsonify({'error': 'File type not allowed'}), 400
 
+def refresh_queued(document_id=None, link_id=None):
+    # A refresh keeps the source 'ready'; a second one queued behind it would diff the same chunks
+    column, source_id = (IngestionJob.document_id, document_id) if document_id is not None else (IngestionJob.link_id, link_id)
+    return IngestionJob.query.filter(
+        column == source_id,
+        IngestionJob.kind == 'refresh',
+        IngestionJob.status.in_(('pending', 'running')),
+    ).first() is not None
+
+@api.route('/sessions/<int:session_id>/files/<int:file_id>', methods=['PUT'])
+def replace_file(session_id, file_id):
+    # Upload a new revision of a document; only changed chunks are embedded again
+    document = DBDocument.query.filter_by(id=file_id, session_id=session_id).first_or_404()
+    if 'file' not in request.files:
+        return jsonify({'error': 'No file part'}), 400
+    file = request.files['file']
+    if file.filename == '':
+        return jsonify({'error': 'No selected file'}), 400
+    if not allowed_file(file.filename):
+        return jsonify({'error': 'File type not allowed'}), 400
+    if document.status == 'processing' or refresh_queued(document_id=document.id):
+        return jsonify({'error': 'File is still being processed'}), 409
+    filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], str(session_id), file.filename)
+    if document.status == 'ready':
+        # The upload waits in a staging folder; the refresh moves it into place with the new chunks,
+        # so a failed refresh leaves the document's file, name and chunks as they were
+        staged = staging_path(filepath, document.id)
+        os.makedirs(os.path.dirname(staged), exist_ok=True)
+        file.save(staged)
+        if file_hash(staged) != document.content_hash:
+            job = ingestion_queue.enqueue(staged, 'file', session_id, document_id=document.id, kind='refresh')
+            return jsonify({'id': document.id, 'filename': document.filename, 'status': document.status, 'job_id': job.id}), 202
+        # Same content: only the name changes
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        os.replace(staged, filepath)
+    else:
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        file.save(filepath)
+    if filepath != document.filepath and os.path.exists(document.filepath):
+        os.remove(document.filepath)
+    document.filename = file.filename
+    document.filepath = filepath
+    if document.status == 'ready':
+        db.session.commit()
+        return jsonify({'id': document.id, 'filename': document.filename, 'status': document.status, 'job_id': None})
+    # A document whose first ingestion failed has nothing to diff against: ingest it again.
+    # Ingestion only fills in an empty hash, so store the new revision's here
+    document.status = 'processing'
+    document.content_hash = file_hash(filepath)
+    db.session.commit()
+    job = ingestion_queue.enqueue(filepath, 'file', session_id, document_id=document.id)
+    return jsonify({'id': document.id, 'filename': document.filename, 'status': document.status, 'job_id': job.id}), 202
+
 # Manage links
-@app.route('/sessions/<int:session_id>/links', methods=['GET'])
+@api.route('/sessions/<int:session_id>/links', methods=['GET'])
 def get_links(session_id):
-    links = Link.query.filter_by(session_id=session_id).all()
-    return jsonify([{'id': l.id, 'name': l.name, 'url': l.url} for l in links])
+    return list_page(
+        select(Link.id, Link.name, Link.url, Link.status).where(Link.session_id == session_id),
+        [Link.id],
+        lambda l: {'id': l.id, 'name': l.name, 'url': l.url, 'status': l.status},
+    )
 
-@app.route('/sessions/<int:session_id>/links', methods=['POST'])
+@api.route('/sessions/<int:session_id>/links', methods=['POST'])
 def add_link(session_id):
     name = request.json.get('name', '')
     url = request.json.get('url')
     if not url:
         return jsonify({'error': 'URL is required'}), 400
-    link = Link(session_id=session_id, name=name, url=url)
+    link = Link(session_id=session_id, name=name, url=url, status='processing')
     db.session.add(link)
     db.session.commit()
-    # Save chunks
-    process_and_store_chunks(url, 'link', session_id)
-    return jsonify({'id': link.id, 'name':link.name, 'url': link.url}), 201
+    # Fetch, embed and save chunks in the background
+    job = ingestion_queue.enqueue(url, 'link', session_id, link_id=link.id)
+    return jsonify({'id': link.id, 'name':link.name, 'url': link.url, 'status': link.status, 'job_id': job.id}), 202
+
+@api.route('/sessions/<int:session_id>/links/<int:link_id>/refresh', methods=['POST'])
+def refresh_link(session_id, link_id):
+    # Re-fetch the page (conditionally) and re-embed only what changed
+    link = Link.query.filter_by(id=link_id, session_id=session_id).first_or_404()
+    if link.status == 'processing' or refresh_queued(link_id=link.id):
+        return jsonify({'error': 'Link is still being processed'}), 409
+    kind = 'refresh' if link.status == 'ready' else 'ingest'
+    link.status = 'ready' if kind == 'refresh' else 'processing'
+    db.session.commit()
+    job = ingestion_queue.enqueue(link.url, 'link', session_id, link_id=link.id, kind=kind)
+    return jsonify({'id': link.id, 'name': link.name, 'url': link.url, 'status': link.status, 'job_id': job.id}), 202
+
+# Ingestion job progress
+@api.route('/jobs/<int:job_id>', methods=['GET'])
+def get_job(job_id):
+    job = IngestionJob.query.get_or_404(job_id)
+    return jsonify(job_to_dict(job))
+
+# Vector index cache counters
+@api.route('/stats/vector_cache', methods=['GET'])
+def vector_cache_stats():
+    return jsonify(vector_cache.stats())
+
+# Question embedding / answer cache counters
+@api.route('/stats/answer_cache', methods=['GET'])
+def answer_cache_stats():
+    return jsonify(answer_cache.stats())
+
+# LLM / embedding admission limiters: slots in use, queue depth, rejections
+@api.route('/stats/admission', methods=['GET'])
+def admission_stats():
+    return jsonify(admission.stats())
 
 # Chat history
-@app.route('/chat_history/<int:session_id>', methods=['GET'])
+@api.route('/chat_history/<int:session_id>', methods=['GET'])
 def get_chat_history(session_id):
-    history = ChatHistory.query.filter_by(session_id=session_id).order_by(ChatHistory.timestamp).all()
-    return jsonify([{'message': h.message, 'is_user': h.is_user} for h in history])
+    # Newest page first (cursor walks back in time); each page is returned oldest to newest
+    return list_page(
+        select(ChatHistory.id, ChatHistory.message, ChatHistory.is_user, ChatHistory.timestamp)
+        .where(ChatHistory.session_id == session_id),
+        [ChatHistory.timestamp, ChatHistory.id],
+        lambda h: {'id': h.id, 'message': h.message, 'is_user': h.is_user},
+        descending=True,
+        reverse=True,
+    )
+
+def resolve_source_names(sources):
+    # Resolve source IDs to names with one query per source type
+    file_ids = [source_id for source_type, source_id in sources if source_type == "file"]
+    link_ids = [source_id for source_type, source_id in sources if source_type == "link"]
+    names = {}
+    if file_ids:
+        rows = db.session.execute(select(DBDocument.id, DBDocument.filename).where(DBDocument.id.in_(file_ids)))
+        names.update((("file", row.id), row.filename) for row in rows)
+    if link_ids:
+        rows = db.session.execute(select(Link.id, Link.name, Link.url).where(Link.id.in_(link_ids)))
+        names.update((("link", row.id), row.name or row.url) for row in rows)
+    return [names[(source_type, int(source_id))] for source_type, source_id in sources
+            if (source_type, int(source_id)) in names]
+
+def save_answer(session_id, question, answer, sources):
+    # Format the source text
+    source_names = resolve_source_names(sources)
+    source_text = "SOURCE: " + ", ".join(source_names) if source_names else ""
+    
+    # Save chat history
+    user_message = ChatHistory(session_id=session_id, is_user=True, message=question)
+    bot_message = ChatHistory(session_id=session_id, is_user=False, message=answer)
+    messages = [user_message, bot_message]
+    if source_text:
+        messages.append(ChatHistory(session_id=session_id, is_user=False, message=source_text))
+    db.session.add_all(messages)
+    db.session.commit()
+    return source_text, [m.id for m in messages]
 
 # Answer question
-@app.route('/sessions/<int:session_id>/ask', methods=['POST'])
+@api.route('/sessions/<int:session_id>/ask', methods=['POST'])
 def ask_question(session_id):
     data = request.json
     question = data.get('question')
@@ -155,43 +354,129 @@ def ask_question(session_id):
         return jsonify({'error': 'Please enter your question'}), 400
 
     # Call chatbot with file_ids and link_ids
-    answer, sources = chatbot(question, session_id, file_ids, link_ids)
-
-    # Resolve source IDs to names                
-    source_names = []
-    for source_type, source_id in sources:
-        if source_type == "file":
-            doc = db.session.get(DBDocument, source_id)
-            if doc:
-                source_names.append(doc.filename)
-        elif source_type == "link":
-            link = db.session.get(Link, source_id)
-            if link:
-                source_names.append(link.name or link.url)
-                
-    # Format the source text
-    source_text = "SOURCE: " + ", ".join(source_names) if source_names else ""
-    
-    # Save chat history
-    user_message = ChatHistory(session_id=session_id, is_user=True, message=question)
-    bot_message = ChatHistory(session_id=session_id, is_user=False, message=answer)
-    db.session.add(user_message)
-    db.session.add(bot_message)
-    if source_text:
-        source_message = ChatHistory(session_id=session_id, is_user=False, message=source_text)
-        db.session.add(source_message)
-    db.session.commit()
+    if data.get('citations'):
+        # Optional per-passage scores and highlight offsets
+        answer, sources, citations = chatbot(question, session_id, file_ids, link_ids, with_citations=True)
+    else:
+        answer, sources = chatbot(question, session_id, file_ids, link_ids)
+        citations = None
+    source_text, _ = save_answer(session_id, question, answer, sources)
+
+    result = {'answer': answer, 'source_text': source_text}
+    if citations is not None:
+        result['citations'] = citations
+    return jsonify(result)
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+# Answer question, streaming the answer as Server-Sent Events
+@api.route('/sessions/<int:session_id>/ask/stream', methods=['POST'])
+def ask_question_stream(session_id):
+    data = request.json
+    question = data.get('question')
+    file_ids = data.get('file_ids', [])
+    link_ids = data.get('link_ids', [])
+    if not question:
+        return jsonify({'error': 'Please enter your question'}), 400
+    # Turn the request away before the stream starts if the LLM queue is already full
+    llm_limiter.check()
+
+    trace = g.get('trace')
+
+    def generate():
+        # Stages recorded while streaming belong to this request's trace
+        if trace is not None:
+            metrics.activate(trace)
+        try:
+            for event, payload in chatbot_stream(question, session_id, file_ids, link_ids,
+                                                 with_citations=bool(data.get('citations'))):
+                if event == "token":
+                    yield sse_event("token", {'text': payload})
+                else:
+                    answer, sources, citations = payload
+                    source_text, history_ids = save_answer(session_id, question, answer, sources)
+                    done = {'answer': answer, 'source_text': source_text, 'history_ids': history_ids}
+                    if citations is not None:
+                        done['citations'] = citations
+                    yield sse_event("done", done)
+        except Overloaded as e:
+            db.session.rollback()
+            yield sse_event("error", {'error': str(e), 'retry_after': e.retry_after})
+        except Exception as e:
+            db.session.rollback()
+            logger.exception("Error streaming answer: %s", e)
+            yield sse_event("error", {'error': str(e)})
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers=headers)
+
+def create_app(config=None):
+    """Build the Flask app: settings, database, migrations, CLI commands and the API routes.
+
+    ``config`` overrides settings (e.g. another SQLALCHEMY_DATABASE_URI). Production
+    servers load it through wsgi.py (gunicorn).
+    """
+    app = Flask(__name__)
+    # CORS(app) # Add CORS to allow frontend from diff port send requests
+    CORS(app, resources={r"/*": {
+        "origins": "http://127.0.0.1:8000",
+        "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
+        "allow_headers": ["Content-Type"],
+        "expose_headers": ["X-Next-Cursor", "Retry-After"]
+    }})  # Allow frontend to send request
+
+    app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+    # Configure PostgreSQL database
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv("DATABASE_URL")
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': True,
+    }
+    if config:
+        app.config.update(config)
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+
+    # Attach db with Flask app
+    db.init_app(app)
+    # Initialize Migrate
+    Migrate(app, db)
+    # flask vectors ...: build and inspect the compact vector indexes
+    app.cli.add_command(vectors_cli)
+    # Background ingestion (workers start on first enqueue or at startup)
+    ingestion_queue.init_app(app)
+
+    app.register_blueprint(api)
+    return app
+
+def start_services():
+    # Once per serving process: resume pending ingestion jobs and build the provider clients
+    ingestion_queue.start()
+    # Build the LLM/embedding clients before the first request
+    if PROVIDER_WARMUP:
+        registry.warm_up()
+    elif EMBEDDING_BACKEND == "local":
+        # Load the local model now instead of on the first upload or question
+        registry.embedding_backend.warm_up()
+
+# Module-level app for the flask CLI (flask --app app db upgrade) and the dev server below
+app = create_app()
 
-    return jsonify({'answer': answer, 'source_text': source_text})
-    
 if __name__ == '__main__':
     # Create database the first time
     with app.app_context():
         try:
             # Automatically create table if it does not exist
             db.create_all()
-            print("Connected and created tables in chatbot_db.")
+            logger.info("Connected and created tables in chatbot_db.")
         except Exception as e:
-            print(f"Error connecting or creating table: {e}")
-            print("Please check if 'chatbot_db' has been created in pgAdmin 4.")
+            logger.error("Error connecting or creating table: %s", e)
+            logger.error("Please check if 'chatbot_db' has been created in pgAdmin 4.")
+    # Resume jobs left pending by a previous run (only in the reloader's serving process)
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_services()
     app.run(debug=True, host="127.0.0.1", port=5000)
@@ -0,0 +1,45 @@
+# PDF extraction speed-up versus the number of worker processes
+#   cd backend && python -m benchmarks.bench_extract --pages 200
+import os
+import json
+import time
+import argparse
+import tempfile
+import parallel_extract
+from benchmarks.corpus import make_pdf
+
+def run(pdf_path, page_count, workers):
+    parallel_extract.shutdown_pool()
+    parallel_extract.EXTRACT_MAX_WORKERS = workers
+    start = time.perf_counter()
+    if workers <= 1:
+        pages = parallel_extract.extract_pdf_pages(pdf_path, 0, page_count)
+    else:
+        # Start the pool first so process spawn is not billed to the first document only
+        parallel_extract.get_pool().submit(int).result()
+        start = time.perf_counter()
+        pages = list(parallel_extract.iter_pdf_pages(pdf_path, page_count))
+    elapsed = time.perf_counter() - start
+    assert len(pages) == page_count
+    return {'workers': workers, 'pages': page_count, 'seconds': round(elapsed, 3),
+            'pages_per_sec': round(page_count / elapsed, 1), 'chars': sum(len(page) for page in pages)}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pages', type=int, default=200)
+    parser.add_argument('--workers', type=int, nargs='*')
+    args = parser.parse_args()
+
+    cpus = os.cpu_count() or 1
+    workers = args.workers or sorted({1, 2, 4, cpus})
+    with tempfile.TemporaryDirectory() as tmp:
+        pdf_path = make_pdf(os.path.join(tmp, 'bench.pdf'), args.pages)
+        results = [run(pdf_path, args.pages, count) for count in workers]
+    parallel_extract.shutdown_pool()
+    baseline = results[0]['seconds']
+    for result in results:
+        result['speedup'] = round(baseline / result['seconds'], 2)
+    print(json.dumps({'cpus': cpus, 'results': results}, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+# Recall and latency of dense-only vs hybrid (full-text + dense, RRF) retrieval
+#   DATABASE_URL=postgresql://... cd backend && python -m benchmarks.bench_hybrid --clauses 2000
+# Needs Postgres with pgvector and the migrations applied; the benchmark data is deleted afterwards.
+import os
+import json
+import time
+import random
+import argparse
+from benchmarks.corpus import WORDS
+from benchmarks.fake_together import start_server, base_url
+
+def clause_text(rng, chapter, clause):
+    words = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(15, 30)))
+    code = f"SP-{rng.randint(1000, 9999)}"
+    return f"Điều {chapter}.{clause}. {words.capitalize()}. Áp dụng cho mã sản phẩm {code}.", code
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clauses', type=int, default=2000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=5)
+    args = parser.parse_args()
+
+    server = start_server(latency=0.0, per_item_latency=0.0, embedding="words")
+    os.environ['TOGETHER_API_BASE'] = base_url(server)
+    os.environ.setdefault('TOGETHER_AI_API_KEY', 'fake-key')
+    from app import app
+    from database import db
+    import chat_service
+    from models import ChatSession, DBDocument, DocumentChunk, ChunkContent
+    from process_documents import iter_chunks, resolve_contents, store_chunks, purge_unused_contents
+
+    rng = random.Random(7)
+    clauses = [clause_text(rng, 1 + i // 20, 1 + i % 20) for i in range(args.clauses)]
+    with app.app_context():
+        session = ChatSession(name="bench_hybrid")
+        db.session.add(session)
+        db.session.commit()
+        document = DBDocument(session_id=session.id, filename="bench.docx", filepath="bench.docx", status='ready')
+        db.session.add(document)
+        db.session.commit()
+        chunks = list(iter_chunks(text for text, _ in clauses))
+        content_ids, embeddings = resolve_contents(chunks)
+        store_chunks(session.id, document.id, None, content_ids)
+        db.session.execute(db.text("ANALYZE chunk_content; ANALYZE document_chunk"))
+        db.session.commit()
+
+        # Questions about one identifier each; relevant = chunks containing it
+        queries = []
+        for text, code in rng.sample(clauses, min(args.queries, len(clauses))):
+            clause_id = text.split('.')[0] + '.' + text.split('.')[1]  # "Điều 3.7"
+            for question, needle in ((f"{clause_id} quy định những gì?", clause_id + '.'),
+                                     (f"Sản phẩm {code} được áp dụng điều khoản nào?", code)):
+                relevant = {i for i, chunk in enumerate(chunks) if needle in chunk}
+                queries.append((question, relevant))
+        rows = db.session.execute(
+            db.select(DocumentChunk.id).where(DocumentChunk.document_id == document.id).order_by(DocumentChunk.id)
+        ).all()
+        position = {row.id: i for i, row in enumerate(rows)}
+        query_embeddings = {question: chat_service.embed_question(question) for question, _ in queries}
+
+        modes = {
+            'dense': dict(HYBRID_SEARCH=False, LEXICAL_PREFILTER=False),
+            'hybrid_rrf': dict(HYBRID_SEARCH=True, LEXICAL_PREFILTER=False),
+            'hybrid_prefilter': dict(HYBRID_SEARCH=True, LEXICAL_PREFILTER=True, LEXICAL_PREFILTER_CANDIDATES=args.k),
+        }
+        results = []
+        for mode, settings in modes.items():
+            for name, value in settings.items():
+                setattr(chat_service, name, value)
+            latencies = []
+            hits = 0
+            for question, relevant in queries:
+                start = time.perf_counter()
+                matches = chat_service.retrieve(question, session.id, [document.id], [], k=args.k,
+                                                query_embedding=query_embeddings[question])
+                latencies.append(time.perf_counter() - start)
+                db.session.commit()
+                found = {position[match.metadata['chunk_id']] for match in matches}
+                hits += bool(found & relevant)
+            results.append({
+                'mode': mode,
+                'recall_at_k': round(hits / len(queries), 3),
+                'p50_ms': round(percentile(latencies, 0.5) * 1000, 2),
+                'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+            })
+
+        DocumentChunk.query.filter_by(session_id=session.id).delete()
+        purge_unused_contents()
+        DBDocument.query.filter_by(session_id=session.id).delete()
+        db.session.delete(session)
+        db.session.commit()
+    print(json.dumps({'clauses': args.clauses, 'chunks': len(chunks), 'queries': len(queries), 'k': args.k,
+                      'engine': chat_service.RETRIEVAL_ENGINE, 'results': results}, indent=2))
+
+if __name__ == '__main__':
+    main()
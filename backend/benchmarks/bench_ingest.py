@@ -0,0 +1,50 @@
+# Embedding throughput of the ingestion path against the fake Together server
+#   cd backend && python -m benchmarks.bench_ingest --chunks 300
+import os
+import json
+import time
+import argparse
+from benchmarks.fake_together import start_server, base_url
+
+def synthetic_chunks(count, size=1000):
+    words = "quy trình vận hành rủi ro compliance vendor hardware software policy điều khoản".split()
+    return [
+        ' '.join(words[(i + j) % len(words)] for j in range(size // 8))[:size] + f" #{i}"
+        for i in range(count)
+    ]
+
+def run(chunks, label, fn):
+    start = time.perf_counter()
+    embeddings = fn(chunks)
+    elapsed = time.perf_counter() - start
+    assert len(embeddings) == len(chunks)
+    return {'mode': label, 'chunks': len(chunks), 'seconds': round(elapsed, 3),
+            'chunks_per_sec': round(len(chunks) / elapsed, 1)}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chunks', type=int, default=300)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    server = start_server(latency=args.latency)
+    os.environ['TOGETHER_API_BASE'] = base_url(server)
+    os.environ.setdefault('TOGETHER_AI_API_KEY', 'fake-key')
+    import process_documents
+
+    chunks = synthetic_chunks(args.chunks)
+    results = [
+        run(chunks, 'serial embed_query',
+            lambda cs: [process_documents.registry.embeddings.embed_query(c) for c in cs]),
+        run(chunks, f'batched (batch={args.batch_size}, workers=1)',
+            lambda cs: process_documents.embed_chunks(cs, batch_size=args.batch_size, max_workers=1)),
+        run(chunks, f'batched (batch={args.batch_size}, workers={args.workers})',
+            lambda cs: process_documents.embed_chunks(cs, batch_size=args.batch_size, max_workers=args.workers)),
+    ]
+    server.shutdown()
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+# Local CPU embedding backend: model load, query latency, dynamic batching and ingestion throughput
+#   cd backend && python -m benchmarks.bench_local_embeddings --chunks 256 --concurrency 8
+#   python -m benchmarks.bench_local_embeddings --model /models/multilingual-e5-small --threads 4
+# Needs torch and transformers; the model is downloaded on the first run (or read from a directory),
+# after that no network is used.
+import os
+import json
+import time
+import argparse
+import threading
+from benchmarks.bench_ingest import synthetic_chunks
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', default=None, help="LOCAL_EMBEDDING_MODEL (default: the backend's)")
+    parser.add_argument('--chunks', type=int, default=256)
+    parser.add_argument('--queries', type=int, default=64)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--threads', type=int, default=0, help="torch threads (0 = torch default)")
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--batch-wait-ms', type=float, default=5)
+    args = parser.parse_args()
+
+    # Ingestion goes through the registry, so select the local backend before importing it
+    os.environ['EMBEDDING_BACKEND'] = 'local'
+    if args.model:
+        os.environ['LOCAL_EMBEDDING_MODEL'] = args.model
+    os.environ['LOCAL_EMBEDDING_THREADS'] = str(args.threads)
+    os.environ['LOCAL_EMBEDDING_BATCH_SIZE'] = str(args.batch_size)
+    os.environ['LOCAL_EMBEDDING_BATCH_WAIT_MS'] = str(args.batch_wait_ms)
+    import process_documents
+    backend = process_documents.registry.embedding_backend
+
+    start = time.perf_counter()
+    backend.warm_up()
+    load_seconds = time.perf_counter() - start
+
+    questions = [f"Điều {i} quy định gì về rủi ro vận hành?" for i in range(args.queries)]
+    latencies = []
+    for question in questions:
+        start = time.perf_counter()
+        backend.embed_query(question)
+        latencies.append(time.perf_counter() - start)
+
+    # Concurrent questions share forward passes in the dynamic batcher
+    batches_before = backend.batcher.batches
+    pending = list(questions)
+    lock = threading.Lock()
+    def ask():
+        while True:
+            with lock:
+                if not pending:
+                    return
+                question = pending.pop()
+            backend.embed_query(question)
+    threads = [threading.Thread(target=ask) for _ in range(args.concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    concurrent_seconds = time.perf_counter() - start
+    concurrent_batches = backend.batcher.batches - batches_before
+
+    chunks = synthetic_chunks(args.chunks)
+    start = time.perf_counter()
+    embeddings = process_documents.embed_chunks(chunks, batch_size=args.batch_size)
+    ingest_seconds = time.perf_counter() - start
+    assert len(embeddings) == len(chunks)
+
+    print(json.dumps({
+        'model': backend.model_name,
+        'load_seconds': round(load_seconds, 2),
+        'query_ms': {
+            'p50': round(percentile(latencies, 0.5) * 1000, 1),
+            'p95': round(percentile(latencies, 0.95) * 1000, 1),
+        },
+        'concurrent_queries': {
+            'concurrency': args.concurrency,
+            'queries_per_sec': round(len(questions) / concurrent_seconds, 1),
+            'forward_passes': concurrent_batches,
+        },
+        'ingest': {
+            'chunks': len(chunks),
+            'seconds': round(ingest_seconds, 2),
+            'chunks_per_sec': round(len(chunks) / ingest_seconds, 1),
+        },
+    }, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+# Micro-benchmark of answer post-processing: the regex pipeline chat_service used to run against postprocessing
+#   cd backend && python -m benchmarks.bench_postprocess --answers 2000 --repeat 5
+# "legacy" is clean_redundant + trim_to_last_sentence (kept in benchmarks.golden_postprocess), "clean_answer"
+# the engine on the complete string and "streamed" the engine fed the answer in 4-character tokens.
+import json
+import time
+import argparse
+from benchmarks.corpus import llm_answers
+from benchmarks.golden_postprocess import legacy_postprocess
+
+TOKEN_CHARS = 4
+
+def streamed(text, question):
+    from postprocessing import AnswerCleaner
+    cleaner = AnswerCleaner(question)
+    for position in range(0, len(text), TOKEN_CHARS):
+        cleaner.feed(text[position:position + TOKEN_CHARS])
+        if cleaner.done:
+            break
+    cleaner.finish()
+    return cleaner.result()
+
+def measure(answers, repeat):
+    # Best of ``repeat`` passes over all answers, in microseconds per answer
+    from postprocessing import clean_answer
+    timings = {}
+    for name, call in (
+        ('legacy', lambda text, question: legacy_postprocess(text, question)),
+        ('clean_answer', lambda text, question: clean_answer(text, question, max_length=700)),
+        ('streamed', streamed),
+    ):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for text, question in answers:
+                call(text, question)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        timings[name] = {'us_per_answer': round(best / len(answers) * 1e6, 2)}
+    return timings
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--answers', type=int, default=2000, help="Synthetic completions to clean")
+    parser.add_argument('--repeat', type=int, default=5, help="Best of N passes")
+    args = parser.parse_args()
+
+    answers = llm_answers(args.answers, seed=1)
+    timings = measure(answers, args.repeat)
+    legacy = timings['legacy']['us_per_answer']
+    report = {
+        'answers': len(answers),
+        'mean_chars': round(sum(len(text) for text, _ in answers) / len(answers)),
+        'best_of': args.repeat,
+        **timings,
+        'speedup': {name: round(legacy / timing['us_per_answer'], 2)
+                    for name, timing in timings.items() if name != 'legacy'},
+    }
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
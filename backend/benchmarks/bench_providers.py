@@ -0,0 +1,57 @@
+# Per-question client overhead: building clients/chains per request vs the shared registry
+#   cd backend && python -m benchmarks.bench_providers --requests 50
+import os
+import json
+import time
+import argparse
+import warnings
+from benchmarks.fake_together import start_server, base_url
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = start_server(latency=args.latency, per_item_latency=0.0)
+    os.environ['TOGETHER_API_BASE'] = base_url(server)
+    os.environ.setdefault('TOGETHER_AI_API_KEY', 'fake-key')
+    import providers
+    from langchain_core.documents import Document
+    from langchain.prompts import PromptTemplate
+    from langchain_together import TogetherEmbeddings, Together
+    from langchain.chains.question_answering import load_qa_chain
+    warnings.filterwarnings('ignore')
+
+    question = "File hiện tại chứa thông tin gì?"
+    docs = [Document(page_content="Quy trình vận hành hệ thống. " * 20, metadata={})] * 5
+
+    def per_request():
+        embeddings = TogetherEmbeddings(api_key='fake-key', base_url=providers.TOGETHER_API_BASE,
+                                        model=providers.EMBEDDING_MODEL)
+        embeddings.embed_query(question)
+        llm = Together(api_key='fake-key', base_url=providers.api_url('completions'),
+                       model=providers.LLM_MODEL, temperature=0.2, max_tokens=800)
+        prompt = PromptTemplate(input_variables=["question", "context"],
+                                template=providers.prompt_template.template)
+        chain = load_qa_chain(llm, chain_type="stuff", prompt=prompt)
+        chain.run(input_documents=docs, question=question)
+
+    def shared():
+        providers.registry.embeddings.embed_query(question)
+        providers.registry.qa_chain.run(input_documents=docs, question=question)
+
+    results = []
+    for label, fn in [('per-request clients', per_request), ('shared registry', shared)]:
+        fn()  # exclude one-time import/initialisation
+        start = time.perf_counter()
+        for _ in range(args.requests):
+            fn()
+        elapsed = time.perf_counter() - start
+        results.append({'mode': label, 'requests': args.requests,
+                        'ms_per_request': round(elapsed * 1000 / args.requests, 2)})
+    server.shutdown()
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+# Time-to-first-token of the streaming answer path vs waiting for the full completion
+#   cd backend && python -m benchmarks.bench_stream --tokens 300 --per-token-latency 0.01
+import os
+import json
+import time
+import argparse
+from benchmarks.fake_together import start_server, base_url
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tokens', type=int, default=300)
+    parser.add_argument('--latency', type=float, default=0.2)
+    parser.add_argument('--per-token-latency', type=float, default=0.01)
+    args = parser.parse_args()
+
+    sentence = "Tài liệu mô tả quy trình vận hành và quản lý rủi ro của hệ thống."
+    words = (sentence + ' ') * (args.tokens // len(sentence.split()) + 1)
+    answer = ' '.join(words.split()[:args.tokens])
+    server = start_server(latency=args.latency, per_token_latency=args.per_token_latency, answer=answer)
+    os.environ['TOGETHER_API_BASE'] = base_url(server)
+    os.environ.setdefault('TOGETHER_AI_API_KEY', 'fake-key')
+    import chat_service
+
+    prompt = "Answer the question 'Tài liệu nói gì?' based only on the information from the following text: ..."
+
+    start = time.perf_counter()
+    chat_service.registry.llm.invoke(prompt)
+    blocking = time.perf_counter() - start
+
+    start = time.perf_counter()
+    cleaner = chat_service.StreamingCleaner('Tài liệu nói gì?')
+    first_token = first_sentence = None
+    for piece in chat_service.stream_completion(prompt):
+        if first_token is None:
+            first_token = time.perf_counter() - start
+        if cleaner.feed(piece) and first_sentence is None:
+            first_sentence = time.perf_counter() - start
+    streamed = time.perf_counter() - start
+    server.shutdown()
+
+    print(json.dumps({
+        'tokens': args.tokens,
+        'blocking_answer_seconds': round(blocking, 3),
+        'stream_first_token_seconds': round(first_token, 3),
+        'stream_first_sentence_seconds': round(first_sentence or streamed, 3),
+        'stream_total_seconds': round(streamed, 3),
+    }, indent=2))
+
+if __name__ == '__main__':
+    main()
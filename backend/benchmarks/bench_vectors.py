@@ -0,0 +1,180 @@
+# Memory, latency and recall@k of compact vector storage against float32
+#   cd backend && python -m benchmarks.bench_vectors --vectors 20000
+#   DATABASE_URL=postgresql://... python -m benchmarks.bench_vectors --postgres   (needs pgvector >= 0.7)
+# Recall is measured against exact float32 search. The Postgres run inserts the vectors into
+# chunk_content, builds the compact indexes and deletes everything it created afterwards.
+import json
+import time
+import argparse
+import numpy as np
+
+DIM = 768
+
+def synthetic_embeddings(count, clusters, seed):
+    # Topic clusters around a shared direction, like sentence embeddings (which are far from isotropic)
+    rng = np.random.default_rng(seed)
+    shared = rng.normal(size=DIM)
+    centroids = rng.normal(size=(clusters, DIM))
+    vectors = centroids[rng.integers(0, clusters, count)] + 0.8 * rng.normal(size=(count, DIM)) + 0.5 * shared
+    vectors = vectors.astype('float32')
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def recall(found, truth):
+    return float(np.mean([len(set(f) & set(t)) / len(t) for f, t in zip(found, truth)]))
+
+def top_k(scores, k):
+    part = np.argpartition(-scores, k)[:k]
+    return part[np.argsort(-scores[part])]
+
+def rescored(vectors, query, shortlist, k):
+    # Full-precision rescoring of a shortlist, as the compact modes do
+    return shortlist[np.argsort(-(vectors[shortlist] @ query))[:k]]
+
+def simulate(vectors, queries, truth, k, factors):
+    """Exact search on halfvec / binary codes (+ rescoring), i.e. what an index converges to."""
+    results = []
+    half = vectors.astype('float16').astype('float32')
+    bits = np.packbits(vectors > 0, axis=1)
+    popcount = np.unpackbits(np.arange(256, dtype='uint8')[:, None], axis=1).sum(axis=1)
+    for name, bytes_per_vector in (('float32', DIM * 4), ('halfvec', DIM * 2), ('binary', DIM // 8)):
+        for factor in (factors if name != 'float32' else [1]):
+            found = []
+            for query in queries:
+                if name == 'float32':
+                    found.append(top_k(vectors @ query, k))
+                    continue
+                if name == 'halfvec':
+                    scores = half @ query.astype('float16').astype('float32')
+                else:
+                    query_bits = np.packbits(query > 0)
+                    scores = -popcount[np.bitwise_xor(bits, query_bits)].sum(axis=1).astype('float32')
+                found.append(rescored(vectors, query, top_k(scores, k * factor), k))
+            results.append({'mode': name, 'rescore_factor': factor, 'bytes_per_vector': bytes_per_vector,
+                            'recall_at_k': round(recall(found, truth), 4)})
+    return results
+
+def bench_faiss(vectors, queries, truth, k):
+    # The faiss_cache engine: SessionIndex memory and search latency per storage
+    from vector_cache import SessionIndex
+    ids = list(range(1, len(vectors) + 1))
+    results = []
+    for storage in ('float32', 'float16'):
+        index = SessionIndex(storage=storage)
+        index.add(ids, [''] * len(ids), vectors, [1] * len(ids), [None] * len(ids), list(range(len(ids))), terms=[()] * len(ids))
+        latencies, found = [], []
+        for query in queries:
+            start = time.perf_counter()
+            matches = index.search(query, [("file", 1)], k)
+            latencies.append(time.perf_counter() - start)
+            found.append([chunk_id - 1 for chunk_id, *_ in matches])
+        results.append({
+            'storage': storage,
+            'vector_mb': round(index.index.ntotal * index.vector_bytes / 2**20, 1),
+            'p50_ms': round(percentile(latencies, 0.5) * 1000, 2),
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+            'recall_at_k': round(recall(found, truth), 4),
+        })
+    return results
+
+def bench_postgres(vectors, queries, truth, k):
+    from sqlalchemy import text, insert
+    from app import app
+    from database import db
+    import chat_service
+    from models import ChatSession, DBDocument, DocumentChunk, ChunkContent
+    from process_documents import purge_unused_contents
+    from vector_storage import INDEXES, COMPACT_MIN_VERSION, pgvector_version, index_exists
+
+    with app.app_context():
+        version = pgvector_version(db.session.connection())
+        if version is None or version < COMPACT_MIN_VERSION:
+            return {'skipped': f"pgvector {version} < 0.7 has no halfvec / binary_quantize"}
+        session = ChatSession(name="bench_vectors")
+        db.session.add(session)
+        db.session.commit()
+        document = DBDocument(session_id=session.id, filename="bench", filepath="bench", status='ready')
+        db.session.add(document)
+        db.session.commit()
+        content_ids = db.session.scalars(
+            insert(ChunkContent).returning(ChunkContent.id, sort_by_parameter_order=True),
+            [{'content_hash': f"bench-vectors-{i}", 'chunk_text': f"chunk {i}", 'embedding': vector}
+             for i, vector in enumerate(vectors)],
+        ).all()
+        chunk_ids = db.session.scalars(
+            insert(DocumentChunk).returning(DocumentChunk.id, sort_by_parameter_order=True),
+            [{'session_id': session.id, 'document_id': document.id, 'content_id': content_id} for content_id in content_ids],
+        ).all()
+        db.session.commit()
+        position = {chunk_id: i for i, chunk_id in enumerate(chunk_ids)}
+
+        engine = db.engine.execution_options(isolation_level="AUTOCOMMIT")
+        with engine.connect() as connection:
+            created = [name for name, _, _ in INDEXES.values() if not index_exists(connection, name)]
+            connection.execute(text("SET maintenance_work_mem = '1GB'"))
+            for storage, (name, expression, opclass) in INDEXES.items():
+                connection.execute(text(
+                    f"CREATE INDEX IF NOT EXISTS {name} ON chunk_content "
+                    f"USING hnsw ({expression} {opclass}) WITH (m = 16, ef_construction = 64)"
+                ))
+            connection.execute(text("ANALYZE chunk_content; ANALYZE document_chunk"))
+
+        results = []
+        for storage, (name, _, _) in INDEXES.items():
+            chat_service.VECTOR_STORAGE = storage
+            latencies, found = [], []
+            for query in queries:
+                start = time.perf_counter()
+                matches = chat_service.search_pgvector(query.tolist(), session.id, [document.id], [], k=k)
+                latencies.append(time.perf_counter() - start)
+                db.session.commit()
+                found.append([position[match.metadata['chunk_id']] for match in matches])
+            size = db.session.execute(text("SELECT pg_relation_size(:name)"), {'name': name}).scalar()
+            results.append({
+                'storage': storage,
+                'index_mb': round(size / 2**20, 1),
+                'p50_ms': round(percentile(latencies, 0.5) * 1000, 2),
+                'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+                'recall_at_k': round(recall(found, truth), 4),
+            })
+
+        DocumentChunk.query.filter_by(session_id=session.id).delete()
+        purge_unused_contents()
+        DBDocument.query.filter_by(session_id=session.id).delete()
+        db.session.delete(session)
+        db.session.commit()
+        with engine.connect() as connection:
+            for name in created:
+                connection.execute(text(f"DROP INDEX IF EXISTS {name}"))
+        return {'pgvector': '.'.join(map(str, version)), 'results': results}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--vectors', type=int, default=20000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--clusters', type=int, default=200)
+    parser.add_argument('--k', type=int, default=15)
+    parser.add_argument('--postgres', action='store_true', help="Also measure the pgvector engine (DATABASE_URL)")
+    args = parser.parse_args()
+
+    vectors = synthetic_embeddings(args.vectors, args.clusters, seed=3)
+    # Queries are perturbed chunks, so every query has a clear neighbourhood
+    rng = np.random.default_rng(5)
+    queries = vectors[rng.choice(len(vectors), args.queries, replace=False)] + 0.05 * rng.normal(size=(args.queries, DIM))
+    queries = (queries / np.linalg.norm(queries, axis=1, keepdims=True)).astype('float32')
+    truth = [top_k(vectors @ query, args.k) for query in queries]
+
+    report = {
+        'vectors': args.vectors, 'queries': args.queries, 'k': args.k,
+        'quantization': simulate(vectors, queries, truth, args.k, factors=[1, 2, 4, 8]),
+        'faiss_cache': bench_faiss(vectors, queries, truth, args.k),
+    }
+    if args.postgres:
+        report['pgvector'] = bench_postgres(vectors, queries, truth, args.k)
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
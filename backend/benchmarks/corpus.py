@@ -0,0 +1,138 @@
+# Synthetic documents for the benchmarks
+import random
+import unicodedata
+
+WORDS = (
+    "quy trình vận hành hệ thống rủi ro tuân thủ nhà cung cấp phần cứng phần mềm chính sách "
+    "điều khoản hợp đồng bảo mật dữ liệu kiểm soát truy cập báo cáo sự cố "
+    "compliance vendor hardware software policy clause contract security incident access control"
+).split()
+
+def sentences(count, seed=0):
+    rng = random.Random(seed)
+    for i in range(count):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(8, 20))]
+        yield f"Điều {i + 1}. " + ' '.join(words).capitalize() + '.'
+
+def paragraphs(count, sentences_per_paragraph=5, seed=0):
+    items = list(sentences(count * sentences_per_paragraph, seed))
+    return [' '.join(items[i:i + sentences_per_paragraph]) for i in range(0, len(items), sentences_per_paragraph)]
+
+def _pdf_escape(text):
+    # Standard fonts have no Vietnamese glyphs; strip the diacritics so PyPDF2 reads the words back
+    decomposed = unicodedata.normalize('NFKD', text.replace('đ', 'd').replace('Đ', 'D'))
+    ascii_text = decomposed.encode('ascii', 'ignore').decode('ascii')
+    return ascii_text.replace('\\\\', '\\\\\\\\').replace('(', '\\\\(').replace(')', '\\\\)')
+
+def make_pdf(path, pages, lines_per_page=40, seed=0):
+    """Write a plain-text PDF (Helvetica, one content stream per page) without extra dependencies."""
+    lines = list(sentences(pages * lines_per_page, seed))
+    objects = {1: b"<< /Type /Catalog /Pages 2 0 R >>", 3: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"}
+    kids = []
+    next_id = 4
+    for page in range(pages):
+        page_lines = lines[page * lines_per_page:(page + 1) * lines_per_page]
+        content = "BT /F1 9 Tf 40 800 Td 11 TL\n" + ''.join(f"({_pdf_escape(line[:110])}) '\n" for line in page_lines) + "ET"
+        stream = content.encode('latin-1')
+        content_id, page_id = next_id, next_id + 1
+        next_id += 2
+        objects[content_id] = b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream"
+        objects[page_id] = (
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id
+        )
+        kids.append(page_id)
+    objects[2] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (' '.join(f"{k} 0 R" for k in kids).encode(), len(kids))
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = {}
+    for object_id in sorted(objects):
+        offsets[object_id] = len(out)
+        out += b"%d 0 obj\n" % object_id + objects[object_id] + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for object_id in sorted(objects):
+        out += b"%010d 00000 n \n" % offsets[object_id]
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, 'wb') as file:
+        file.write(bytes(out))
+    return path
+
+def make_docx(path, paragraph_count, seed=0):
+    from docx import Document
+    document = Document()
+    for i, paragraph in enumerate(paragraphs(paragraph_count, seed=seed)):
+        if i % 10 == 0:
+            document.add_heading(f"Chương {i // 10 + 1}", level=1)
+        document.add_paragraph(paragraph)
+    document.save(path)
+    return path
+
+def make_xlsx(path, rows, seed=0):
+    # One sentence per row next to an id and a number, spread over sheets of 500 rows
+    import openpyxl
+    workbook = openpyxl.Workbook(write_only=True)
+    rng = random.Random(seed)
+    sheet = None
+    for i, sentence in enumerate(sentences(rows, seed)):
+        if i % 500 == 0:
+            sheet = workbook.create_sheet(f"Sheet{i // 500 + 1}")
+            sheet.append(["Mã", "Nội dung", "Giá trị"])
+        sheet.append([f"SP-{rng.randint(1000, 9999)}", sentence, rng.randint(1, 100000)])
+    workbook.save(path)
+    return path
+
+def make_pptx(path, slides, bullets_per_slide=5, seed=0):
+    from pptx import Presentation
+    presentation = Presentation()
+    items = list(sentences(slides * bullets_per_slide, seed))
+    for i in range(slides):
+        slide = presentation.slides.add_slide(presentation.slide_layouts[1])
+        slide.shapes.title.text = f"Phần {i + 1}"
+        slide.placeholders[1].text = '\n'.join(items[i * bullets_per_slide:(i + 1) * bullets_per_slide])
+    presentation.save(path)
+    return path
+
+# Format -> (writer, sentences per unit the writer counts in)
+FORMATS = {
+    'pdf': (make_pdf, 40),
+    'docx': (make_docx, 5),
+    'xlsx': (make_xlsx, 1),
+    'pptx': (make_pptx, 5),
+}
+
+def make_corpus(directory, size, formats=tuple(FORMATS), seed=0):
+    """One file per format with about ``size`` sentences (of 8-20 words) each.
+
+    Each (format, size) gets its own seed, so no two files share chunks and
+    ingestion cannot skip any of them as already embedded.
+    """
+    paths = {}
+    for offset, name in enumerate(formats):
+        writer, per_unit = FORMATS[name]
+        path = f"{directory}/corpus_{size}.{name}"
+        writer(path, max(1, size // per_unit), seed=seed + size * len(FORMATS) + offset)
+        paths[name] = path
+    return paths
+
+# Filler the LLM tends to add around an answer (what clean_redundant strips)
+ANSWER_NOISE = (
+    "Xin chào! ", "Here is the response: ", "Tóm tắt thông tin bạn đang có: ", " Tôi hy vọng thông tin này hữu ích.",
+    " Nếu bạn cần thêm thông tin, hãy cho tôi biết.", " Tôi luôn sẵn lòng hỗ trợ bạn.", " | | ",
+    " Tuy nhiên, cần lưu ý thêm.", "<|eot_id|>|assistant Xin cảm ơn.",
+)
+
+def llm_answers(count, seed=0):
+    """Synthetic raw completions: sentences with repeats, greetings, closing phrases and chat-template leftovers."""
+    rng = random.Random(seed)
+    answers = []
+    for i in range(count):
+        body = list(sentences(rng.randint(2, 30), seed=seed * 1000 + i))
+        body += rng.sample(body, min(len(body), rng.randint(0, 3)))  # repeated sentences
+        noise = rng.sample(ANSWER_NOISE, rng.randint(0, 4))
+        text = ' '.join(body)
+        for piece in noise:
+            position = rng.choice((0, len(text)))
+            text = text[:position] + piece + text[position:]
+        answers.append((text, rng.choice(("Tài liệu nói gì?", body[0], "What does the document cover?"))))
+    return answers
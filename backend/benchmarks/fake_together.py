@@ -0,0 +1,130 @@
+# Local stand-in for the Together embeddings/completions API, used by the benchmarks
+import json
+import time
+import hashlib
+import re
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+EMBEDDING_DIM = 768
+
+def fake_embedding(text, dim=EMBEDDING_DIM):
+    # Deterministic unit vector derived from the text
+    seed = int.from_bytes(hashlib.sha1(text.encode('utf-8')).digest()[:8], 'big')
+    rng = random.Random(seed)
+    vector = [rng.gauss(0, 1) for _ in range(dim)]
+    norm = sum(v * v for v in vector) ** 0.5 or 1.0
+    return [v / norm for v in vector]
+
+def word_embedding(text, dim=EMBEDDING_DIM):
+    # Feature-hashed bag of words: related texts get close vectors, while numbers and
+    # codes are ignored the way dense models tend to blur exact identifiers
+    vector = [0.0] * dim
+    for word in re.findall(r'[^\W\d_]+', text.lower()):
+        digest = hashlib.sha1(word.encode('utf-8')).digest()
+        vector[int.from_bytes(digest[:4], 'big') % dim] += 1.0 if digest[4] & 1 else -1.0
+    norm = sum(v * v for v in vector) ** 0.5 or 1.0
+    return [v / norm for v in vector]
+
+class FakeTogetherHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream_completion(self, server):
+        # Server-sent events, one word per event, like the Together stream=True API
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        time.sleep(server.latency)
+        words = server.answer.split(' ')
+        for i, word in enumerate(words):
+            time.sleep(server.per_token_latency)
+            piece = word if i == 0 else ' ' + word
+            event = {'choices': [{'index': 0, 'text': piece, 'finish_reason': None}]}
+            self.wfile.write(f"data: {json.dumps(event)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def do_POST(self):
+        server = self.server
+        payload = self._read_json()
+        with server.lock:
+            server.request_count += 1
+        if self.path.rstrip('/').endswith('/embeddings'):
+            inputs = payload.get('input', [])
+            if isinstance(inputs, str):
+                inputs = [inputs]
+            time.sleep(server.latency + server.per_item_latency * len(inputs))
+            self._send_json({
+                'object': 'list',
+                'model': payload.get('model', ''),
+                'data': [
+                    {'object': 'embedding', 'index': i, 'embedding': server.embed(text, server.dim)}
+                    for i, text in enumerate(inputs)
+                ],
+            })
+        elif self.path.rstrip('/').endswith('/completions') and payload.get('stream'):
+            self._stream_completion(server)
+        elif self.path.rstrip('/').endswith('/completions'):
+            time.sleep(server.latency + server.per_token_latency * len(server.answer.split()))
+            self._send_json({
+                'id': 'fake',
+                'object': 'text_completion',
+                'model': payload.get('model', ''),
+                'choices': [{'index': 0, 'text': server.answer, 'finish_reason': 'stop'}],
+            })
+        else:
+            self._send_json({'error': 'not found'}, status=404)
+
+def start_server(host='127.0.0.1', port=0, latency=0.05, per_item_latency=0.002,
+                 per_token_latency=0.0, dim=EMBEDDING_DIM,
+                 answer="Tài liệu mô tả quy trình vận hành và quản lý rủi ro.", embedding="hash"):
+    server = ThreadingHTTPServer((host, port), FakeTogetherHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.per_item_latency = per_item_latency
+    server.per_token_latency = per_token_latency
+    server.dim = dim
+    server.embed = word_embedding if embedding == "words" else fake_embedding
+    server.answer = answer
+    server.request_count = 0
+    server.lock = threading.Lock()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+def base_url(server):
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}/v1/"
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run a fake Together API server")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--per-item-latency', type=float, default=0.002)
+    args = parser.parse_args()
+    server = start_server(port=args.port, latency=args.latency, per_item_latency=args.per_item_latency)
+    print(f"Fake Together API listening on {base_url(server)}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,168 @@
+# Golden outputs of answer post-processing: postprocessing.clean_answer against the regex pipeline it replaced
+#   cd backend && python -m benchmarks.golden_postprocess              (exit 1 on any difference)
+#   python -m benchmarks.golden_postprocess --fuzz 5000                 (also compare on generated answers)
+#   python -m benchmarks.golden_postprocess --update                    (rewrite golden/postprocess.json)
+# The expected outputs were produced by legacy_postprocess below (clean_redundant followed by
+# trim_to_last_sentence, as chat_service had them); the engine is also checked token by token.
+import os
+import re
+import sys
+import json
+import random
+import argparse
+from benchmarks.corpus import llm_answers
+
+GOLDEN_PATH = os.path.join(os.path.dirname(__file__), 'golden', 'postprocess.json')
+
+def legacy_clean_redundant(text, question):
+    text = re.split(r'\|\s*assistant', text)[0]
+    sentences = re.split(r'(?<=[.!?])\s+', text)
+    if sentences and sentences[0].strip() == question.strip():
+        text = ' '.join(sentences[1:])
+    patterns = [
+        r"(Tôi luôn sẵn.*?)(?=(Tôi luôn sẵn|Xin chào|Xin cảm ơn|$))",
+        r"Xin chào.*",
+        r"Xin cảm ơn.*",
+        r"Nếu bạn cần thêm.*",
+        r"Chúc bạn thành công.*",
+        r"Tôi hy vọng.*",
+        r"Tôi sẵn sàng.*",
+        r"Tôi luôn sẵn lòng.*",
+        r"Hãy cho tôi biết.*",
+        r"Tôi chúc bạn.*",
+        r"Tôi xin lỗi, nhưng.*?(?=\s|$)",
+        r"Tuy nhiên,.*?(?=\s|$)",
+        r"Nếu bạn cần.*?(?=\s|$)",
+        r"Hãy cho tôi biết.*?(?=\s|$)",
+        r"Here is the response:?\s*",
+        r"Here is the rewritten response:?\s*",
+        r"Tóm tắt thông tin bạn đang có:?\s*",
+        r"\|\s*\|",
+    ]
+    for p in patterns:
+        text = re.sub(p, '', text, flags=re.IGNORECASE)
+    seen = set()
+    unique_sentences = []
+    for sentence in re.split(r'(?<=[.!?])\s+', text):
+        if sentence not in seen:
+            seen.add(sentence)
+            unique_sentences.append(sentence)
+    return ' '.join(unique_sentences).strip()
+
+def legacy_trim_to_last_sentence(text, max_length=700):
+    sentences = re.split(r'(?<=[.!?])\s+', text)
+    result = ""
+    for s in sentences:
+        if len(result) + len(s) > max_length:
+            break
+        result += s + " "
+    result = result.strip()
+    if result:
+        result = result.rstrip('.!?') + '.'
+    if result:
+        result = result[0].upper() + result[1:]
+    return result
+
+def legacy_postprocess(text, question, max_length=700):
+    return legacy_trim_to_last_sentence(legacy_clean_redundant(text, question), max_length)
+
+# Hand-written cases for every rule and the ways they interact (the rest of the file is generated)
+CASES = [
+    ("Tài liệu mô tả quy trình vận hành. Xin chào bạn!", "Tài liệu nói gì?"),
+    ("Xin chào! Tài liệu mô tả quy trình vận hành.\nNó gồm ba bước.", "Tài liệu nói gì?"),
+    ("Tài liệu nói gì? Tài liệu mô tả quy trình. Xin chào bạn.\nNó gồm ba bước.", "Tài liệu nói gì?"),
+    ("Tài liệu nói gì?\nXin chào.\nNó gồm ba bước.", "Tài liệu nói gì?"),
+    ("Quy trình có ba bước. Quy trình có ba bước. Bước một là lập kế hoạch.", "Quy trình?"),
+    ("Here is the response: the policy covers access control. Here is the rewritten response the end!", "What?"),
+    ("Tóm tắt thông tin bạn đang có: hợp đồng gồm 5 điều khoản.", "Tóm tắt"),
+    ("Here is the response\n\nXin chào bạn.\n Điều 1.  Tuy nhiên,\nĐiều 1.  Hết\n", "Điều 1?"),
+    ("Tóm tắt thông tin bạn đang có Tuy nhiên,vâng.\n\nĐiều 2 có hiệu lực. Điều 2 có hiệu lực.", "Điều 2?"),
+    ("Tuy nhiên, tài liệu không nói về giá. Tôi xin lỗi, nhưng không có thông tin.", "Giá bao nhiêu?"),
+    ("Nếu bạn cần thêm thông tin, hãy hỏi. Điều 1 quy định phạm vi.", "Điều 1?"),
+    ("Nếu bạn cần, tôi sẽ giải thích. Điều 2 quy định đối tượng.", "Điều 2?"),
+    ("Điều 3 quy định trách nhiệm.<|eot_id|>|assistant Xin cảm ơn. Điều 4.", "Điều 3?"),
+    ("Điều 3 quy định trách nhiệm. | assistant\nĐiều 4 quy định quyền.", "Điều 3?"),
+    ("| Cột A | | Cột B |\n| --- | --- |\nGiá trị | | 12.", "Bảng?"),
+    ("Câu trả lời ngắn!!! Thêm một câu nữa???", "?"),
+    ("tài liệu bắt đầu bằng chữ thường. đây là câu thứ hai.", "Tài liệu?"),
+    ("Tôi hy vọng điều này hữu ích. Tôi chúc bạn một ngày tốt lành.", "Cảm ơn"),
+    ("Chúc bạn thành công!\nĐiều 5 quy định hiệu lực.", "Điều 5?"),
+    ("Hãy cho tôi biết nếu cần. Tôi sẵn sàng hỗ trợ.\nHết.", "?"),
+    ("Điều 6 quy định xử phạt. Tôi luôn sẵn lòng giúp đỡ. Xin cảm ơn!", "Điều 6?"),
+    ("Điều 7. Tôi luôn sẵn sàng hỗ trợ bạn. Xin chào.", "Điều 7?"),
+    ("XIN CHÀO các bạn. TUY NHIÊN, điều này đúng.\nhere is the response: ok.", "Chào?"),
+    ("", "Tài liệu nói gì?"),
+    ("   ", "Tài liệu nói gì?"),
+    ("Tài liệu nói gì?", "Tài liệu nói gì?"),
+    ("Một câu không có dấu chấm cuối", "?"),
+    ("Câu một.\n\n\nCâu hai.\tCâu ba.  ", "?"),
+    ("  Câu có khoảng trắng đầu. Câu có khoảng trắng đầu. Hết.", "?"),
+    ("A. " + "Đây là một câu dài về quy trình vận hành hệ thống thông tin. " * 12, "?"),
+    ("Câu " + "rất " * 200 + "dài. Câu ngắn.", "?"),
+    ("Intro dòng một Xin chào phần còn lại.\nDòng hai.", "?"),
+    ("Trước. Xin chào sau. Vẫn dòng này.\nDòng mới. Nữa.", "?"),
+    ("Kết thúc bằng dấu chấm...", "?"),
+    ("ßtraße beginnt klein. Zweiter Satz.", "?"),
+]
+
+def engine_outputs(text, question):
+    # (whole string, token by token): both must give the same answer
+    from postprocessing import AnswerCleaner, clean_answer
+    whole = clean_answer(text, question, max_length=700)
+    cleaner = AnswerCleaner(question, max_length=700)
+    streamed = []
+    rng = random.Random(len(text))
+    position = 0
+    while position < len(text):
+        size = rng.randint(1, 8)
+        streamed += cleaner.feed(text[position:position + size])
+        position += size
+    streamed += cleaner.finish()
+    return whole, cleaner.result(), ''.join(streamed).strip()
+
+def check(cases):
+    failures = []
+    for case in cases:
+        whole, incremental, streamed = engine_outputs(case['text'], case['question'])
+        expected = case['expected']
+        # Streamed sentences are the final answer without its end-of-answer punctuation fix-up
+        streamed_ok = streamed.rstrip('.!?') == expected.rstrip('.!?') or (not streamed and not expected)
+        if whole != expected or incremental != expected or not streamed_ok:
+            failures.append({**case, 'whole': whole, 'incremental': incremental, 'streamed': streamed})
+    return failures
+
+def generated_cases(count, seed):
+    return [{'text': text, 'question': question} for text, question in llm_answers(count, seed=seed)]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--update', action='store_true', help="Regenerate the golden file from legacy_postprocess")
+    parser.add_argument('--generated', type=int, default=40, help="Generated answers stored in the golden file")
+    parser.add_argument('--fuzz', type=int, default=0, help="Extra generated answers compared with legacy_postprocess")
+    args = parser.parse_args()
+
+    if args.update:
+        cases = [{'text': text, 'question': question} for text, question in CASES] + generated_cases(args.generated, 7)
+        for case in cases:
+            case['expected'] = legacy_postprocess(case['text'], case['question'])
+        os.makedirs(os.path.dirname(GOLDEN_PATH), exist_ok=True)
+        with open(GOLDEN_PATH, 'w') as file:
+            json.dump(cases, file, ensure_ascii=False, indent=1)
+            file.write('\n')
+    with open(GOLDEN_PATH) as file:
+        cases = json.load(file)
+    failures = check(cases)
+    report = {'golden_cases': len(cases), 'golden_failures': len(failures)}
+    if args.fuzz:
+        fuzz = generated_cases(args.fuzz, 1000)
+        for case in fuzz:
+            case['expected'] = legacy_postprocess(case['text'], case['question'])
+        fuzz_failures = check(fuzz)
+        report.update(fuzz_cases=len(fuzz), fuzz_failures=len(fuzz_failures))
+        failures += fuzz_failures
+    report['failures'] = failures[:10]
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+# Cold-start check: time `import app` with python -X importtime and fail when it goes over budget
+#   cd backend && python -m benchmarks.import_budget --budget-ms 3000
+# Also fails when a module that should load on first use (parsers, FAISS, the Together/openai
+# clients, ...) is imported with the app. Exits 1 on either failure, so CI can run it as is.
+import os
+import re
+import sys
+import json
+import argparse
+import subprocess
+from collections import defaultdict
+
+# Loaded by the extractor, retrieval engine or provider client that needs them
+DEFERRED_MODULES = (
+    'PyPDF2', 'openpyxl', 'docx', 'pptx', 'pyheif', 'trafilatura', 'PIL', 'pytesseract',
+    'faiss', 'langchain_community', 'langchain_text_splitters', 'langchain_together',
+    'langchain_openai', 'openai', 'aiohttp', 'torch', 'transformers',
+)
+IMPORT_BUDGET_MS = float(os.getenv("IMPORT_BUDGET_MS", "3000"))
+
+LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)")
+PROBE = "import sys, json, {module}; print(json.dumps([m for m in {modules!r} if m in sys.modules]))"
+
+def measure(module):
+    # One fresh interpreter: (cumulative ms of the module, self ms per top-level package, deferred modules loaded)
+    env = dict(os.environ)
+    # Creating the app needs a database URL but does not connect to it
+    env.setdefault('DATABASE_URL', 'postgresql://localhost/import_budget')
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', PROBE.format(module=module, modules=DEFERRED_MODULES)],
+        capture_output=True, text=True, env=env,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+    total, packages = None, defaultdict(int)
+    for line in result.stderr.splitlines():
+        match = LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, name = match.groups()
+        packages[name.split('.')[0]] += int(self_us)
+        if not indent and name == module:
+            total = int(cumulative_us) / 1000
+    return total, {name: us / 1000 for name, us in packages.items()}, json.loads(result.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--module', default='app')
+    parser.add_argument('--budget-ms', type=float, default=IMPORT_BUDGET_MS)
+    parser.add_argument('--runs', type=int, default=3, help="Best of N cold imports (filters out noise)")
+    parser.add_argument('--top', type=int, default=10, help="Slowest packages to list")
+    args = parser.parse_args()
+
+    runs = [measure(args.module) for _ in range(max(1, args.runs))]
+    total, packages, loaded = min(runs, key=lambda run: run[0])
+    report = {
+        'module': args.module,
+        'import_ms': round(total, 1),
+        'budget_ms': args.budget_ms,
+        'runs_ms': [round(run[0], 1) for run in runs],
+        'slowest_packages_ms': {name: round(ms, 1) for name, ms in
+                                sorted(packages.items(), key=lambda item: -item[1])[:args.top]},
+        'deferred_modules_loaded': loaded,
+        'ok': total <= args.budget_ms and not loaded,
+    }
+    print(json.dumps(report, indent=2))
+    sys.exit(0 if report['ok'] else 1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+# Concurrent /ask throughput against stubbed LLM/embedding APIs
+#   cd backend && DATABASE_URL=postgresql://... python -m benchmarks.load_test --server single,threaded
+#   python -m benchmarks.load_test --url http://127.0.0.1:5000 --fake-port 8765   (gunicorn)
+# "single" serves one request at a time like a one-worker sync deployment, "threaded" one thread per
+# request like a gthread worker. For --url, start the server with TOGETHER_API_BASE pointing at the
+# fake API (http://127.0.0.1:<fake-port>/v1/), ANSWER_CACHE_ENABLED=false and SUMMARIES_ENABLED=false.
+import io
+import os
+import json
+import time
+import argparse
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from benchmarks.fake_together import start_server, base_url
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else None
+
+def sample_docx():
+    from docx import Document
+    document = Document()
+    for i in range(60):
+        document.add_paragraph(f"Điều {i}. Quy định về vận hành hệ thống số {i} và quản lý rủi ro liên quan. " * 3)
+    buffer = io.BytesIO()
+    document.save(buffer)
+    buffer.seek(0)
+    return buffer
+
+def prepare(url):
+    # One session with one ingested document to ask about
+    session_id = requests.post(f"{url}/sessions", json={'name': 'load test'}).json()['id']
+    upload = requests.post(f"{url}/sessions/{session_id}/upload",
+                           files={'file': ('load_test.docx', sample_docx())}).json()
+    for _ in range(600):
+        job = requests.get(f"{url}/jobs/{upload['job_id']}").json()
+        if job['status'] in ('done', 'failed'):
+            break
+        time.sleep(0.1)
+    if job['status'] != 'done':
+        raise RuntimeError(f"Ingestion failed: {job.get('error')}")
+    return session_id, upload['id']
+
+def run_load(url, session_id, file_id, clients, total, stream):
+    path = f"{url}/sessions/{session_id}/ask" + ("/stream" if stream else "")
+    local = threading.local()
+
+    def ask(i):
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        # Distinct questions, so neither coalescing nor the caches short-circuit the pipeline
+        question = f"Quy định số {i} về vận hành hệ thống là gì?"
+        start = time.perf_counter()
+        response = local.session.post(path, json={'question': question, 'file_ids': [file_id]})
+        response.content
+        return response.status_code, time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        results = list(executor.map(ask, range(total)))
+    elapsed = time.perf_counter() - start
+    latencies = [seconds for status, seconds in results if status == 200]
+    return {
+        'clients': clients,
+        'requests': total,
+        'seconds': round(elapsed, 2),
+        'throughput_rps': round(len(latencies) / elapsed, 2),
+        'p50_ms': round(percentile(latencies, 0.5) * 1000) if latencies else None,
+        'p95_ms': round(percentile(latencies, 0.95) * 1000) if latencies else None,
+        'status': dict(Counter(status for status, _ in results)),
+    }
+
+def serve(app, threaded):
+    import logging
+    from werkzeug.serving import make_server
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, app, threaded=threaded)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--server', default='single,threaded', help="In-process servers to compare")
+    parser.add_argument('--url', help="Load an already running server instead")
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--requests', type=int, default=128)
+    parser.add_argument('--llm-latency', type=float, default=0.5, help="Seconds per fake API call")
+    parser.add_argument('--fake-port', type=int, default=0)
+    parser.add_argument('--stream', action='store_true', help="Load /ask/stream instead of /ask")
+    args = parser.parse_args()
+
+    fake = start_server(port=args.fake_port, latency=args.llm_latency, per_item_latency=0.0)
+    report = {'llm_latency': args.llm_latency, 'endpoint': '/ask/stream' if args.stream else '/ask', 'runs': {}}
+    if args.url:
+        report['fake_api'] = base_url(fake)
+        session_id, file_id = prepare(args.url)
+        report['runs']['external'] = run_load(args.url, session_id, file_id, args.clients, args.requests, args.stream)
+    else:
+        os.environ['TOGETHER_API_BASE'] = base_url(fake)
+        os.environ.setdefault('TOGETHER_AI_API_KEY', 'fake-key')
+        os.environ['ANSWER_CACHE_ENABLED'] = 'false'
+        os.environ['SUMMARIES_ENABLED'] = 'false'
+        # Admission control is measured separately; do not let it cap the comparison
+        os.environ.setdefault('LLM_MAX_IN_FLIGHT', '0')
+        os.environ.setdefault('EMBED_MAX_IN_FLIGHT', '0')
+        from app import app
+        for mode in args.server.split(','):
+            server, url = serve(app, threaded=(mode == 'threaded'))
+            session_id, file_id = prepare(url)
+            report['runs'][mode] = run_load(url, session_id, file_id, args.clients, args.requests, args.stream)
+            requests.delete(f"{url}/sessions/{session_id}")
+            server.shutdown()
+    fake.shutdown()
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,282 @@
+# Refresh safety checks against Postgres and the fake Together server
+#   cd backend && DATABASE_URL=postgresql://... python -m benchmarks.refresh_check
+# A link is ingested from a local page server, then refreshed while the page is down, answers
+# with an error status or has no main text; a file is replaced by one that cannot be parsed and
+# a workbook by one whose second sheet is cut off (extraction fails after the first sheet).
+# Each refresh job must fail and leave the stored chunks, content hash, file name and path and
+# 'ready' status as they were. A second refresh while one is queued must be refused (409). Then
+# one paragraph of a document is edited: after the refresh its chunks must still be in document
+# order and context packing must not join the edited chunk to another one. Once the edit is
+# reverted, no chunk content may be left without a chunk.
+# Exits 1 on any failure.
+import io
+import os
+import sys
+import json
+import time
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from benchmarks.fake_together import start_server, base_url
+
+PARAGRAPHS = 60
+
+def page_body(version):
+    paragraphs = ''.join(
+        f"<p>Điều {i}. Quy định số {i} về vận hành hệ thống, phiên bản {version}, và quản lý rủi ro liên quan "
+        f"đến dữ liệu khách hàng, nhật ký truy cập và sao lưu định kỳ của phòng ban số {i}.</p>"
+        for i in range(PARAGRAPHS)
+    )
+    return f"<html><body><article>{paragraphs}</article></body></html>"
+
+class PageHandler(BaseHTTPRequestHandler):
+    # Serves self.server.page = {'status': ..., 'body': ...}; status None drops the connection
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        page = self.server.page
+        if page['status'] is None:
+            self.close_connection = True
+            self.connection.close()
+            return
+        data = page['body'].encode('utf-8')
+        self.send_response(page['status'])
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+def start_page_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), PageHandler)
+    server.daemon_threads = True
+    server.page = {'status': 200, 'body': page_body(1)}
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def wait_for_job(client, job_id, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.get(f'/jobs/{job_id}').get_json()
+        if job['status'] in ('done', 'failed'):
+            return job
+        time.sleep(0.05)
+    raise TimeoutError(f"Job {job_id} did not finish")
+
+def source_state(app, model, source_id):
+    from database import db
+    from models import DocumentChunk
+    column = 'document_id' if model.__name__ == 'DBDocument' else 'link_id'
+    with app.app_context():
+        source = db.session.get(model, source_id)
+        chunk_ids = sorted(row.id for row in DocumentChunk.query.filter_by(**{column: source_id}))
+        state = {'status': source.status, 'content_hash': source.content_hash, 'chunk_ids': chunk_ids}
+        if column == 'document_id':
+            state.update(filename=source.filename, filepath=source.filepath,
+                         file_exists=os.path.exists(source.filepath))
+        return state
+
+def sample_docx(edited=None):
+    from docx import Document
+    document = Document()
+    for i in range(PARAGRAPHS):
+        if i == edited:
+            document.add_paragraph(f"Điều {i}. Nội dung đã sửa đổi hoàn toàn, phiên bản mới của điều {i}. " * 3)
+        else:
+            document.add_paragraph(f"Điều {i}. Quy định số {i} về vận hành hệ thống và quản lý rủi ro liên quan. " * 3)
+    buffer = io.BytesIO()
+    document.save(buffer)
+    buffer.seek(0)
+    return buffer
+
+def sample_xlsx(truncated=False):
+    # Two sheets; truncated cuts the second sheet's XML in half, so reading it fails midway
+    import zipfile
+    import openpyxl
+    workbook = openpyxl.Workbook()
+    for sheet, title in ((workbook.active, "Điều"), (workbook.create_sheet("b"), "Mục")):
+        for i in range(PARAGRAPHS):
+            sheet.append([f"{title} {i}", f"Quy định số {i} về vận hành hệ thống và quản lý rủi ro liên quan. " * 3])
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    if not truncated:
+        buffer.seek(0)
+        return buffer
+    source = zipfile.ZipFile(io.BytesIO(buffer.getvalue()))
+    output = io.BytesIO()
+    with zipfile.ZipFile(output, 'w') as archive:
+        for item in source.infolist():
+            data = source.read(item.filename)
+            if item.filename == 'xl/worksheets/sheet2.xml':
+                data = data[:len(data) // 2]
+            archive.writestr(item, data)
+    output.seek(0)
+    return output
+
+def compare_state(name, job, before, after, results, failures):
+    results[name] = {'job': job['status'], 'source': after['status'], 'chunks': len(after['chunk_ids'])}
+    if job['status'] != 'failed':
+        failures.append(f"{name}: refresh job {job['status']}, expected failed")
+    if after != before:
+        failures.append(f"{name}: source changed from {len(before['chunk_ids'])} chunks to "
+                        f"{len(after['chunk_ids'])} ({after['status']})")
+
+def check_failed_refreshes(app, client, session_id, page_server):
+    from models import DBDocument, Link
+    url = f"http://127.0.0.1:{page_server.server_port}/page"
+    added = client.post(f'/sessions/{session_id}/links', json={'url': url}).get_json()
+    job = wait_for_job(client, added['job_id'])
+    before = source_state(app, Link, added['id'])
+    results = {'ingest': {'status': job['status'], 'chunks': len(before['chunk_ids'])}}
+    failures = []
+    if job['status'] != 'done' or not before['chunk_ids']:
+        return results, [f"ingest: {job['status']} with {len(before['chunk_ids'])} chunks"]
+
+    for name, status, body in (
+        ('connection_error', None, ''),
+        ('http_500', 500, page_body(2)),
+        ('http_404', 404, ''),
+        ('no_main_text', 200, '<html><body></body></html>'),
+    ):
+        page_server.page = {'status': status, 'body': body}
+        refresh = client.post(f"/sessions/{session_id}/links/{added['id']}/refresh").get_json()
+        job = wait_for_job(client, refresh['job_id'])
+        compare_state(name, job, before, source_state(app, Link, added['id']), results, failures)
+    page_server.page = {'status': 200, 'body': page_body(1)}
+
+    uploaded = client.post(f'/sessions/{session_id}/upload', data={'file': (sample_docx(), 'check.docx')},
+                           content_type='multipart/form-data').get_json()
+    job = wait_for_job(client, uploaded['job_id'])
+    before = source_state(app, DBDocument, uploaded['id'])
+    if job['status'] != 'done' or not before['chunk_ids']:
+        failures.append(f"upload: {job['status']} with {len(before['chunk_ids'])} chunks")
+        return results, failures
+    # Bytes the docx parser rejects, under a new name: the extractor logs the error and yields nothing
+    replaced = client.put(f"/sessions/{session_id}/files/{uploaded['id']}",
+                          data={'file': (io.BytesIO(b'not a docx file'), 'broken.docx')},
+                          content_type='multipart/form-data').get_json()
+    job = wait_for_job(client, replaced['job_id'])
+    after = source_state(app, DBDocument, uploaded['id'])
+    # The stored hash, name and file still describe the indexed version, not the unreadable upload
+    compare_state('unreadable_file', job, before, after, results, failures)
+
+    uploaded = client.post(f'/sessions/{session_id}/upload', data={'file': (sample_xlsx(), 'check.xlsx')},
+                           content_type='multipart/form-data').get_json()
+    job = wait_for_job(client, uploaded['job_id'])
+    before = source_state(app, DBDocument, uploaded['id'])
+    if job['status'] != 'done' or not before['chunk_ids']:
+        failures.append(f"xlsx upload: {job['status']} with {len(before['chunk_ids'])} chunks")
+        return results, failures
+    replaced = client.put(f"/sessions/{session_id}/files/{uploaded['id']}",
+                          data={'file': (sample_xlsx(truncated=True), 'check.xlsx')},
+                          content_type='multipart/form-data').get_json()
+    job = wait_for_job(client, replaced['job_id'])
+    compare_state('truncated_file', job, before, source_state(app, DBDocument, uploaded['id']), results, failures)
+    return results, failures
+
+def check_queued_refresh(app, client, session_id):
+    # A running refresh job (inserted directly, so no worker finishes it first) blocks another one
+    from database import db
+    from models import DBDocument, Link, IngestionJob
+    statuses = {}
+    failures = []
+    with app.app_context():
+        for model, kind in ((DBDocument, 'file'), (Link, 'link')):
+            source = model.query.filter_by(session_id=session_id, status='ready').first()
+            job = IngestionJob(session_id=session_id, source='check', source_type=kind, kind='refresh', status='running',
+                               **{'document_id' if kind == 'file' else 'link_id': source.id})
+            db.session.add(job)
+            db.session.commit()
+            if kind == 'file':
+                response = client.put(f"/sessions/{session_id}/files/{source.id}",
+                                      data={'file': (sample_docx(PARAGRAPHS // 2), 'check.docx')},
+                                      content_type='multipart/form-data')
+            else:
+                response = client.post(f"/sessions/{session_id}/links/{source.id}/refresh")
+            statuses[kind] = response.status_code
+            if response.status_code != 409:
+                failures.append(f"{kind}: second refresh answered {response.status_code}, expected 409")
+            db.session.delete(job)
+            db.session.commit()
+    return statuses, failures
+
+def check_edited_order(app, client, session_id):
+    import re
+    from database import db
+    from sqlalchemy import select, exists
+    from models import DocumentChunk, ChunkContent
+    from context_packing import merge_adjacent
+    from chat_service import chunk_metadata
+    from langchain_core.documents import Document as LangchainDocument
+    uploaded = client.post(f'/sessions/{session_id}/upload', data={'file': (sample_docx(), 'order.docx')},
+                           content_type='multipart/form-data').get_json()
+    wait_for_job(client, uploaded['job_id'])
+    edited = PARAGRAPHS // 3
+    replaced = client.put(f"/sessions/{session_id}/files/{uploaded['id']}",
+                          data={'file': (sample_docx(edited), 'order.docx')},
+                          content_type='multipart/form-data').get_json()
+    job = wait_for_job(client, replaced['job_id'])
+    failures = []
+    if job['status'] != 'done':
+        return {'job': job['status']}, [f"edit: refresh job {job['status']}"]
+    with app.app_context():
+        rows = db.session.execute(
+            select(DocumentChunk.id, DocumentChunk.position, ChunkContent.chunk_text, ChunkContent.terms)
+            .join(ChunkContent, ChunkContent.id == DocumentChunk.content_id)
+            .where(DocumentChunk.document_id == uploaded['id'])
+            .order_by(DocumentChunk.position)
+        ).all()
+    # The first article number of each chunk must not go down in position order
+    numbers = [int(re.search(r'Điều (\d+)', row.chunk_text).group(1)) for row in rows]
+    positions = [row.position for row in rows]
+    if positions != list(range(len(rows))):
+        failures.append(f"edit: positions are {positions}")
+    if numbers != sorted(numbers):
+        failures.append(f"edit: chunks out of document order: {numbers}")
+    # The first chunk the refresh inserted has the id after the last chunk's, but they are not neighbours
+    inserted = min((row for row in rows if row.id > rows[-1].id), key=lambda row: row.id)
+    matches = [
+        LangchainDocument(page_content=row.chunk_text,
+                          metadata=chunk_metadata(uploaded['id'], None, row.id, row.terms, row.position))
+        for row in (inserted, rows[-1])
+    ]
+    passages = merge_adjacent(matches)
+    if len(passages) != 2:
+        failures.append("edit: the edited chunk was merged with the end of the document")
+    # Revert the edit: the edited chunks were only used by this document
+    reverted = client.put(f"/sessions/{session_id}/files/{uploaded['id']}",
+                          data={'file': (sample_docx(), 'order.docx')},
+                          content_type='multipart/form-data').get_json()
+    wait_for_job(client, reverted['job_id'])
+    with app.app_context():
+        orphans = ChunkContent.query.filter(~exists().where(DocumentChunk.content_id == ChunkContent.id)).count()
+    if orphans:
+        failures.append(f"edit: {orphans} chunk contents left without a chunk")
+    return {'job': job['status'], 'chunks': len(rows), 'passages': len(passages), 'orphan_contents': orphans}, failures
+
+def main():
+    fake = start_server(latency=0.0, per_item_latency=0.0, embedding="words")
+    os.environ['TOGETHER_API_BASE'] = base_url(fake)
+    os.environ.setdefault('TOGETHER_AI_API_KEY', 'fake-key')
+    os.environ['SUMMARIES_ENABLED'] = 'false'
+    page_server = start_page_server()
+    from app import app
+    client = app.test_client()
+    with tempfile.TemporaryDirectory() as directory:
+        app.config['UPLOAD_FOLDER'] = directory
+        session_id = client.post('/sessions', json={'name': 'refresh_check'}).get_json()['id']
+        try:
+            results, failures = check_failed_refreshes(app, client, session_id, page_server)
+            results['queued_refresh'], queued_failures = check_queued_refresh(app, client, session_id)
+            failures += queued_failures
+            results['edited_order'], order_failures = check_edited_order(app, client, session_id)
+            failures += order_failures
+        finally:
+            client.delete(f'/sessions/{session_id}')
+    page_server.shutdown()
+    fake.shutdown()
+    print(json.dumps({'results': results, 'failures': failures}, indent=2, ensure_ascii=False))
+    sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
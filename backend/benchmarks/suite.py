@@ -0,0 +1,210 @@
+# End-to-end benchmarks against the fake Together server, as one JSON report per run
+#   cd backend && DATABASE_URL=postgresql://... python -m benchmarks.suite --sizes 200,1000 --output run.json
+#   python -m benchmarks.suite --baseline run.json     (compares with an earlier report, exit 1 on --fail-on-regression)
+# Per corpus size it times ingestion (process_and_store_chunks per format), retrieval and chatbot(),
+# and the /ask route; postprocessing (benchmarks.bench_postprocess) is timed once.
+# Needs Postgres with pgvector and the migrations applied; everything the suite creates is deleted afterwards.
+import os
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+from benchmarks.corpus import WORDS, FORMATS, make_corpus, llm_answers
+from benchmarks.fake_together import start_server, base_url
+
+BENCHMARKS = ('postprocess', 'ingest', 'retrieval', 'ask')
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def latency_summary(seconds):
+    return {
+        'count': len(seconds),
+        'mean_ms': round(sum(seconds) / len(seconds) * 1000, 2),
+        'p50_ms': round(percentile(seconds, 0.5) * 1000, 2),
+        'p95_ms': round(percentile(seconds, 0.95) * 1000, 2),
+    }
+
+def stage_ms(trace):
+    return {name: round(seconds * 1000, 1) for name, seconds in sorted(trace.stages.items())}
+
+def questions(count, seed):
+    rng = random.Random(seed)
+    return [f"Điều {rng.randint(1, 200)} quy định gì về {rng.choice(WORDS)} {rng.choice(WORDS)}? #{i}" for i in range(count)]
+
+def bench_postprocess(count, repeat):
+    from benchmarks.bench_postprocess import measure
+    answers = llm_answers(count, seed=1)
+    return {'answers': len(answers), 'mean_chars': round(sum(len(text) for text, _ in answers) / len(answers)),
+            'best_of': repeat, **measure(answers, repeat)}
+
+def bench_ingest(session_id, paths):
+    import metrics
+    from database import db
+    from models import DBDocument
+    from process_documents import process_and_store_chunks
+    results, document_ids = {}, []
+    for name, path in paths.items():
+        document = DBDocument(session_id=session_id, filename=os.path.basename(path), filepath=path)
+        db.session.add(document)
+        db.session.commit()
+        trace = metrics.start_trace(f"ingest {name}")
+        chunks = process_and_store_chunks(path, 'file', session_id, document_id=document.id)
+        seconds = metrics.finish_trace(trace, threshold=0)
+        document.status = 'ready'
+        db.session.commit()
+        document_ids.append(document.id)
+        results[name] = {
+            'bytes': os.path.getsize(path),
+            'chunks': chunks,
+            'seconds': round(seconds, 3),
+            'chunks_per_sec': round(chunks / seconds, 1) if seconds else None,
+            'stages_ms': stage_ms(trace),
+        }
+    return results, document_ids
+
+def bench_retrieval(session_id, file_ids, asked):
+    import metrics
+    import chat_service
+    from database import db
+    retrieve, chatbot, stages = [], [], {}
+    for question in asked:
+        start = time.perf_counter()
+        chat_service.retrieve(question, session_id, file_ids, [])
+        retrieve.append(time.perf_counter() - start)
+        db.session.commit()
+    for question in asked:
+        trace = metrics.start_trace("chatbot")
+        chat_service.chatbot(question + " (chatbot)", session_id, file_ids, [])
+        chatbot.append(metrics.finish_trace(trace, threshold=0))
+        for name, seconds in trace.stages.items():
+            stages[name] = stages.get(name, 0.0) + seconds
+        db.session.commit()
+    return {
+        'engine': chat_service.RETRIEVAL_ENGINE,
+        'retrieve': latency_summary(retrieve),
+        'chatbot': latency_summary(chatbot),
+        'chatbot_stages_mean_ms': {name: round(seconds / len(asked) * 1000, 2) for name, seconds in sorted(stages.items())},
+    }
+
+def bench_ask(client, session_id, file_ids, asked):
+    seconds, statuses = [], {}
+    for question in asked:
+        start = time.perf_counter()
+        response = client.post(f'/sessions/{session_id}/ask', json={'question': question + " (ask)", 'file_ids': file_ids})
+        seconds.append(time.perf_counter() - start)
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+    return {**latency_summary(seconds), 'status': statuses}
+
+def flatten(report, prefix=''):
+    for key, value in report.items():
+        path = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            yield from flatten(value, path)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield path, value
+
+def compare(report, baseline, tolerance):
+    # Timings that got slower (or throughputs that dropped) by more than ``tolerance`` against the baseline
+    old = dict(flatten(baseline['results']))
+    changes, regressions = {}, []
+    for path, value in flatten(report['results']):
+        lower_is_better = path.endswith(('_ms', 'seconds', 'us_per_answer'))
+        if not (lower_is_better or path.endswith('_per_sec')) or not old.get(path):
+            continue
+        ratio = value / old[path]
+        changes[path] = round(ratio, 3)
+        if (ratio > 1 + tolerance) if lower_is_better else (ratio < 1 - tolerance):
+            regressions.append(path)
+    return {'baseline': baseline.get('started'), 'tolerance': tolerance, 'ratios': changes, 'regressions': regressions}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='200,1000', help="Corpus sizes in sentences per file")
+    parser.add_argument('--formats', default=','.join(FORMATS))
+    parser.add_argument('--benchmarks', default=','.join(BENCHMARKS))
+    parser.add_argument('--questions', type=int, default=20, help="Questions per size for retrieval and /ask")
+    parser.add_argument('--answers', type=int, default=500, help="Synthetic completions for postprocessing")
+    parser.add_argument('--repeat', type=int, default=5, help="Postprocessing: best of N passes")
+    parser.add_argument('--engine', help="RETRIEVAL_ENGINE to benchmark (default: the configured one)")
+    parser.add_argument('--llm-latency', type=float, default=0.05, help="Seconds per fake API call")
+    parser.add_argument('--per-item-latency', type=float, default=0.0005, help="Extra seconds per embedded text")
+    parser.add_argument('--output', help="Also write the report to this file")
+    parser.add_argument('--baseline', help="Earlier report to compare with")
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--fail-on-regression', action='store_true')
+    args = parser.parse_args()
+    benchmarks = set(args.benchmarks.split(','))
+    sizes = [int(size) for size in args.sizes.split(',')]
+    formats = args.formats.split(',')
+
+    server = start_server(latency=args.llm_latency, per_item_latency=args.per_item_latency, embedding="words")
+    os.environ['TOGETHER_API_BASE'] = base_url(server)
+    os.environ.setdefault('TOGETHER_AI_API_KEY', 'fake-key')
+    # Every question goes through the whole pipeline: no cached or summary answers, no admission queueing
+    os.environ['ANSWER_CACHE_ENABLED'] = 'false'
+    os.environ['SUMMARIES_ENABLED'] = 'false'
+    os.environ.setdefault('LLM_MAX_IN_FLIGHT', '0')
+    os.environ.setdefault('EMBED_MAX_IN_FLIGHT', '0')
+    if args.engine:
+        os.environ['RETRIEVAL_ENGINE'] = args.engine
+
+    report = {
+        'started': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'cpus': os.cpu_count(),
+        'config': {'llm_latency': args.llm_latency, 'per_item_latency': args.per_item_latency,
+                   'questions': args.questions, 'formats': formats},
+        'results': {},
+    }
+    if 'postprocess' in benchmarks:
+        report['results']['postprocess'] = bench_postprocess(args.answers, args.repeat)
+
+    if benchmarks & {'ingest', 'retrieval', 'ask'}:
+        from app import app
+        from database import db
+        from models import ChatSession
+        from providers import registry
+        client = app.test_client()
+        # Client construction and the first connection are not billed to the first file
+        registry.warm_up()
+        with tempfile.TemporaryDirectory() as directory:
+            for size in sizes:
+                paths = make_corpus(directory, size, formats)
+                result = report['results'][f"size_{size}"] = {'sentences_per_file': size}
+                with app.app_context():
+                    session = ChatSession(name=f"bench_suite_{size}")
+                    db.session.add(session)
+                    db.session.commit()
+                    session_id = session.id
+                try:
+                    asked = questions(args.questions, seed=size)
+                    with app.app_context():
+                        ingest, file_ids = bench_ingest(session_id, paths)
+                        if 'ingest' in benchmarks:
+                            result['ingest'] = ingest
+                        if 'retrieval' in benchmarks:
+                            result['retrieval'] = bench_retrieval(session_id, file_ids, asked)
+                    # Through the Flask app, like a real request
+                    if 'ask' in benchmarks:
+                        result['ask'] = bench_ask(client, session_id, file_ids, asked)
+                finally:
+                    client.delete(f'/sessions/{session_id}')
+
+    server.shutdown()
+    if args.baseline:
+        with open(args.baseline) as file:
+            report['comparison'] = compare(report, json.load(file), args.tolerance)
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output + '\n')
+    print(output)
+    if args.fail_on_regression and report.get('comparison', {}).get('regressions'):
+        raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
@@ -1,167 +1,385 @@
 import os
 import re
-from models import DocumentChunk
+import json
+from database import db
+from sqlalchemy import select, text, func, literal_column
+from vector_cache import vector_cache
+from answer_cache import answer_cache, normalize_question
+from admission import SingleFlight, llm_limiter, embedding_limiter
+from summaries import SUMMARIES_ENABLED, is_overview_question, load_summaries
+from context_packing import pack_context, chunk_terms, count_tokens
+from metrics import stage, TimedIterator, TOKENS
+from postprocessing import AnswerCleaner, clean_answer
+from vector_storage import VECTOR_STORAGE, compact_distance, rescore_factor
+from models import DocumentChunk, ChunkContent, DBDocument, Link, IngestionJob
 from collections import defaultdict
-from langchain.prompts import PromptTemplate
-from langchain_community.vectorstores import FAISS
-from langchain_together import TogetherEmbeddings, Together
-from langchain.chains.question_answering import load_qa_chain
+from langchain_core.documents import Document as LangchainDocument
+from providers import (
+    registry, prompt_template, api_url, auth_headers, LLM_MODEL, LLM_TEMPERATURE, LLM_MAX_TOKENS,
+    PROVIDER_CONNECT_TIMEOUT, PROVIDER_READ_TIMEOUT,
+)
 
 from dotenv import load_dotenv
 load_dotenv()
 
-def clean_redundant(text, question):
-    # Remove everything after "|assistant" (if any)
-    text = re.split(r'\|\s*assistant', text)[0]
-    
-    # Eliminate the first sentence if it is similar to the question
-    sentences = re.split(r'(?<=[.!?])\s+', text)
-    if sentences and sentences[0].strip() == question.strip():
-        text = ' '.join(sentences[1:])
-    
-    # Eliminate unwanted phrases
-    patterns = [
-        r"(Tôi luôn sẵn.*?)(?=(Tôi luôn sẵn|Xin chào|Xin cảm ơn|$))",
-        r"Xin chào.*",
-        r"Xin cảm ơn.*",
-        r"Nếu bạn cần thêm.*",
-        r"Chúc bạn thành công.*",
-        r"Tôi hy vọng.*",
-        r"Tôi sẵn sàng.*",
-        r"Tôi luôn sẵn lòng.*",
-        r"Hãy cho tôi biết.*",
-        r"Tôi chúc bạn.*",
-        r"Tôi xin lỗi, nhưng.*?(?=\s|$)",
-        r"Tuy nhiên,.*?(?=\s|$)",
-        r"Nếu bạn cần.*?(?=\s|$)",
-        r"Hãy cho tôi biết.*?(?=\s|$)",
-        r"Here is the response:?\s*", 
-        r"Here is the rewritten response:?\s*",
-        r"Tóm tắt thông tin bạn đang có:?\s*",
-        r"\|\s*\|",
+# Retrieval engine: "pgvector" ranks in the database, "faiss_cache" keeps a FAISS index
+# per session in memory, "faiss" builds an index per question
+RETRIEVAL_ENGINE = os.getenv("RETRIEVAL_ENGINE", "pgvector")
+# Optional HNSW tuning (recall vs latency), e.g. PGVECTOR_EF_SEARCH=100, PGVECTOR_ITERATIVE_SCAN=relaxed_order
+PGVECTOR_EF_SEARCH = os.getenv("PGVECTOR_EF_SEARCH")
+PGVECTOR_ITERATIVE_SCAN = os.getenv("PGVECTOR_ITERATIVE_SCAN")
+# Hybrid retrieval: fuse Postgres full-text matches with the dense results (reciprocal-rank fusion)
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "true").lower() in ("1", "true", "yes")
+LEXICAL_CANDIDATES = int(os.getenv("LEXICAL_CANDIDATES", "30"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+# Restrict the dense search to the best lexical candidates when there are enough of them
+LEXICAL_PREFILTER = os.getenv("LEXICAL_PREFILTER", "false").lower() in ("1", "true", "yes")
+LEXICAL_PREFILTER_CANDIDATES = int(os.getenv("LEXICAL_PREFILTER_CANDIDATES", "200"))
+# Text search configuration of the GIN index (no Vietnamese dictionary, so no stemming)
+TS_CONFIG = "simple"
+# Question words that match almost every chunk
+LEXICAL_STOPWORDS = {
+    "là", "của", "và", "có", "được", "cho", "trong", "những", "các", "gì", "nào", "không", "này",
+    "đó", "về", "với", "thì", "một", "như", "nội", "dung", "tài", "liệu", "file", "hãy", "cho", "biết",
+    "the", "a", "an", "of", "to", "in", "is", "are", "what", "which", "how", "for", "and", "on",
+    "does", "do", "about", "or", "me", "tell", "please",
+}
+
+
+def source_filter(session_id, file_ids, link_ids, candidates=None):
+    # Only use sources whose ingestion has finished
+    ready_file_ids = select(DBDocument.id).where(DBDocument.id.in_(file_ids), DBDocument.status == 'ready')
+    ready_link_ids = select(Link.id).where(Link.id.in_(link_ids), Link.status == 'ready')
+    condition = (
+        (DocumentChunk.session_id == session_id) &
+        ( (DocumentChunk.document_id.in_(ready_file_ids)) | (DocumentChunk.link_id.in_(ready_link_ids)) )
+    )
+    if candidates is not None:
+        condition = condition & DocumentChunk.id.in_(candidates)
+    return condition
+
+def current_embeddings():
+    # Vectors of another embedding model are not comparable with the question's
+    # (``flask vectors reembed`` converts them)
+    return ChunkContent.embedding_model == registry.embedding_backend.model_name
+
+def chunk_metadata(document_id, link_id, chunk_id=None, terms=None, position=None):
+    metadata = {"type": "file", "id": document_id} if document_id else {"type": "link", "id": link_id}
+    metadata["chunk_id"] = chunk_id
+    metadata["position"] = position
+    if terms is not None:
+        metadata["terms"] = set(terms)
+    return metadata
+
+def search_pgvector(query_embedding, session_id, file_ids, link_ids, k=15, candidates=None):
+    # Rank inside Postgres (HNSW index on embedding) and only fetch the top k rows
+    distance = ChunkContent.embedding.cosine_distance(query_embedding)
+    if PGVECTOR_EF_SEARCH:
+        db.session.execute(text(f"SET LOCAL hnsw.ef_search = {int(PGVECTOR_EF_SEARCH)}"))
+    if PGVECTOR_ITERATIVE_SCAN in ("strict_order", "relaxed_order"):
+        # pgvector >= 0.8: keep scanning the index until k rows pass the source filter
+        db.session.execute(text(f"SET LOCAL hnsw.iterative_scan = {PGVECTOR_ITERATIVE_SCAN}"))
+    if VECTOR_STORAGE != "full":
+        return search_pgvector_compact(query_embedding, session_id, file_ids, link_ids, k, candidates)
+    with stage("ask", "vector_search"):
+        rows = db.session.execute(
+            select(DocumentChunk.id, ChunkContent.chunk_text, ChunkContent.terms, DocumentChunk.document_id, DocumentChunk.link_id, DocumentChunk.position)
+            .join(ChunkContent, ChunkContent.id == DocumentChunk.content_id)
+            .where(source_filter(session_id, file_ids, link_ids, candidates), current_embeddings())
+            .order_by(distance)
+            .limit(k)
+        ).all()
+    if len(rows) < k:
+        rows = search_pgvector_exact(query_embedding, session_id, file_ids, link_ids, k, candidates)
+    return [
+        LangchainDocument(page_content=row.chunk_text, metadata=chunk_metadata(row.document_id, row.link_id, row.id, row.terms, row.position))
+        for row in rows
     ]
-    for p in patterns:
-        text = re.sub(p, '', text, flags=re.IGNORECASE)
-        
-    # Eliminate repeated sentences
-    seen = set()
-    unique_sentences = []
-    for sentence in re.split(r'(?<=[.!?])\s+', text):
-        if sentence not in seen:
-            seen.add(sentence)
-            unique_sentences.append(sentence)
-
-    return ' '.join(unique_sentences).strip()
-
-def trim_to_last_sentence(text, max_length=700):
-    sentences = re.split(r'(?<=[.!?])\s+', text)
-    result = ""
-    for s in sentences:
-        if len(result) + len(s) > max_length:
-            break
-        result += s + " "
-    result = result.strip()
-    
-    # # Make sure to end with punctuation and write the first sentence
-    # if result and result[-1] not in '.!?':
-    #     result = result.rsplit(' ', 1)[0] + '.'
-        
-    #! TEST 01 - work best
-    # Make sure to end with a single period
-    if result:
-        result = result.rstrip('.!?') + '.'  # Remove extra punctuation and add a period
-    # Capitalize the first letter
-    if result:
-        result = result[0].upper() + result[1:]
-        
-    return result
 
-# Chatbot function
-def chatbot(question, session_id, file_ids, link_ids):
+def search_pgvector_exact(query_embedding, session_id, file_ids, link_ids, k=15, candidates=None):
+    """Top k rows of the selected sources by an exact scan, without the HNSW index.
+
+    The index is built over every session's contents and returns about ef_search rows
+    before the source filter, so selected sources that are a small part of the corpus
+    can come back short or empty. The materialized CTE makes Postgres filter first and
+    compute the distance of each selected chunk.
+    """
+    selected = (
+        select(DocumentChunk.id, ChunkContent.chunk_text, ChunkContent.terms, ChunkContent.embedding,
+               DocumentChunk.document_id, DocumentChunk.link_id, DocumentChunk.position)
+        .join(ChunkContent, ChunkContent.id == DocumentChunk.content_id)
+        .where(source_filter(session_id, file_ids, link_ids, candidates), current_embeddings())
+        .cte("selected_chunks")
+        .prefix_with("MATERIALIZED")
+    )
+    with stage("ask", "vector_search_exact"):
+        return db.session.execute(
+            select(selected.c.id, selected.c.chunk_text, selected.c.terms, selected.c.document_id, selected.c.link_id, selected.c.position)
+            .order_by(selected.c.embedding.cosine_distance(query_embedding))
+            .limit(k)
+        ).all()
+
+def search_pgvector_compact(query_embedding, session_id, file_ids, link_ids, k=15, candidates=None):
+    # Shortlist on the halfvec/binary index, then rank the shortlist by the float32 distance
+    limit = k * rescore_factor(VECTOR_STORAGE)
+    # The index scan returns at most ef_search rows
+    db.session.execute(text(f"SET LOCAL hnsw.ef_search = {min(1000, max(int(PGVECTOR_EF_SEARCH or 40), limit))}"))
+    shortlist = (
+        select(DocumentChunk.id, DocumentChunk.content_id, DocumentChunk.document_id, DocumentChunk.link_id, DocumentChunk.position)
+        .join(ChunkContent, ChunkContent.id == DocumentChunk.content_id)
+        .where(source_filter(session_id, file_ids, link_ids, candidates), current_embeddings())
+        .order_by(compact_distance(query_embedding, VECTOR_STORAGE))
+        .limit(limit)
+        .subquery()
+    )
+    with stage("ask", "vector_search"):
+        rows = db.session.execute(
+            select(shortlist.c.id, ChunkContent.chunk_text, ChunkContent.terms, shortlist.c.document_id, shortlist.c.link_id, shortlist.c.position)
+            .join(ChunkContent, ChunkContent.id == shortlist.c.content_id)
+            .order_by(ChunkContent.embedding.cosine_distance(query_embedding))
+            .limit(k)
+        ).all()
+    if len(rows) < k:
+        rows = search_pgvector_exact(query_embedding, session_id, file_ids, link_ids, k, candidates)
+    return [
+        LangchainDocument(page_content=row.chunk_text, metadata=chunk_metadata(row.document_id, row.link_id, row.id, row.terms, row.position))
+        for row in rows
+    ]
+
+def search_faiss(query_embedding, session_id, file_ids, link_ids, k=15, candidates=None):
     # Get chunks from database
-    chunks = DocumentChunk.query.filter(
-        (DocumentChunk.session_id == session_id) &
-        ( (DocumentChunk.document_id.in_(file_ids)) | (DocumentChunk.link_id.in_(link_ids)) )
-    ).all()
-    
+    with stage("ask", "chunk_select"):
+        chunks = db.session.execute(
+            select(DocumentChunk.id, DocumentChunk.document_id, DocumentChunk.link_id, DocumentChunk.position, ChunkContent.chunk_text, ChunkContent.terms, ChunkContent.embedding)
+            .join(ChunkContent, ChunkContent.id == DocumentChunk.content_id)
+            .where(source_filter(session_id, file_ids, link_ids, candidates), current_embeddings())
+        ).all()
     if not chunks:
-        raise ValueError("No chunks were found for the selected documents or links.")
+        return []
     
     texts = [chunk.chunk_text for chunk in chunks]
-    embeddings = [chunk.embedding for chunk in chunks]  # Get embeddings from database #! TEST 01 - work best
-    metadatas = []
-    for chunk in chunks:
-        if chunk.document_id:
-            metadatas.append({"type": "file", "id": chunk.document_id})
-        elif chunk.link_id:
-            metadatas.append({"type": "link", "id": chunk.link_id})
-    
-    # # Create vector stores
-    # embeddings = TogetherEmbeddings(
-    #     api_key=os.getenv("TOGETHER_AI_API_KEY"),
-    #     model="togethercomputer/m2-bert-80M-32k-retrieval"
-    # )
-    # vector_store = FAISS.from_texts(
-    #     texts,
-    #     embeddings,
-    #     metadatas=metadatas
-    # )
+    embeddings = [chunk.embedding for chunk in chunks]  # Get embeddings from database
+    metadatas = [chunk_metadata(chunk.document_id, chunk.link_id, chunk.id, chunk.terms, chunk.position) for chunk in chunks]
     
-    #! TEST 01 - work best
     # Create vector store from stored embeddings
-    embeddings_model = TogetherEmbeddings(
-        api_key=os.getenv("TOGETHER_AI_API_KEY"),
-        model="togethercomputer/m2-bert-80M-32k-retrieval"
-    )
-    vector_store = FAISS.from_embeddings(
-        text_embeddings=zip(texts, embeddings),  # Use saved embeddings
-        embedding=embeddings_model,
-        metadatas=metadatas
-    )
-    
-    # Initialize LLM
-    llm = Together(
-        api_key=os.getenv("TOGETHER_AI_API_KEY"),
-        model="meta-llama/Llama-3.3-70B-Instruct-Turbo-Free",
-        temperature=0.2, # slight creativity but mostly deterministic
-        max_tokens=800,  # faster response with tighter focus
-    )
-    
-    # Define a specific prompt to restrict LLM to provided documents
-    prompt_template = PromptTemplate(
-        input_variables=["question", "context"],
-        template= (
-            "Answer the question '{question}' based only on the information from the following text: {context}. "
-            "If the question asks for a summary or overview (e.g., 'File hiện tại chứa thông tin gì?'), provide a concise and brief summary of the main topics in the text. "
-            
-            "If no relevant information is found in the text, reply with: 'Thông tin bạn hỏi không được đề cập trong file.' "
-            "if the question is in Vietnamese, or 'The information you asked for is not mentioned in the file.' if the question is in English. "
-            "Ensure the entire response, including this message, is in the same language as the question '{question}'."
-            "Keep answers short, 600 tokens max, and end naturally so as not to be cut off within the 600 token limit."
+    with stage("ask", "faiss_build"):
+        from langchain_community.vectorstores import FAISS  # only the "faiss" engine needs it
+        vector_store = FAISS.from_embeddings(
+            text_embeddings=zip(texts, embeddings),  # Use saved embeddings
+            embedding=registry.embedding_backend,
+            metadatas=metadatas
         )
-    )
+    with stage("ask", "vector_search"):
+        return vector_store.similarity_search_by_vector(query_embedding, k=k)
 
-    # Create QA chain with the custom prompt
-    chain = load_qa_chain(llm, chain_type="stuff", prompt=prompt_template)
-    # chain = load_qa_chain(llm, chain_type="stuff")
+def ready_source_versions(session_id, file_ids, link_ids):
+    # {source: version} for the selected sources that are ready. The version is the newest
+    # finished ingestion or refresh job, so it changes whenever any worker changes the chunks
+    versions = {}
+    for source_type, model, column, ids in (
+        ("file", DBDocument, IngestionJob.document_id, file_ids),
+        ("link", Link, IngestionJob.link_id, link_ids),
+    ):
+        if not ids:
+            continue
+        rows = db.session.execute(
+            select(model.id, func.max(IngestionJob.id))
+            .outerjoin(IngestionJob, (column == model.id) & (IngestionJob.status == 'done') & (IngestionJob.kind != 'summary'))
+            .where(model.session_id == session_id, model.id.in_([int(i) for i in ids]), model.status == 'ready')
+            .group_by(model.id)
+        ).all()
+        versions.update(((source_type, source_id), version or 0) for source_id, version in rows)
+    return versions
 
-    # Search and answer
-    matches = vector_store.similarity_search(question, k=15)
-    # matches = vector_store.similarity_search(question, k=5) #! Reduce to top 5 for speed
-    
-    # Create answer using the LLM
-    response = chain.run(input_documents=matches, question=question)
+def load_sources(entry, session_id, versions):
+    # (Re)load the chunks of sources the cached session index lacks or has at an older version;
+    # returns how many were loaded again
+    file_ids = [source_id for source_type, source_id in versions if source_type == "file"]
+    link_ids = [source_id for source_type, source_id in versions if source_type == "link"]
+    rows = db.session.execute(
+        select(DocumentChunk.id, ChunkContent.chunk_text, ChunkContent.terms, DocumentChunk.document_id, DocumentChunk.link_id, DocumentChunk.position, ChunkContent.embedding)
+        .join(ChunkContent, ChunkContent.id == DocumentChunk.content_id)
+        .where(
+            (DocumentChunk.session_id == session_id) &
+            ( (DocumentChunk.document_id.in_(file_ids)) | (DocumentChunk.link_id.in_(link_ids)) ),
+            current_embeddings(),
+        )
+    ).all()
+    # Searches never see a source half replaced
+    with entry.lock:
+        stale = [source for source in versions if source in entry.loaded_sources]
+        entry.drop(stale)
+        entry.add(
+            [row.id for row in rows],
+            [row.chunk_text for row in rows],
+            [row.embedding for row in rows],
+            [row.document_id for row in rows],
+            [row.link_id for row in rows],
+            [row.position for row in rows],
+            [row.terms for row in rows],
+        )
+        entry.mark_loaded(versions)
+    vector_cache.evict()
+    return len(stale)
+
+def search_faiss_cache(query_embedding, session_id, file_ids, link_ids, k=15, candidates=None):
+    # Reuse the session's in-memory index. Only ready sources are searched, and sources that
+    # are new to it or were re-ingested or refreshed since (by any worker) are fetched
+    entry = vector_cache.get(session_id)
+    with stage("ask", "source_versions"):
+        versions = ready_source_versions(session_id, file_ids, link_ids)
+    missing = entry.missing(versions)
+    reloads = 0
+    if missing:
+        with stage("ask", "chunk_select"):
+            reloads = load_sources(entry, session_id, {source: versions[source] for source in missing})
+    vector_cache.record(hit=not missing, reloads=reloads)
+    with stage("ask", "vector_search"):
+        results = entry.search(query_embedding, list(versions), k, candidates)
+    return [
+        LangchainDocument(page_content=chunk_text, metadata=chunk_metadata(document_id, link_id, chunk_id, terms, position))
+        for chunk_id, _, chunk_text, document_id, link_id, terms, position in results
+    ]
+
+def lexical_terms(question):
+    """Search terms of a question; identifiers win when there are any.
+
+    Clause numbers ("5.2") and codes ("ISO-27001") are what dense retrieval misses.
+    The index has no IDF, so mixing them with common words would let long chunks
+    full of common words outrank the one chunk that has the identifier.
+    """
+    terms = re.findall(r'\w+(?:[.\-/]\w+)*', question.lower())
+    terms = list(dict.fromkeys(term for term in terms if term not in LEXICAL_STOPWORDS))
+    identifiers = [term for term in terms if any(c.isdigit() for c in term)]
+    return identifiers or terms
+
+def search_lexical(question, session_id, file_ids, link_ids, k=LEXICAL_CANDIDATES):
+    """Full-text matches (GIN index on chunk_content.search_vector) ranked by cover density."""
+    terms = lexical_terms(question)
+    if not terms or db.engine.dialect.name != 'postgresql':
+        return []
+    # Any term may match; chunks containing more (and closer) terms rank higher
+    query = func.websearch_to_tsquery(literal_column(f"'{TS_CONFIG}'"), ' or '.join(f'"{term}"' for term in terms))
+    rank = func.ts_rank_cd(ChunkContent.search_vector, query)
+    rows = db.session.execute(
+        select(DocumentChunk.id, ChunkContent.chunk_text, ChunkContent.terms, DocumentChunk.document_id, DocumentChunk.link_id, DocumentChunk.position)
+        .join(ChunkContent, ChunkContent.id == DocumentChunk.content_id)
+        .where(source_filter(session_id, file_ids, link_ids), ChunkContent.search_vector.op('@@')(query))
+        .order_by(rank.desc(), DocumentChunk.id)
+        .limit(k)
+    ).all()
+    return [
+        LangchainDocument(page_content=row.chunk_text, metadata=chunk_metadata(row.document_id, row.link_id, row.id, row.terms, row.position))
+        for row in rows
+    ]
+
+def reciprocal_rank_fusion(rankings, k):
+    # score(chunk) = sum over rankings of 1 / (RRF_K + rank)
+    scores = {}
+    documents = {}
+    for ranking in rankings:
+        for rank, match in enumerate(ranking, start=1):
+            chunk_id = match.metadata.get("chunk_id")
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (RRF_K + rank)
+            documents.setdefault(chunk_id, match)
+    ordered = sorted(scores, key=lambda chunk_id: scores[chunk_id], reverse=True)
+    return [documents[chunk_id] for chunk_id in ordered[:k]]
+
+RETRIEVAL_ENGINES = {
+    "pgvector": search_pgvector,
+    "faiss_cache": search_faiss_cache,
+    "faiss": search_faiss,
+}
+
+def embed_query(question):
+    with embedding_limiter.slot():
+        return registry.embedding_backend.embed_query(question)
+
+def embed_question(question):
+    # Repeated questions reuse their embedding (level 1 of the answer cache)
+    with stage("ask", "embed_query"):
+        return answer_cache.embed_question(question, embed_query)
+
+def retrieve(question, session_id, file_ids, link_ids, k=15, query_embedding=None):
+    # Search for the most similar chunks
+    if query_embedding is None:
+        query_embedding = embed_question(question)
+    search = RETRIEVAL_ENGINES[RETRIEVAL_ENGINE]
+    lexical = []
+    if HYBRID_SEARCH:
+        limit = max(LEXICAL_PREFILTER_CANDIDATES, LEXICAL_CANDIDATES) if LEXICAL_PREFILTER else LEXICAL_CANDIDATES
+        with stage("ask", "lexical_search"):
+            lexical = search_lexical(question, session_id, file_ids, link_ids, k=limit)
+    candidates = None
+    if LEXICAL_PREFILTER and len(lexical) >= LEXICAL_PREFILTER_CANDIDATES:
+        # Plenty of keyword matches: rank only those by vector distance
+        candidates = [match.metadata["chunk_id"] for match in lexical]
+    matches = search(query_embedding, session_id, file_ids, link_ids, k=k, candidates=candidates)
+    if lexical:
+        matches = reciprocal_rank_fusion([matches, lexical[:LEXICAL_CANDIDATES]], k)
+    if not matches:
+        raise ValueError("No chunks were found for the selected documents or links.")
+    return matches
+
+def postprocess(response, question):
     #! NEW: Post-process to remove repeated phrases and trim
-    response = clean_redundant(response, question)
-    response = trim_to_last_sentence(response, max_length=700)
-    
+    TOKENS.inc(count_tokens(response), kind="completion")
+    with stage("ask", "postprocess"):
+        return clean_answer(response, question)
+
+def lookup_answer(cache_key, query_embedding):
+    with stage("ask", "cache_lookup"):
+        return answer_cache.lookup(cache_key, query_embedding)
+
+def overview_context(question, session_id, file_ids, link_ids):
+    # Overview questions on sources that all have a stored summary are answered from the summaries
+    if not SUMMARIES_ENABLED or not is_overview_question(question):
+        return None
+    with stage("ask", "summary_lookup"):
+        summaries = load_summaries(session_id, file_ids, link_ids)
+    if summaries is None:
+        return None
+    return [
+        LangchainDocument(page_content=summary, metadata=chunk_metadata(
+            source_id if source_type == "file" else None, source_id if source_type == "link" else None,
+        ))
+        for source_type, source_id, summary in summaries
+    ]
+
+def context_for(question, session_id, file_ids, link_ids, query_embedding):
+    # (passages for the prompt, whether they are per-source summaries rather than retrieved chunks)
+    summaries = overview_context(question, session_id, file_ids, link_ids)
+    if summaries is not None:
+        return summaries, True
+    matches = retrieve(question, session_id, file_ids, link_ids, k=15, query_embedding=query_embedding)
+    # matches = retrieve(question, session_id, file_ids, link_ids, k=5) #! Reduce to top 5 for speed
+    return build_context(matches), False
+
+def build_context(matches):
+    # Merge overlapping chunks, drop near-duplicates and fit the token budget
+    with stage("ask", "pack_context"):
+        matches, stats = pack_context(matches)
+    TOKENS.inc(stats['tokens_in'], kind="context_retrieved")
+    TOKENS.inc(stats['tokens_out'], kind="context_packed")
+    return matches
+
+def finish_answer(cache_key, question, query_embedding, response, matches, with_citations):
+    # Sources (and citations) of a final answer, which is then cached
+    with stage("ask", "attribution"):
+        sources = attribute_sources(response, matches)
+        citations = cite_passages(response, matches) if with_citations else None
+    with stage("ask", "cache_store"):
+        answer_cache.store(cache_key, question, query_embedding, response, sources)
+    return sources, citations
+
+def attribute_sources(response, matches):
     # Check if the response is exactly the "no information found" message
     no_info_messages = [
         "Thông tin bạn hỏi không được đề cập trong file.",
         "The information you asked for is not mentioned in the file."
     ]
     if response.strip() in no_info_messages:
-        unique_sources = []
+        return []
     else:
         #! Origin
         # # Filter sources based on relevance to the response
@@ -184,23 +402,178 @@ def chatbot(question, session_id, file_ids, link_ids):
         #             if source not in unique_sources:
         #                 unique_sources.append(source)
                         
-        #! TEST 01 - work best
         # Filter sources based on relevance to the response
         unique_sources = []
-        if matches:
-            # Extract key terms from the question and response (simple approach: split into words)
-            response_terms = set(re.findall(r'\w+', response.lower()))
-            for match in matches:
-                match_text = match.page_content.lower()
-                #! DEBUG
-                # print("Question terms:", question_terms)
-                # print("Response terms:", response_terms)
-                # print("Match text:", match_text)
-                if sum(term in match_text for term in response_terms) >=2:
-                    source_type = match.metadata["type"]
-                    source_id = match.metadata["id"]
-                    # source = match.metadata["source"]
-                    if (source_type, source_id) not in unique_sources:
-                        unique_sources.append((source_type, source_id))
+        for match, _, _ in score_passages(response, matches):
+            source_type = match.metadata["type"]
+            source_id = match.metadata["id"]
+            if (source_type, source_id) not in unique_sources:
+                unique_sources.append((source_type, source_id))
+    
+    return unique_sources
+
+def score_passages(response, matches):
+    """(passage, shared words, score) for passages sharing at least two words with the response.
+
+    Chunk word sets are computed at ingestion, so this is one set intersection per passage.
+    """
+    response_terms = chunk_terms(response)
+    if not response_terms:
+        return []
+    scored = []
+    for match in matches:
+        terms = match.metadata.get("terms")
+        if terms is None:
+            terms = chunk_terms(match.page_content)
+        shared = response_terms & terms
+        if len(shared) >= 2:
+            scored.append((match, shared, len(shared) / len(response_terms)))
+    return scored
+
+def highlight_offsets(text, words):
+    # [start, end) character ranges of the given words in text, neighbouring words joined
+    spans = []
+    for found in re.finditer(r'\w+', text):
+        if found.group().lower() not in words:
+            continue
+        if spans and found.start() - spans[-1][1] <= 2:
+            spans[-1][1] = found.end()
+        else:
+            spans.append([found.start(), found.end()])
+    return spans
+
+def cite_passages(response, matches):
+    # Per-passage citations (score and highlight ranges) for the frontend, best first
+    citations = []
+    for match, shared, score in score_passages(response, matches):
+        keywords = {term for term in shared if term not in LEXICAL_STOPWORDS}
+        citations.append({
+            'type': match.metadata["type"],
+            'id': match.metadata["id"],
+            'chunk_ids': match.metadata.get("chunk_ids") or [match.metadata.get("chunk_id")],
+            'score': round(score, 3),
+            'text': match.page_content,
+            'offsets': highlight_offsets(match.page_content, keywords),
+        })
+    citations.sort(key=lambda citation: citation['score'], reverse=True)
+    return citations
+
+# Identical questions on the same sources that arrive while one is being answered wait for that
+# answer instead of running retrieval and the LLM again (both /ask and /ask/stream)
+in_flight_answers = SingleFlight("answer")
+
+def flight_key(cache_key, question, with_citations):
+    return (cache_key, normalize_question(question), bool(with_citations))
+
+def answer_question(question, session_id, file_ids, link_ids, cache_key, with_citations):
+    # Same (or near-identical) question on the same sources: reuse the answer
+    query_embedding = embed_question(question)
+    cached = lookup_answer(cache_key, query_embedding)
+    if cached is not None:
+        # Cached answers keep their sources but not the passages, so there are no citations
+        return (*cached, None)
+    
+    matches, from_summaries = context_for(question, session_id, file_ids, link_ids, query_embedding)
+    
+    # Create answer using the shared LLM and QA chain
+    with llm_limiter.slot(), stage("ask", "llm"):
+        response = registry.qa_chain.run(input_documents=matches, question=question)
+    response = postprocess(response, question)
+    # Summaries are not passages of the source, so there is nothing to cite
+    sources, citations = finish_answer(cache_key, question, query_embedding, response, matches,
+                                       with_citations and not from_summaries)
+    return response, sources, citations
+
+# Chatbot function
+def chatbot(question, session_id, file_ids, link_ids, with_citations=False):
+    cache_key = answer_cache.key(session_id, file_ids, link_ids)
+    response, sources, citations = in_flight_answers.do(
+        flight_key(cache_key, question, with_citations),
+        lambda: answer_question(question, session_id, file_ids, link_ids, cache_key, with_citations),
+    )
+    if with_citations:
+        return response, sources, citations
+    return response, sources
+
+def stream_completion(prompt):
+    # Together completions API with stream=True (server-sent events), yields text pieces
+    response = registry.http_session.post(
+        api_url('completions'),
+        headers=auth_headers(),
+        json={
+            "model": LLM_MODEL,
+            "prompt": prompt,
+            "temperature": LLM_TEMPERATURE,
+            "max_tokens": LLM_MAX_TOKENS,
+            "stream": True,
+        },
+        stream=True,
+        timeout=(PROVIDER_CONNECT_TIMEOUT, PROVIDER_READ_TIMEOUT),
+    )
+    with response:
+        response.raise_for_status()
+        for line in response.iter_lines(decode_unicode=True):
+            if not line or not line.startswith('data:'):
+                continue
+            data = line[len('data:'):].strip()
+            if data == '[DONE]':
+                break
+            choices = json.loads(data).get('choices') or [{}]
+            piece = choices[0].get('text') or ''
+            if piece:
+                yield piece
+
+def chatbot_stream(question, session_id, file_ids, link_ids, with_citations=False):
+    # Yields ("token", text) events while the LLM generates, then ("done", (answer, sources, citations))
+    cache_key = answer_cache.key(session_id, file_ids, link_ids)
+    key = flight_key(cache_key, question, with_citations)
+    leader, answer = in_flight_answers.join(key)
+    if not leader:
+        # The same question is already being answered: send its answer in one piece
+        yield "token", answer[0]
+        yield "done", answer
+        return
+    try:
+        for event, payload in stream_answer(question, session_id, file_ids, link_ids, cache_key, with_citations):
+            if event == "done":
+                in_flight_answers.finish(key, payload)
+            yield event, payload
+    except BaseException as e:
+        # A client disconnecting mid-stream (GeneratorExit) hands the answer to a waiting request
+        in_flight_answers.finish(key, error=e)
+        raise
+
+def stream_answer(question, session_id, file_ids, link_ids, cache_key, with_citations):
+    query_embedding = embed_question(question)
+    cached = lookup_answer(cache_key, query_embedding)
+    if cached is not None:
+        yield "token", cached[0]
+        yield "done", (*cached, None)
+        return
+    
+    matches, from_summaries = context_for(question, session_id, file_ids, link_ids, query_embedding)
+    context = "\n\n".join(match.page_content for match in matches)
+    prompt = prompt_template.format(question=question, context=context)
+    
+    cleaner = AnswerCleaner(question)
+    pieces = []
+    # The LLM slot is held until generation ends. Only the time spent waiting on the LLM
+    # counts as the llm stage, not the time the client takes to read
+    with llm_limiter.slot():
+        for piece in TimedIterator(stream_completion(prompt), "ask", "llm"):
+            pieces.append(piece)
+            for sentence in cleaner.feed(piece):
+                yield "token", sentence
+            if cleaner.done:
+                # The answer is complete (length limit or chat template leftovers); stop generating
+                break
+    with stage("ask", "postprocess"):
+        tail = cleaner.finish()
+    for sentence in tail:
+        yield "token", sentence
     
-    return response, unique_sources
+    TOKENS.inc(count_tokens(''.join(pieces)), kind="completion")
+    response = cleaner.result()
+    sources, citations = finish_answer(cache_key, question, query_embedding, response, matches,
+                                       with_citations and not from_summaries)
+    yield "done", (response, sources, citations)
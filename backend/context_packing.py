@@ -0,0 +1,237 @@
+import os
+import re
+import logging
+from langchain_core.documents import Document as LangchainDocument
+
+from dotenv import load_dotenv
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Max prompt tokens spent on retrieved context
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+# Chunks whose word-shingle Jaccard similarity to an already picked chunk exceeds this are dropped
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv("NEAR_DUPLICATE_THRESHOLD", "0.8"))
+# MMR trade-off between relevance (1.0) and novelty (0.0)
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))
+# Smallest shared prefix/suffix treated as splitter overlap (the splitter uses 150 chars)
+MIN_OVERLAP_CHARS = 20
+MAX_OVERLAP_CHARS = 300
+
+_encoding = None
+
+def count_tokens(text):
+    # tiktoken's cl100k_base approximates the Llama tokenizer; fall back to ~4 chars per token
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            logger.warning("tiktoken unavailable, estimating tokens: %s", e)
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+def truncate_to_tokens(text, max_tokens):
+    count_tokens('')  # make sure the encoding is loaded
+    if _encoding:
+        return _encoding.decode(_encoding.encode(text, disallowed_special=())[:max_tokens])
+    return text[:max_tokens * 4]
+
+def overlap_length(left, right):
+    # Longest suffix of left that is also a prefix of right. The overlap starts with right's
+    # first MIN_OVERLAP_CHARS characters, so only the places where they occur in left's tail
+    # are compared, from the longest possible suffix down
+    upper = min(len(left), len(right), MAX_OVERLAP_CHARS)
+    if upper < MIN_OVERLAP_CHARS:
+        return 0
+    tail = left[len(left) - upper:]
+    seed = right[:MIN_OVERLAP_CHARS]
+    start = tail.find(seed)
+    while start != -1:
+        size = upper - start
+        if tail[start:] == right[:size]:
+            return size
+        start = tail.find(seed, start + 1)
+    return 0
+
+def merged_passage(text, parts):
+    # The passage keeps the ids and the union of the term sets of the chunks it was built from
+    metadata = dict(parts[0].metadata)
+    metadata["chunk_ids"] = [part.metadata.get("chunk_id") for part in parts]
+    if all(part.metadata.get("terms") is not None for part in parts):
+        metadata["terms"] = set().union(*(part.metadata["terms"] for part in parts))
+    else:
+        metadata.pop("terms", None)
+    return LangchainDocument(page_content=text, metadata=metadata)
+
+def chunk_position(match):
+    position = match.metadata.get("position")
+    return position if position is not None else match.metadata.get("chunk_id") or 0
+
+def join_text(text, last_position, match):
+    # text extended by match when match continues it (next position or shared overlap), else None
+    position = match.metadata.get("position")
+    size = overlap_length(text, match.page_content)
+    if last_position is not None and position == last_position + 1:
+        return text + (match.page_content[size:] if size else ' ' + match.page_content)
+    if size:
+        return text + match.page_content[size:]
+    return None
+
+def merge_adjacent(matches):
+    """Merge consecutive chunks of the same source into one passage without the overlap.
+
+    Neighbours in the source have consecutive positions (chunk ids stop following the
+    text once a refresh inserts chunks). The merged passage takes the rank of its best-ranked part.
+    """
+    groups = {}
+    for rank, match in enumerate(matches):
+        key = (match.metadata.get("type"), match.metadata.get("id"))
+        groups.setdefault(key, []).append((rank, match))
+
+    passages = []
+    for parts in groups.values():
+        parts.sort(key=lambda part: chunk_position(part[1]))
+        current_rank, current = parts[0]
+        text = current.page_content
+        merged = [current]
+        last_position = current.metadata.get("position")
+        for rank, match in parts[1:]:
+            joined = join_text(text, last_position, match)
+            if joined is not None:
+                text = joined
+                current_rank = min(current_rank, rank)
+                merged.append(match)
+            else:
+                passages.append((current_rank, merged_passage(text, merged)))
+                current_rank, current, text, merged = rank, match, match.page_content, [match]
+            last_position = match.metadata.get("position")
+        passages.append((current_rank, merged_passage(text, merged)))
+    passages.sort(key=lambda passage: passage[0])
+    return [passage for _, passage in passages]
+
+def chunk_terms(text):
+    # Lowercased word set of a chunk, stored at ingestion and used for source attribution
+    return set(re.findall(r'\w+', text.lower()))
+
+def shingles(text, size=3):
+    words = re.findall(r'\w+', text.lower())
+    return {tuple(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+
+def jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+def mmr_order(passages):
+    # Relevance comes from the retrieval rank; similarity is lexical, so no extra embeddings are needed
+    candidates = [(i, passage, shingles(passage.page_content)) for i, passage in enumerate(passages)]
+    total = len(candidates)
+    selected = []
+    while candidates:
+        best = None
+        for position, (rank, passage, grams) in enumerate(candidates):
+            similarity = max((jaccard(grams, chosen[2]) for chosen in selected), default=0.0)
+            if similarity >= NEAR_DUPLICATE_THRESHOLD:
+                continue
+            score = MMR_LAMBDA * (1 - rank / total) - (1 - MMR_LAMBDA) * similarity
+            if best is None or score > best[0]:
+                best = (score, position)
+        if best is None:
+            break
+        selected.append(candidates.pop(best[1]))
+    return [passage for _, passage, _ in selected]
+
+def insert_run(runs, rank, match):
+    """Runs of one source once ``match`` is added, as ``(first, last, new_runs)``.
+
+    ``runs`` is what merge_adjacent builds for the source: ``(parts, text)`` pairs in position
+    order, ``parts`` being ``(rank, match)`` pairs. ``new_runs`` replaces ``runs[first:last]``;
+    only the run before the new chunk and the runs it now reaches are merged again.
+    """
+    key = chunk_position(match)
+    first = 0
+    for index, (parts, _) in enumerate(runs):
+        if chunk_position(parts[0][1]) > key:
+            break
+        first = index
+    parts = list(runs[first][0]) if runs else []
+    at = sum(1 for _, part in parts if chunk_position(part) <= key)
+    parts.insert(at, (rank, match))
+
+    new_runs = []
+    current, text = [parts[0]], parts[0][1].page_content
+    pending, last = parts[1:], min(first + 1, len(runs))
+    while True:
+        for part in pending:
+            joined = join_text(text, current[-1][1].metadata.get("position"), part[1])
+            if joined is None:
+                new_runs.append((current, text))
+                current, text = [part], part[1].page_content
+            else:
+                current.append(part)
+                text = joined
+        # A following run that does not join starts over exactly as before
+        if last == len(runs) or join_text(text, current[-1][1].metadata.get("position"), runs[last][0][0][1]) is None:
+            break
+        pending, last = runs[last][0], last + 1
+    new_runs.append((current, text))
+    return first, last, new_runs
+
+def pack_context(matches, token_budget=None):
+    """Merge, de-duplicate and budget retrieved chunks before they are stuffed in the prompt.
+
+    Returns the passages to send and a stats dict with the token counts.
+    """
+    token_budget = token_budget or CONTEXT_TOKEN_BUDGET
+    original_tokens = sum(count_tokens(match.page_content) for match in matches)
+
+    # Pick chunks in MMR order (near-duplicates already dropped) while the merged
+    # passages still fit the budget; overlap removed by merging is not paid twice.
+    # The result is merge_adjacent over the picked chunks, kept up to date one chunk at a time
+    sources = {}
+    token_counts = {}
+    selected = 0
+    used = 0
+    ordered = mmr_order(matches)
+
+    def passage_tokens(text):
+        if text not in token_counts:
+            token_counts[text] = count_tokens(text)
+        return token_counts[text]
+
+    for match in ordered:
+        runs = sources.setdefault((match.metadata.get("type"), match.metadata.get("id")), [])
+        first, last, new_runs = insert_run(runs, selected, match)
+        tokens = (used - sum(passage_tokens(text) for _, text in runs[first:last])
+                  + sum(passage_tokens(text) for _, text in new_runs))
+        if tokens > token_budget:
+            continue
+        runs[first:last] = new_runs
+        selected += 1
+        used = tokens
+    passages = [
+        (min(rank for rank, _ in parts), merged_passage(text, [part for _, part in parts]))
+        for runs in sources.values() for parts, text in runs
+    ]
+    passages.sort(key=lambda passage: passage[0])
+    packed = [passage for _, passage in passages]
+    if not packed and ordered:
+        # Even the best chunk is over budget: keep its beginning
+        top = ordered[0]
+        text = truncate_to_tokens(top.page_content, token_budget)
+        packed = [LangchainDocument(page_content=text, metadata=dict(top.metadata))]
+        used = count_tokens(text)
+
+    stats = {
+        'chunks_in': len(matches),
+        'passages_out': len(packed),
+        'tokens_in': original_tokens,
+        'tokens_out': used,
+        'tokens_saved': original_tokens - used,
+    }
+    logger.info("Context packing: %s", stats)
+    return packed, stats
@@ -0,0 +1,200 @@
+import os
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+from langchain_core.embeddings import Embeddings
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_random_exponential
+
+from dotenv import load_dotenv
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# "together" calls the Together embeddings API, "local" runs a transformers model on the CPU
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "together")
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "5"))
+# Width of the chunk_content.embedding column
+EMBEDDING_DIM = 768
+# Local model: a Hugging Face id or a directory with at most 768 dimensions (the chunk_content
+# column; smaller vectors are zero-padded, which leaves cosine distances unchanged).
+# multilingual-e5-small (384) handles Vietnamese and expects "query: " / "passage: " prefixes
+LOCAL_EMBEDDING_MODEL = os.getenv("LOCAL_EMBEDDING_MODEL", "intfloat/multilingual-e5-small")
+LOCAL_EMBEDDING_QUERY_PREFIX = os.getenv("LOCAL_EMBEDDING_QUERY_PREFIX", "query: ")
+LOCAL_EMBEDDING_DOCUMENT_PREFIX = os.getenv("LOCAL_EMBEDDING_DOCUMENT_PREFIX", "passage: ")
+LOCAL_EMBEDDING_MAX_TOKENS = int(os.getenv("LOCAL_EMBEDDING_MAX_TOKENS", "512"))
+# torch intra-op threads (0 = torch default, one per core)
+LOCAL_EMBEDDING_THREADS = int(os.getenv("LOCAL_EMBEDDING_THREADS", "0"))
+# Dynamic batching: texts per forward pass and how long to wait for more requests to join one
+LOCAL_EMBEDDING_BATCH_SIZE = int(os.getenv("LOCAL_EMBEDDING_BATCH_SIZE", "32"))
+LOCAL_EMBEDDING_BATCH_WAIT_MS = float(os.getenv("LOCAL_EMBEDDING_BATCH_WAIT_MS", "5"))
+
+def transient_api_error(error):
+    # Connection errors, timeouts, 5xx and rate limits from the openai client behind TogetherEmbeddings
+    # (imported here: openai is only loaded once the client has been created)
+    from openai import APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+    return isinstance(error, (APIConnectionError, APITimeoutError, InternalServerError, RateLimitError))
+
+class TogetherEmbeddingBackend(Embeddings):
+    """Together embeddings API; documents go out as one request per batch."""
+
+    def __init__(self, client, model_name):
+        self._client = client  # callable returning the shared TogetherEmbeddings client
+        self.model_name = model_name
+
+    @retry(
+        retry=retry_if_exception(transient_api_error),
+        wait=wait_random_exponential(multiplier=0.5, max=20),
+        stop=stop_after_attempt(EMBED_MAX_RETRIES),
+        reraise=True,
+    )
+    def embed_documents(self, texts):
+        # TogetherEmbeddings.embed_documents sends one request per text, so call the
+        # embeddings endpoint directly with the whole batch as input
+        embeddings_model = self._client()
+        response = embeddings_model.client.create(input=texts, model=embeddings_model.model)
+        data = sorted(response.data, key=lambda item: item.index)
+        return [item.embedding for item in data]
+
+    def embed_query(self, text):
+        return self._client().embed_query(text)
+
+    def warm_up(self):
+        self.embed_query("warm up")
+
+class DynamicBatcher:
+    """Merges concurrent encode requests into shared batches on one worker thread.
+
+    Callers block in ``submit``; the worker takes the first waiting request, then
+    gathers more for up to ``max_wait`` seconds or until ``max_batch_size`` texts
+    are collected, encodes them together and hands each caller its slice.
+    """
+
+    def __init__(self, encode, max_batch_size, max_wait):
+        self.encode = encode
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.texts = 0
+
+    def submit(self, texts):
+        if not texts:
+            return []
+        self._start()
+        future = Future()
+        self._queue.put((list(texts), future))
+        return future.result()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="embedding-batcher", daemon=True)
+                self._thread.start()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        size = len(batch[0][0])
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            batch.append(item)
+            size += len(item[0])
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            texts = [text for request_texts, _ in batch for text in request_texts]
+            try:
+                vectors = []
+                for start in range(0, len(texts), self.max_batch_size):
+                    vectors.extend(self.encode(texts[start:start + self.max_batch_size]))
+                    self.batches += 1
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.texts += len(texts)
+            offset = 0
+            for request_texts, future in batch:
+                future.set_result(vectors[offset:offset + len(request_texts)])
+                offset += len(request_texts)
+
+class LocalEmbeddingBackend(Embeddings):
+    """Sentence embeddings from a local transformers model (mean pooling, L2-normalised).
+
+    torch and transformers are imported when the model loads, so the API backend
+    never pays for them. Queries and documents share the dynamic batcher, so
+    concurrent questions and ingestion batches fill the same forward passes.
+    """
+
+    def __init__(self, model_name=LOCAL_EMBEDDING_MODEL, threads=LOCAL_EMBEDDING_THREADS,
+                 batch_size=LOCAL_EMBEDDING_BATCH_SIZE, batch_wait_ms=LOCAL_EMBEDDING_BATCH_WAIT_MS):
+        self.model_name = model_name
+        self.threads = threads
+        self._model = None
+        self._tokenizer = None
+        self._load_lock = threading.Lock()
+        self.batcher = DynamicBatcher(self._encode, batch_size, batch_wait_ms / 1000)
+
+    def load(self):
+        if self._model is not None:
+            return
+        with self._load_lock:
+            if self._model is not None:
+                return
+            import torch
+            from transformers import AutoModel, AutoTokenizer
+            if self.threads:
+                torch.set_num_threads(self.threads)
+            started = time.perf_counter()
+            self._tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+            model = AutoModel.from_pretrained(self.model_name)
+            if model.config.hidden_size > EMBEDDING_DIM:
+                raise ValueError(f"{self.model_name} produces {model.config.hidden_size}-dimensional vectors, "
+                                 f"the database stores {EMBEDDING_DIM}")
+            model.eval()
+            self._model = model
+            logger.info("Loaded embedding model %s in %.1fs (%d threads)",
+                        self.model_name, time.perf_counter() - started, torch.get_num_threads())
+
+    def _encode(self, texts):
+        import torch
+        self.load()
+        # Similar lengths share a forward pass, so little compute goes to padding
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        encoded = self._tokenizer(
+            [texts[i] for i in order], padding=True, truncation=True,
+            max_length=LOCAL_EMBEDDING_MAX_TOKENS, return_tensors='pt',
+        )
+        with torch.inference_mode():
+            hidden = self._model(**encoded).last_hidden_state
+            mask = encoded['attention_mask'].unsqueeze(-1).to(hidden.dtype)
+            pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+            pooled = torch.nn.functional.normalize(pooled, p=2, dim=1)
+            pooled = torch.nn.functional.pad(pooled, (0, EMBEDDING_DIM - pooled.shape[1]))
+        vectors = [None] * len(texts)
+        for position, vector in zip(order, pooled.tolist()):
+            vectors[position] = vector
+        return vectors
+
+    def embed_documents(self, texts):
+        return self.batcher.submit([LOCAL_EMBEDDING_DOCUMENT_PREFIX + text for text in texts])
+
+    def embed_query(self, text):
+        return self.batcher.submit([LOCAL_EMBEDDING_QUERY_PREFIX + text])[0]
+
+    def warm_up(self):
+        # Load the weights and run one pass so the first request does not pay for it
+        self.load()
+        self.embed_query("warm up")
@@ -0,0 +1,22 @@
+# Production launcher: cd backend && gunicorn -c gunicorn.conf.py wsgi:app
+# A question spends almost all of its time waiting on the LLM and embedding APIs, which releases
+# the GIL, so concurrency comes from threads per worker, not from the worker count. Keep
+# GUNICORN_THREADS + INGEST_WORKERS within DB_POOL_SIZE + DB_MAX_OVERFLOW (app.py).
+import os
+import multiprocessing
+
+bind = os.getenv("BIND", "127.0.0.1:5000")
+# Processes: CPU-bound work (extraction, FAISS, postprocessing) scales with these
+workers = int(os.getenv("WEB_CONCURRENCY", str(min(4, multiprocessing.cpu_count()))))
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "16"))
+# Streamed answers last as long as the LLM generation (PROVIDER_READ_TIMEOUT is 120s)
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "180"))
+graceful_timeout = 30
+keepalive = 5
+# Restart workers now and then so per-process caches (FAISS indexes, answers) cannot grow forever
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "2000"))
+max_requests_jitter = 200
+# Build the app after the fork: DB connections, ingestion threads and provider clients are per worker
+preload_app = False
+accesslog = "-"
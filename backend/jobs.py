@@ -0,0 +1,292 @@
+import os
+import logging
+import threading
+from datetime import timedelta
+from database import db
+from sqlalchemy import or_, and_, select, func
+from models import IngestionJob, DBDocument, Link, DocumentChunk
+from vector_cache import vector_cache
+from answer_cache import answer_cache
+from process_documents import process_and_store_chunks, refresh_source, discard_staged
+from summaries import SUMMARIES_ENABLED, summarize_source, needs_summary
+from metrics import (
+    Gauge, start_trace, finish_trace, SLOW_INGEST_SECONDS,
+    INGEST_CHUNKS, INGEST_JOB_SECONDS, INGEST_CHUNKS_PER_SECOND,
+)
+
+from dotenv import load_dotenv
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Number of background ingestion threads per process
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+# Seconds a worker sleeps when the queue is empty (enqueue wakes it earlier)
+INGEST_POLL_INTERVAL = float(os.getenv("INGEST_POLL_INTERVAL", "2"))
+# A running job without progress for this long is assumed orphaned (e.g. the process died)
+INGEST_STALE_SECONDS = int(os.getenv("INGEST_STALE_SECONDS", "600"))
+# Seconds between heartbeats that keep this process's running jobs from looking stale
+INGEST_HEARTBEAT_SECONDS = float(os.getenv("INGEST_HEARTBEAT_SECONDS", str(max(INGEST_STALE_SECONDS / 4, 1))))
+INGEST_MAX_ATTEMPTS = int(os.getenv("INGEST_MAX_ATTEMPTS", "3"))
+
+def job_to_dict(job):
+    return {
+        'id': job.id,
+        'session_id': job.session_id,
+        'document_id': job.document_id,
+        'link_id': job.link_id,
+        'source_type': job.source_type,
+        'kind': job.kind,
+        'status': job.status,
+        'attempts': job.attempts,
+        'chunks_processed': job.chunks_processed,
+        'chunks_total': job.chunks_total,
+        'error': job.error,
+        'created_at': job.created_at,
+        'started_at': job.started_at,
+        'finished_at': job.finished_at,
+    }
+
+class JobLost(RuntimeError):
+    """The job was reclaimed as stale by another worker, which now owns it."""
+
+class IngestionQueue:
+    """Database-backed ingestion queue drained by a pool of worker threads.
+
+    Jobs live in the ``ingestion_job`` table, so pending work survives a restart and
+    several processes can share the queue (rows are claimed with SKIP LOCKED).
+    """
+
+    def __init__(self, app=None, workers=INGEST_WORKERS):
+        self.app = None
+        self.workers = workers
+        self._threads = []
+        # job id -> attempt number of the jobs this process is running (its leases)
+        self._leases = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['ingestion_queue'] = self
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            self._stop.clear()
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._worker_loop, name=f"ingest-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            thread = threading.Thread(target=self._heartbeat_loop, name="ingest-heartbeat", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def enqueue(self, source, source_type, session_id, document_id=None, link_id=None, kind='ingest'):
+        # kind: ingest / refresh, or summary (queued by the worker once a source is ingested)
+        job = IngestionJob(
+            session_id=session_id,
+            document_id=document_id,
+            link_id=link_id,
+            source=source,
+            source_type=source_type,
+            kind=kind,
+            status='pending',
+        )
+        db.session.add(job)
+        db.session.commit()
+        # Workers start lazily so that importing the app never spawns threads
+        self.start()
+        self._wakeup.set()
+        return job
+
+    def _worker_loop(self):
+        while not self._stop.is_set():
+            job_id = None
+            with self.app.app_context():
+                try:
+                    job_id = self._claim_next()
+                    if job_id is not None:
+                        self._run(job_id)
+                except Exception as e:
+                    db.session.rollback()
+                    logger.exception("Ingestion worker error: %s", e)
+                finally:
+                    db.session.remove()
+            if job_id is None:
+                self._wakeup.wait(INGEST_POLL_INTERVAL)
+                self._wakeup.clear()
+
+    def _heartbeat_loop(self):
+        # Extraction, OCR and waiting for an admission slot report no progress; touching
+        # updated_at keeps those jobs from being reclaimed while this process still runs them
+        while not self._stop.wait(INGEST_HEARTBEAT_SECONDS):
+            with self._lock:
+                leases = list(self._leases.items())
+            if not leases:
+                continue
+            with self.app.app_context():
+                try:
+                    for job_id, attempts in leases:
+                        IngestionJob.query.filter_by(id=job_id, status='running', attempts=attempts).update(
+                            {'updated_at': db.func.current_timestamp()}, synchronize_session=False)
+                    db.session.commit()
+                except Exception as e:
+                    db.session.rollback()
+                    logger.warning("Ingestion heartbeat failed: %s", e)
+                finally:
+                    db.session.remove()
+
+    def _claim_next(self):
+        stale_before = db.func.current_timestamp() - timedelta(seconds=INGEST_STALE_SECONDS)
+        job = (
+            IngestionJob.query
+            .filter(or_(
+                IngestionJob.status == 'pending',
+                and_(IngestionJob.status == 'running', IngestionJob.updated_at < stale_before),
+            ))
+            .order_by(IngestionJob.id)
+            .with_for_update(skip_locked=True)
+            .first()
+        )
+        if job is None:
+            db.session.commit()
+            return None
+        if job.attempts >= INGEST_MAX_ATTEMPTS:
+            self._finish(job, 'failed', error=job.error or "Too many attempts")
+            db.session.commit()
+            return None
+        # Compare-and-swap on (status, attempts) so two workers never both win the same row
+        claimed = IngestionJob.query.filter_by(id=job.id, status=job.status, attempts=job.attempts).update({
+            'status': 'running',
+            'attempts': IngestionJob.attempts + 1,
+            'error': None,
+            'started_at': db.func.current_timestamp(),
+            'updated_at': db.func.current_timestamp(),
+        }, synchronize_session=False)
+        db.session.commit()
+        return job.id if claimed else None
+
+    def _run(self, job_id):
+        job = db.session.get(IngestionJob, job_id)
+        attempts = job.attempts
+
+        def on_progress(done, total):
+            # Only the attempt that holds the lease may write; a reclaimed one stops here
+            owned = IngestionJob.query.filter_by(id=job_id, status='running', attempts=attempts).update({
+                'chunks_processed': done,
+                'chunks_total': total,
+                'updated_at': db.func.current_timestamp(),
+            }, synchronize_session=False)
+            db.session.commit()
+            if not owned:
+                raise JobLost(f"Job {job_id} attempt {attempts} was reclaimed")
+
+        # A refresh swaps chunks in one transaction, so a failed attempt leaves the old version intact
+        refresh = job.kind == 'refresh'
+        kind = job.kind
+        trace = start_trace(f"{kind} job {job_id} ({job.source})")
+        status = 'failed'
+        count = 0
+        with self._lock:
+            self._leases[job_id] = attempts
+        try:
+            if kind == 'summary':
+                # Map-reduce summary for overview questions; the source is already usable without it.
+                # Progress counts LLM calls and keeps updated_at fresh so the job is not reclaimed as stale
+                summarize_source(job.document_id, job.link_id, on_progress=on_progress)
+            else:
+                if job.attempts > 1 and not refresh:
+                    # A previous attempt may have stored chunks before dying
+                    self._clear_chunks(job)
+                count = (refresh_source if refresh else process_and_store_chunks)(
+                    job.source,
+                    job.source_type,
+                    job.session_id,
+                    document_id=job.document_id,
+                    link_id=job.link_id,
+                    on_progress=on_progress,
+                )
+                job.chunks_processed = count
+                job.chunks_total = count
+            self._finish(job, 'done')
+            status = 'done'
+        except JobLost:
+            # The new owner clears and rewrites the chunks; touching them here would race it
+            logger.warning("Ingestion job %s attempt %s was reclaimed, abandoning it", job_id, attempts)
+            db.session.rollback()
+            finish_trace(trace, SLOW_INGEST_SECONDS)
+            return
+        except Exception as e:
+            logger.exception("Ingestion job %s failed", job_id)
+            db.session.rollback()
+            job = db.session.get(IngestionJob, job_id)
+            if kind == 'ingest':
+                # Chunks are committed group by group; drop the ones from this failed attempt
+                self._clear_chunks(job)
+            self._finish(job, 'failed', error=str(e))
+        finally:
+            with self._lock:
+                self._leases.pop(job_id, None)
+        db.session.commit()
+        if refresh:
+            # A successful refresh has moved its staged upload into place
+            discard_staged(job.source)
+        seconds = finish_trace(trace, SLOW_INGEST_SECONDS)
+        INGEST_JOB_SECONDS.observe(seconds, kind=kind, status=status)
+        if status == 'done' and kind != 'summary':
+            INGEST_CHUNKS.inc(count, kind=kind)
+            if seconds > 0:
+                INGEST_CHUNKS_PER_SECOND.set(count / seconds, kind=kind)
+            if count and SUMMARIES_ENABLED and needs_summary(job.document_id, job.link_id):
+                self.enqueue(job.source, job.source_type, job.session_id,
+                             document_id=job.document_id, link_id=job.link_id, kind='summary')
+
+    def _clear_chunks(self, job):
+        if job.document_id:
+            DocumentChunk.query.filter_by(document_id=job.document_id).delete()
+        if job.link_id:
+            DocumentChunk.query.filter_by(link_id=job.link_id).delete()
+        db.session.commit()
+        vector_cache.invalidate(job.session_id)
+
+    def _finish(self, job, status, error=None):
+        job.status = status
+        job.error = error
+        job.finished_at = db.func.current_timestamp()
+        if job.kind == 'summary':
+            # Summaries change neither the source's status nor its chunks
+            return
+        source_status = 'ready' if status == 'done' or job.kind == 'refresh' else 'failed'
+        if job.document_id:
+            DBDocument.query.filter_by(id=job.document_id).update({'status': source_status})
+            answer_cache.invalidate_source("file", job.document_id)
+        if job.link_id:
+            Link.query.filter_by(id=job.link_id).update({'status': source_status})
+            answer_cache.invalidate_source("link", job.link_id)
+
+def queue_depth():
+    # Jobs waiting or running, across every process sharing the queue (read at scrape time)
+    rows = db.session.execute(
+        select(IngestionJob.status, func.count())
+        .where(IngestionJob.status.in_(('pending', 'running')))
+        .group_by(IngestionJob.status)
+    ).all()
+    depth = {('pending',): 0, ('running',): 0}
+    depth.update(((status,), count) for status, count in rows)
+    return depth
+
+INGEST_QUEUE_DEPTH = Gauge('ingest_queue_depth', 'Ingestion jobs by status', ('status',), collect=queue_depth)
+
+ingestion_queue = IngestionQueue()
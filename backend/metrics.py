@@ -0,0 +1,236 @@
+import os
+import time
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Requests (and ingestion jobs) slower than this many seconds are logged with their stage breakdown
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", "5"))
+SLOW_INGEST_SECONDS = float(os.getenv("SLOW_INGEST_SECONDS", "120"))
+# Histogram buckets (seconds) shared by the latency metrics
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in zip(names, values)) + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    """Base of the metrics below: a name, a help text and values per label tuple."""
+
+    type = 'untyped'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, self.labelnames, key, value) for key, value in self._values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for name, labelnames, key, value in self.samples():
+            lines.append(f"{name}{_format_labels(labelnames, key)} {_format_value(value)}")
+        return lines
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def __init__(self, name, help, labels=(), collect=None):
+        super().__init__(name, help, labels)
+        # collect() -> {label tuple: value}, evaluated at scrape time
+        self.collect = collect
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def samples(self):
+        if self.collect is None:
+            return super().samples()
+        try:
+            values = self.collect()
+        except Exception as e:
+            logger.warning("Collecting %s failed: %s", self.name, e)
+            return []
+        return [(self.name, self.labelnames, tuple(str(v) for v in key), value) for key, value in values.items()]
+
+class CollectedCounter(Gauge):
+    # Counter whose values are kept elsewhere (e.g. the cache statistics) and read at scrape time
+    type = 'counter'
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    def samples(self):
+        samples = []
+        labelnames = self.labelnames + ('le',)
+        with self._lock:
+            for key, (counts, total, count) in self._values.items():
+                for bound, bucket_count in zip(self.buckets, counts):
+                    samples.append((f"{self.name}_bucket", labelnames, key + (_format_value(bound),), bucket_count))
+                samples.append((f"{self.name}_sum", self.labelnames, key, total))
+                samples.append((f"{self.name}_count", self.labelnames, key, count))
+        return samples
+
+class Registry:
+    # Per process: behind several gunicorn workers each scrape sees one worker's values
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Metrics shared by the app, the chat pipeline and ingestion
+HTTP_REQUEST_SECONDS = Histogram(
+    'http_request_duration_seconds', 'HTTP request latency, streamed bodies included',
+    ('method', 'endpoint', 'status'),
+)
+STAGE_SECONDS = Histogram(
+    'pipeline_stage_duration_seconds', 'Time spent per stage of the ask and ingest pipelines',
+    ('pipeline', 'stage'),
+)
+TOKENS = Counter('chatbot_tokens_total', 'Tokens of retrieved context, packed context and answers', ('kind',))
+INGEST_CHUNKS = Counter('ingest_chunks_total', 'Chunks stored by ingestion jobs', ('kind',))
+INGEST_EMBEDDED = Counter('ingest_embedded_chunks_total', 'Chunks sent to the embedding model (not deduplicated)')
+INGEST_JOB_SECONDS = Histogram(
+    'ingest_job_duration_seconds', 'Ingestion job latency', ('kind', 'status'),
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800),
+)
+INGEST_CHUNKS_PER_SECOND = Gauge('ingest_chunks_per_second', 'Throughput of the last finished ingestion job', ('kind',))
+
+# Request traces: the stages of the current request or job, for the slow-request log
+_current_trace = contextvars.ContextVar('trace', default=None)
+
+class Trace:
+    def __init__(self, name):
+        self.name = name
+        self.started = time.perf_counter()
+        self.stages = {}
+
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def breakdown(self):
+        return ', '.join(f"{stage}={seconds * 1000:.0f}ms" for stage, seconds in self.stages.items())
+
+def start_trace(name):
+    trace = Trace(name)
+    _current_trace.set(trace)
+    return trace
+
+def activate(trace):
+    # Re-attach a trace in code that runs outside the context that started it (streamed bodies)
+    _current_trace.set(trace)
+
+def finish_trace(trace, threshold=SLOW_REQUEST_SECONDS):
+    seconds = trace.elapsed()
+    if threshold and seconds >= threshold:
+        logger.warning("Slow %s: %.2fs (%s)", trace.name, seconds, trace.breakdown() or "no stages recorded")
+    if _current_trace.get() is trace:
+        _current_trace.set(None)
+    return seconds
+
+def record(pipeline, stage_name, seconds):
+    STAGE_SECONDS.observe(seconds, pipeline=pipeline, stage=stage_name)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(stage_name, seconds)
+
+@contextmanager
+def stage(pipeline, stage_name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(pipeline, stage_name, time.perf_counter() - started)
+
+class TimedIterator:
+    """Wraps a lazy iterator and records the time spent producing its items as one stage.
+
+    With ``inner`` (another TimedIterator feeding this one) only the time of this
+    step is recorded, e.g. splitting without the extraction it pulls from.
+    """
+
+    def __init__(self, iterable, pipeline, stage_name, inner=None):
+        self.iterable = iterable
+        self.pipeline = pipeline
+        self.stage_name = stage_name
+        self.inner = inner
+        self.seconds = 0.0
+
+    def __iter__(self):
+        iterator = iter(self.iterable)
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    self.seconds += time.perf_counter() - started
+                yield item
+        finally:
+            inner_seconds = self.inner.seconds if self.inner is not None else 0.0
+            record(self.pipeline, self.stage_name, max(0.0, self.seconds - inner_seconds))
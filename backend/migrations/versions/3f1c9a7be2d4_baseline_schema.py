@@ -0,0 +1,81 @@
+"""baseline schema
+
+Revision ID: 3f1c9a7be2d4
+Revises: 
+Create Date: 2026-10-18 09:12:41.503127
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from pgvector.sqlalchemy import Vector
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c9a7be2d4'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Databases created earlier with db.create_all() already have these tables
+    op.execute('CREATE EXTENSION IF NOT EXISTS vector')
+    op.create_table('chat_session',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=100), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    if_not_exists=True
+    )
+    op.create_table('db_document',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('session_id', sa.Integer(), nullable=True),
+    sa.Column('filename', sa.String(length=255), nullable=False),
+    sa.Column('filepath', sa.String(length=255), nullable=False),
+    sa.Column('uploaded_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['session_id'], ['chat_session.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    if_not_exists=True
+    )
+    op.create_table('link',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('session_id', sa.Integer(), nullable=True),
+    sa.Column('name', sa.String(length=255), nullable=True),
+    sa.Column('url', sa.String(length=255), nullable=False),
+    sa.Column('added_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['session_id'], ['chat_session.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    if_not_exists=True
+    )
+    op.create_table('chat_history',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('session_id', sa.Integer(), nullable=True),
+    sa.Column('is_user', sa.Boolean(), nullable=True),
+    sa.Column('message', sa.Text(), nullable=False),
+    sa.Column('timestamp', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['session_id'], ['chat_session.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    if_not_exists=True
+    )
+    op.create_table('document_chunk',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('session_id', sa.Integer(), nullable=True),
+    sa.Column('document_id', sa.Integer(), nullable=True),
+    sa.Column('link_id', sa.Integer(), nullable=True),
+    sa.Column('chunk_text', sa.Text(), nullable=False),
+    sa.Column('embedding', Vector(768), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['document_id'], ['db_document.id'], ),
+    sa.ForeignKeyConstraint(['link_id'], ['link.id'], ),
+    sa.ForeignKeyConstraint(['session_id'], ['chat_session.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    if_not_exists=True
+    )
+
+
+def downgrade():
+    op.drop_table('document_chunk')
+    op.drop_table('chat_history')
+    op.drop_table('link')
+    op.drop_table('db_document')
+    op.drop_table('chat_session')
@@ -0,0 +1,30 @@
+"""embedding model of each chunk content
+
+Revision ID: 4c9d2f61a8b3
+Revises: e7b3c2a9f054
+Create Date: 2026-10-20 09:41:27.318604
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4c9d2f61a8b3'
+down_revision = 'e7b3c2a9f054'
+branch_labels = None
+depends_on = None
+
+# Every vector stored before this revision came from the Together embedding model
+PREVIOUS_MODEL = 'togethercomputer/m2-bert-80M-32k-retrieval'
+
+
+def upgrade():
+    # Nullable without a default: adding the column does not rewrite the table
+    op.add_column('chunk_content', sa.Column('embedding_model', sa.String(length=200), nullable=True), if_not_exists=True)
+    op.execute(sa.text("UPDATE chunk_content SET embedding_model = :model WHERE embedding_model IS NULL")
+               .bindparams(model=PREVIOUS_MODEL))
+
+
+def downgrade():
+    op.drop_column('chunk_content', 'embedding_model')
@@ -0,0 +1,34 @@
+"""source summaries for overview questions
+
+Revision ID: 5d8f3a6c1e27
+Revises: 9c4e2b7d5a13
+Create Date: 2026-10-18 21:47:12.508263
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d8f3a6c1e27'
+down_revision = '9c4e2b7d5a13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('source_summary',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('content_hash', sa.String(length=64), nullable=False),
+    sa.Column('summary', sa.Text(), nullable=False),
+    sa.Column('levels', sa.Integer(), nullable=False),
+    sa.Column('chunks', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('content_hash'),
+    if_not_exists=True
+    )
+
+
+def downgrade():
+    op.drop_table('source_summary')
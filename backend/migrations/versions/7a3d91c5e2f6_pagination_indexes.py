@@ -0,0 +1,36 @@
+"""composite indexes for keyset pagination and per-source chunk lookups
+
+Revision ID: 7a3d91c5e2f6
+Revises: f0c27e9d4b18
+Create Date: 2026-10-18 19:41:27.604913
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7a3d91c5e2f6'
+down_revision = 'f0c27e9d4b18'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ('ix_db_document_session_id_id', 'db_document', ['session_id', 'id']),
+    ('ix_link_session_id_id', 'link', ['session_id', 'id']),
+    ('ix_chat_history_session_timestamp', 'chat_history', ['session_id', 'timestamp', 'id']),
+    ('ix_document_chunk_session_document', 'document_chunk', ['session_id', 'document_id']),
+    ('ix_document_chunk_session_link', 'document_chunk', ['session_id', 'link_id']),
+]
+
+
+def upgrade():
+    # Build concurrently so the app keeps serving while long histories are indexed
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, unique=False, postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade():
+    for name, table, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
@@ -0,0 +1,51 @@
+"""ingestion jobs and source status
+
+Revision ID: 8b27d04e6a91
+Revises: 3f1c9a7be2d4
+Create Date: 2026-10-18 10:03:17.284410
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b27d04e6a91'
+down_revision = '3f1c9a7be2d4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('db_document', sa.Column('status', sa.String(length=20), server_default='ready', nullable=False), if_not_exists=True)
+    op.add_column('link', sa.Column('status', sa.String(length=20), server_default='ready', nullable=False), if_not_exists=True)
+    op.create_table('ingestion_job',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('session_id', sa.Integer(), nullable=True),
+    sa.Column('document_id', sa.Integer(), nullable=True),
+    sa.Column('link_id', sa.Integer(), nullable=True),
+    sa.Column('source', sa.Text(), nullable=False),
+    sa.Column('source_type', sa.String(length=10), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('chunks_processed', sa.Integer(), nullable=False),
+    sa.Column('chunks_total', sa.Integer(), nullable=True),
+    sa.Column('error', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('started_at', sa.DateTime(), nullable=True),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['document_id'], ['db_document.id'], ),
+    sa.ForeignKeyConstraint(['link_id'], ['link.id'], ),
+    sa.ForeignKeyConstraint(['session_id'], ['chat_session.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    if_not_exists=True
+    )
+    op.create_index(op.f('ix_ingestion_job_status'), 'ingestion_job', ['status'], unique=False, if_not_exists=True)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_ingestion_job_status'), table_name='ingestion_job')
+    op.drop_table('ingestion_job')
+    op.drop_column('link', 'status')
+    op.drop_column('db_document', 'status')
@@ -0,0 +1,37 @@
+"""search_vector as a trigger-maintained column
+
+Revision ID: 8e51c7a3d940
+Revises: 4c9d2f61a8b3
+Create Date: 2026-10-20 15:03:18.604127
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8e51c7a3d940'
+down_revision = '4c9d2f61a8b3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Databases migrated before b62f4e8d1a07 switched to a trigger still have a generated
+    # search_vector; DROP EXPRESSION keeps the stored values and does not rewrite the table
+    op.execute("ALTER TABLE chunk_content ALTER COLUMN search_vector DROP EXPRESSION IF EXISTS")
+    op.execute(
+        "CREATE OR REPLACE FUNCTION chunk_content_search_vector() RETURNS trigger AS $$ "
+        "BEGIN NEW.search_vector := to_tsvector('simple', NEW.chunk_text); RETURN NEW; END "
+        "$$ LANGUAGE plpgsql"
+    )
+    op.execute("DROP TRIGGER IF EXISTS chunk_content_search_vector ON chunk_content")
+    op.execute(
+        "CREATE TRIGGER chunk_content_search_vector BEFORE INSERT OR UPDATE OF chunk_text ON chunk_content "
+        "FOR EACH ROW EXECUTE FUNCTION chunk_content_search_vector()"
+    )
+
+
+def downgrade():
+    # b62f4e8d1a07 now creates the same trigger, so there is nothing to undo
+    pass
@@ -0,0 +1,31 @@
+"""update the vector extension for compact (halfvec / binary) indexes
+
+Revision ID: 9c4e2b7d5a13
+Revises: 7a3d91c5e2f6
+Create Date: 2026-10-18 20:26:51.117342
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9c4e2b7d5a13'
+down_revision = '7a3d91c5e2f6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # halfvec and binary_quantize arrive with pgvector 0.7. Databases created with an
+    # older extension keep their old SQL definitions until the extension is updated,
+    # even after the server binaries are upgraded. This is a no-op when it is current.
+    op.execute("ALTER EXTENSION vector UPDATE")
+    # The compact indexes themselves are built with `flask vectors build halfvec|binary`:
+    # an HNSW build over every chunk is too slow for a migration and only the mode in use
+    # (VECTOR_STORAGE) needs one
+
+
+def downgrade():
+    # Extension versions are not rolled back; the compact indexes are dropped with `flask vectors drop`
+    pass
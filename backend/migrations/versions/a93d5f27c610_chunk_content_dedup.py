@@ -0,0 +1,96 @@
+"""shared chunk_content table and source content hashes
+
+Revision ID: a93d5f27c610
+Revises: e1a46b2c8d53
+Create Date: 2026-10-18 15:42:08.613920
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from pgvector.sqlalchemy import Vector
+
+
+# revision identifiers, used by Alembic.
+revision = 'a93d5f27c610'
+down_revision = 'e1a46b2c8d53'
+branch_labels = None
+depends_on = None
+
+# Must match providers.EMBEDDING_MODEL, which is part of every chunk hash
+EMBEDDING_MODEL = 'togethercomputer/m2-bert-80M-32k-retrieval'
+CHUNK_HASH_SQL = "encode(sha256(convert_to(:model || E'\\n' || dc.chunk_text, 'UTF8')), 'hex')"
+
+
+def upgrade():
+    op.add_column('db_document', sa.Column('content_hash', sa.String(length=64), nullable=True), if_not_exists=True)
+    op.create_index(op.f('ix_db_document_content_hash'), 'db_document', ['content_hash'], unique=False, if_not_exists=True)
+    op.add_column('link', sa.Column('content_hash', sa.String(length=64), nullable=True), if_not_exists=True)
+    op.create_index(op.f('ix_link_content_hash'), 'link', ['content_hash'], unique=False, if_not_exists=True)
+    op.create_table('chunk_content',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('content_hash', sa.String(length=64), nullable=False),
+    sa.Column('chunk_text', sa.Text(), nullable=False),
+    sa.Column('embedding', Vector(768), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('content_hash'),
+    if_not_exists=True
+    )
+    op.add_column('document_chunk', sa.Column('content_id', sa.Integer(), nullable=True), if_not_exists=True)
+
+    # Move every distinct chunk text (and its embedding) into chunk_content
+    op.execute(sa.text(
+        "INSERT INTO chunk_content (content_hash, chunk_text, embedding, created_at) "
+        f"SELECT DISTINCT ON (1) {CHUNK_HASH_SQL}, dc.chunk_text, dc.embedding, dc.created_at "
+        "FROM document_chunk dc ORDER BY 1, dc.id "
+        "ON CONFLICT (content_hash) DO NOTHING"
+    ).bindparams(model=EMBEDDING_MODEL))
+    op.execute(sa.text(
+        "UPDATE document_chunk dc SET content_id = cc.id FROM chunk_content cc "
+        f"WHERE cc.content_hash = {CHUNK_HASH_SQL}"
+    ).bindparams(model=EMBEDDING_MODEL))
+
+    op.alter_column('document_chunk', 'content_id', nullable=False)
+    op.create_foreign_key(op.f('document_chunk_content_id_fkey'), 'document_chunk', 'chunk_content', ['content_id'], ['id'])
+    op.create_index(op.f('ix_document_chunk_content_id'), 'document_chunk', ['content_id'], unique=False, if_not_exists=True)
+    op.drop_index('ix_document_chunk_embedding_hnsw', table_name='document_chunk', if_exists=True)
+    op.drop_column('document_chunk', 'embedding')
+    op.drop_column('document_chunk', 'chunk_text')
+    op.create_index(
+        'ix_chunk_content_embedding_hnsw',
+        'chunk_content',
+        ['embedding'],
+        unique=False,
+        postgresql_using='hnsw',
+        postgresql_with={'m': 16, 'ef_construction': 64},
+        postgresql_ops={'embedding': 'vector_cosine_ops'},
+        if_not_exists=True,
+    )
+
+
+def downgrade():
+    op.add_column('document_chunk', sa.Column('chunk_text', sa.Text(), nullable=True))
+    op.add_column('document_chunk', sa.Column('embedding', Vector(768), nullable=True))
+    op.execute(
+        "UPDATE document_chunk dc SET chunk_text = cc.chunk_text, embedding = cc.embedding "
+        "FROM chunk_content cc WHERE cc.id = dc.content_id"
+    )
+    op.alter_column('document_chunk', 'chunk_text', nullable=False)
+    op.create_index(
+        'ix_document_chunk_embedding_hnsw',
+        'document_chunk',
+        ['embedding'],
+        unique=False,
+        postgresql_using='hnsw',
+        postgresql_with={'m': 16, 'ef_construction': 64},
+        postgresql_ops={'embedding': 'vector_cosine_ops'},
+    )
+    op.drop_index(op.f('ix_document_chunk_content_id'), table_name='document_chunk')
+    op.drop_constraint(op.f('document_chunk_content_id_fkey'), 'document_chunk', type_='foreignkey')
+    op.drop_column('document_chunk', 'content_id')
+    op.drop_index('ix_chunk_content_embedding_hnsw', table_name='chunk_content')
+    op.drop_table('chunk_content')
+    op.drop_index(op.f('ix_link_content_hash'), table_name='link')
+    op.drop_column('link', 'content_hash')
+    op.drop_index(op.f('ix_db_document_content_hash'), table_name='db_document')
+    op.drop_column('db_document', 'content_hash')
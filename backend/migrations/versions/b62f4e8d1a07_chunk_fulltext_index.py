@@ -0,0 +1,62 @@
+"""full-text search vector and gin index on chunk_content
+
+Revision ID: b62f4e8d1a07
+Revises: d4b8e0c36f19
+Create Date: 2026-10-18 18:12:44.530172
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'b62f4e8d1a07'
+down_revision = 'd4b8e0c36f19'
+branch_labels = None
+depends_on = None
+
+# Rows filled per backfill transaction
+BACKFILL_BATCH = 5000
+
+
+def upgrade():
+    # A generated column would be computed for every row under an ACCESS EXCLUSIVE lock
+    # (a table rewrite); a nullable column without a default is a catalog change only
+    op.add_column('chunk_content', sa.Column('search_vector', postgresql.TSVECTOR(), nullable=True), if_not_exists=True)
+    # New and edited rows get their vector from a trigger, so ingestion never writes it
+    op.execute(
+        "CREATE OR REPLACE FUNCTION chunk_content_search_vector() RETURNS trigger AS $$ "
+        "BEGIN NEW.search_vector := to_tsvector('simple', NEW.chunk_text); RETURN NEW; END "
+        "$$ LANGUAGE plpgsql"
+    )
+    op.execute("DROP TRIGGER IF EXISTS chunk_content_search_vector ON chunk_content")
+    op.execute(
+        "CREATE TRIGGER chunk_content_search_vector BEFORE INSERT OR UPDATE OF chunk_text ON chunk_content "
+        "FOR EACH ROW EXECUTE FUNCTION chunk_content_search_vector()"
+    )
+    with op.get_context().autocommit_block():
+        # Existing rows in short transactions, so row locks are held briefly and ingestion keeps going
+        bind = op.get_bind()
+        while bind.execute(sa.text(
+            "UPDATE chunk_content SET search_vector = to_tsvector('simple', chunk_text) "
+            "WHERE id IN (SELECT id FROM chunk_content WHERE search_vector IS NULL LIMIT :batch)"
+        ), {'batch': BACKFILL_BATCH}).rowcount:
+            pass
+        # CONCURRENTLY builds the index without blocking inserts
+        op.create_index(
+            'ix_chunk_content_search_vector',
+            'chunk_content',
+            ['search_vector'],
+            unique=False,
+            postgresql_using='gin',
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+
+
+def downgrade():
+    op.drop_index('ix_chunk_content_search_vector', table_name='chunk_content')
+    op.execute("DROP TRIGGER IF EXISTS chunk_content_search_vector ON chunk_content")
+    op.execute("DROP FUNCTION IF EXISTS chunk_content_search_vector()")
+    op.drop_column('chunk_content', 'search_vector')
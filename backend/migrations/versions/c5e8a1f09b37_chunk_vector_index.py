@@ -0,0 +1,42 @@
+"""hnsw index on document_chunk.embedding
+
+Revision ID: c5e8a1f09b37
+Revises: 8b27d04e6a91
+Create Date: 2026-10-18 11:26:52.918034
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5e8a1f09b37'
+down_revision = '8b27d04e6a91'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Build concurrently so ingestion and /ask keep working on large tables
+    with op.get_context().autocommit_block():
+        op.create_index(op.f('ix_document_chunk_session_id'), 'document_chunk', ['session_id'], unique=False, postgresql_concurrently=True, if_not_exists=True)
+        op.create_index(op.f('ix_document_chunk_document_id'), 'document_chunk', ['document_id'], unique=False, postgresql_concurrently=True, if_not_exists=True)
+        op.create_index(op.f('ix_document_chunk_link_id'), 'document_chunk', ['link_id'], unique=False, postgresql_concurrently=True, if_not_exists=True)
+        op.create_index(
+            'ix_document_chunk_embedding_hnsw',
+            'document_chunk',
+            ['embedding'],
+            unique=False,
+            postgresql_using='hnsw',
+            postgresql_with={'m': 16, 'ef_construction': 64},
+            postgresql_ops={'embedding': 'vector_cosine_ops'},
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+
+
+def downgrade():
+    op.drop_index('ix_document_chunk_embedding_hnsw', table_name='document_chunk')
+    op.drop_index(op.f('ix_document_chunk_link_id'), table_name='document_chunk')
+    op.drop_index(op.f('ix_document_chunk_document_id'), table_name='document_chunk')
+    op.drop_index(op.f('ix_document_chunk_session_id'), table_name='document_chunk')
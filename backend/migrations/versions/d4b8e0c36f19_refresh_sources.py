@@ -0,0 +1,28 @@
+"""refresh jobs and link validators
+
+Revision ID: d4b8e0c36f19
+Revises: a93d5f27c610
+Create Date: 2026-10-18 16:57:31.208455
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4b8e0c36f19'
+down_revision = 'a93d5f27c610'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('ingestion_job', sa.Column('kind', sa.String(length=10), server_default='ingest', nullable=False), if_not_exists=True)
+    op.add_column('link', sa.Column('etag', sa.String(length=255), nullable=True), if_not_exists=True)
+    op.add_column('link', sa.Column('last_modified', sa.String(length=64), nullable=True), if_not_exists=True)
+
+
+def downgrade():
+    op.drop_column('link', 'last_modified')
+    op.drop_column('link', 'etag')
+    op.drop_column('ingestion_job', 'kind')
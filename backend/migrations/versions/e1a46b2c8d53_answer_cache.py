@@ -0,0 +1,44 @@
+"""shared answer cache
+
+Revision ID: e1a46b2c8d53
+Revises: c5e8a1f09b37
+Create Date: 2026-10-18 13:41:05.772913
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from pgvector.sqlalchemy import Vector
+
+
+# revision identifiers, used by Alembic.
+revision = 'e1a46b2c8d53'
+down_revision = 'c5e8a1f09b37'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('answer_cache_entry',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('session_id', sa.Integer(), nullable=True),
+    sa.Column('cache_key', sa.String(length=64), nullable=False),
+    sa.Column('question', sa.Text(), nullable=False),
+    sa.Column('question_embedding', Vector(768), nullable=True),
+    sa.Column('answer', sa.Text(), nullable=False),
+    sa.Column('sources', sa.JSON(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('expires_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['session_id'], ['chat_session.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    if_not_exists=True
+    )
+    op.create_index(op.f('ix_answer_cache_entry_cache_key'), 'answer_cache_entry', ['cache_key'], unique=False, if_not_exists=True)
+    op.create_index(op.f('ix_answer_cache_entry_expires_at'), 'answer_cache_entry', ['expires_at'], unique=False, if_not_exists=True)
+    op.create_index(op.f('ix_answer_cache_entry_session_id'), 'answer_cache_entry', ['session_id'], unique=False, if_not_exists=True)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_answer_cache_entry_session_id'), table_name='answer_cache_entry')
+    op.drop_index(op.f('ix_answer_cache_entry_expires_at'), table_name='answer_cache_entry')
+    op.drop_index(op.f('ix_answer_cache_entry_cache_key'), table_name='answer_cache_entry')
+    op.drop_table('answer_cache_entry')
@@ -0,0 +1,30 @@
+"""chunk position within its source
+
+Revision ID: e7b3c2a9f054
+Revises: 5d8f3a6c1e27
+Create Date: 2026-10-19 10:12:40.731902
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7b3c2a9f054'
+down_revision = '5d8f3a6c1e27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('document_chunk', sa.Column('position', sa.Integer(), server_default='0', nullable=False), if_not_exists=True)
+    # Existing chunks are numbered in id order, which is the order they were split in
+    op.execute(
+        "UPDATE document_chunk dc SET position = numbered.position FROM ("
+        "SELECT id, row_number() OVER (PARTITION BY document_id, link_id ORDER BY id) - 1 AS position "
+        "FROM document_chunk) numbered WHERE numbered.id = dc.id"
+    )
+
+
+def downgrade():
+    op.drop_column('document_chunk', 'position')
@@ -0,0 +1,55 @@
+"""chunk_content word sets for source attribution
+
+Revision ID: f0c27e9d4b18
+Revises: b62f4e8d1a07
+Create Date: 2026-10-18 19:04:12.318406
+
+"""
+import re
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'f0c27e9d4b18'
+down_revision = 'b62f4e8d1a07'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+
+
+def upgrade():
+    op.add_column('chunk_content', sa.Column('terms', postgresql.ARRAY(sa.Text()), nullable=True), if_not_exists=True)
+
+    # Backfill with the same tokenisation as context_packing.chunk_terms (Python \w, not Postgres')
+    connection = op.get_bind()
+    chunk_content = sa.table(
+        'chunk_content',
+        sa.column('id', sa.Integer),
+        sa.column('chunk_text', sa.Text),
+        sa.column('terms', postgresql.ARRAY(sa.Text())),
+    )
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select(chunk_content.c.id, chunk_content.c.chunk_text)
+            .where(chunk_content.c.id > last_id, chunk_content.c.terms.is_(None))
+            .order_by(chunk_content.c.id)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        connection.execute(
+            chunk_content.update()
+            .where(chunk_content.c.id == sa.bindparam('row_id'))
+            .values(terms=sa.bindparam('row_terms')),
+            [{'row_id': row.id, 'row_terms': sorted(set(re.findall(r'\w+', row.chunk_text.lower())))} for row in rows],
+        )
+        last_id = rows[-1].id
+
+
+def downgrade():
+    op.drop_column('chunk_content', 'terms')
@@ -1,5 +1,6 @@
 from database import db
 from pgvector.sqlalchemy import Vector
+from sqlalchemy.dialects.postgresql import ARRAY, TSVECTOR
 
 # Define models
 class ChatSession(db.Model):
@@ -8,31 +9,112 @@ class ChatSession(db.Model):
     created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
 
 class DBDocument(db.Model):
+    # Keyset pagination of a session's files
+    __table_args__ = (db.Index('ix_db_document_session_id_id', 'session_id', 'id'),)
     id = db.Column(db.Integer, primary_key=True)
     session_id = db.Column(db.Integer, db.ForeignKey('chat_session.id'))
     filename = db.Column(db.String(255), nullable=False)
     filepath = db.Column(db.String(255), nullable=False)
+    content_hash = db.Column(db.String(64), nullable=True, index=True)  # sha256 of the file bytes
+    status = db.Column(db.String(20), nullable=False, default='ready', server_default='ready')  # processing / ready / failed
     uploaded_at = db.Column(db.DateTime, default=db.func.current_timestamp())
 
 class Link(db.Model):
+    __table_args__ = (db.Index('ix_link_session_id_id', 'session_id', 'id'),)
     id = db.Column(db.Integer, primary_key=True)
     session_id = db.Column(db.Integer, db.ForeignKey('chat_session.id'))
     name = db.Column(db.String(255), nullable=True)
     url = db.Column(db.String(255), nullable=False)
+    content_hash = db.Column(db.String(64), nullable=True, index=True)  # sha256 of the extracted page text
+    etag = db.Column(db.String(255), nullable=True)  # Validators for conditional refreshes
+    last_modified = db.Column(db.String(64), nullable=True)
+    status = db.Column(db.String(20), nullable=False, default='ready', server_default='ready')  # processing / ready / failed
     added_at = db.Column(db.DateTime, default=db.func.current_timestamp())
 
 class ChatHistory(db.Model):
+    # Keyset pagination of a session's messages, newest first
+    __table_args__ = (db.Index('ix_chat_history_session_timestamp', 'session_id', 'timestamp', 'id'),)
     id = db.Column(db.Integer, primary_key=True)
     session_id = db.Column(db.Integer, db.ForeignKey('chat_session.id'))
     is_user = db.Column(db.Boolean, default=True)
     message = db.Column(db.Text, nullable=False)
     timestamp = db.Column(db.DateTime, default=db.func.current_timestamp())
     
+class ChunkContent(db.Model):
+    # Chunk text and embedding shared by every DocumentChunk with the same text
+    __table_args__ = (
+        # ANN index for ORDER BY embedding <=> :query (cosine distance)
+        db.Index(
+            'ix_chunk_content_embedding_hnsw',
+            'embedding',
+            postgresql_using='hnsw',
+            postgresql_with={'m': 16, 'ef_construction': 64},
+            postgresql_ops={'embedding': 'vector_cosine_ops'},
+        ),
+        # Full-text index for the lexical half of hybrid retrieval
+        db.Index('ix_chunk_content_search_vector', 'search_vector', postgresql_using='gin'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    content_hash = db.Column(db.String(64), nullable=False, unique=True)  # sha256 of embedding model + chunk text
+    chunk_text = db.Column(db.Text, nullable=False)
+    embedding = db.Column(Vector(768))
+    # Model that produced the embedding; searches only compare vectors of the current one
+    embedding_model = db.Column(db.String(200), nullable=True)
+    terms = db.Column(ARRAY(db.Text), nullable=True)  # Lowercased word set, for source attribution
+    # Stored so ranking does not re-parse the text of every matching chunk; the
+    # chunk_content_search_vector trigger sets it to to_tsvector('simple', chunk_text)
+    search_vector = db.Column(TSVECTOR, server_default=db.FetchedValue(), server_onupdate=db.FetchedValue())
+    created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
+
 class DocumentChunk(db.Model):
+    # Chunks of one source within a session (retrieval filters, refresh, delete)
+    __table_args__ = (
+        db.Index('ix_document_chunk_session_document', 'session_id', 'document_id'),
+        db.Index('ix_document_chunk_session_link', 'session_id', 'link_id'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    session_id = db.Column(db.Integer, db.ForeignKey('chat_session.id'), index=True)
+    document_id = db.Column(db.Integer, db.ForeignKey('db_document.id'), nullable=True, index=True)
+    link_id = db.Column(db.Integer, db.ForeignKey('link.id'), nullable=True, index=True)
+    content_id = db.Column(db.Integer, db.ForeignKey('chunk_content.id'), nullable=False, index=True)
+    # Order of the chunk within its source; ids stop following it once a refresh inserts chunks
+    position = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
+
+class IngestionJob(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     session_id = db.Column(db.Integer, db.ForeignKey('chat_session.id'))
     document_id = db.Column(db.Integer, db.ForeignKey('db_document.id'), nullable=True)
     link_id = db.Column(db.Integer, db.ForeignKey('link.id'), nullable=True)
-    chunk_text = db.Column(db.Text, nullable=False)
-    embedding = db.Column(Vector(768))
-    created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
\ No newline at end of file
+    source = db.Column(db.Text, nullable=False)  # File path or URL
+    source_type = db.Column(db.String(10), nullable=False)  # file / link
+    kind = db.Column(db.String(10), nullable=False, default='ingest', server_default='ingest')  # ingest / refresh / summary / reembed
+    status = db.Column(db.String(20), nullable=False, default='pending', index=True)  # pending / running / done / failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    chunks_processed = db.Column(db.Integer, nullable=False, default=0)
+    chunks_total = db.Column(db.Integer, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, default=db.func.current_timestamp(), onupdate=db.func.current_timestamp())
+
+class AnswerCacheEntry(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    session_id = db.Column(db.Integer, db.ForeignKey('chat_session.id'), index=True)
+    cache_key = db.Column(db.String(64), nullable=False, index=True)  # sha256 of (session, sources, corpus version)
+    question = db.Column(db.Text, nullable=False)
+    question_embedding = db.Column(Vector(768))
+    answer = db.Column(db.Text, nullable=False)
+    sources = db.Column(db.JSON, nullable=False)  # [[type, id], ...]
+    created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+class SourceSummary(db.Model):
+    # Map-reduce summary of an ingested file or page, shared by every source with the same content hash
+    id = db.Column(db.Integer, primary_key=True)
+    content_hash = db.Column(db.String(64), nullable=False, unique=True)  # DBDocument/Link.content_hash
+    summary = db.Column(db.Text, nullable=False)
+    levels = db.Column(db.Integer, nullable=False, default=1)  # Summarisation rounds (1 = the text fit one call)
+    chunks = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
@@ -0,0 +1,61 @@
+import os
+import json
+import base64
+from datetime import datetime
+from sqlalchemy import tuple_
+
+from dotenv import load_dotenv
+load_dotenv()
+
+# Rows per page when the client does not ask for a size, and the largest size it may ask for
+PAGE_SIZE = int(os.getenv("PAGE_SIZE", "50"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "500"))
+
+class InvalidCursor(ValueError):
+    pass
+
+def encode_cursor(values):
+    # Opaque to clients: the sort key of the last row they received
+    values = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor, columns):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except ValueError:
+        raise InvalidCursor(cursor)
+    if not isinstance(values, list) or len(values) != len(columns):
+        raise InvalidCursor(cursor)
+    try:
+        return [
+            datetime.fromisoformat(value) if column.type.python_type is datetime else column.type.python_type(value)
+            for column, value in zip(columns, values)
+        ]
+    except (TypeError, ValueError):
+        raise InvalidCursor(cursor)
+
+def page_size(requested, default=None):
+    if requested is None:
+        return default or PAGE_SIZE
+    try:
+        return max(1, min(int(requested), MAX_PAGE_SIZE))
+    except ValueError:
+        return default or PAGE_SIZE
+
+def keyset_page(session, stmt, keys, limit, cursor=None, descending=False):
+    """Run ``stmt`` ordered by ``keys`` and return (rows, next cursor or None).
+
+    The page starts right after the row the cursor points at, so the cost of a
+    page does not depend on how many rows came before it (unlike OFFSET).
+    ``keys`` must end with a unique column (the primary key) to break ties.
+    """
+    if cursor:
+        after = decode_cursor(cursor, keys)
+        stmt = stmt.where(tuple_(*keys) < tuple_(*after) if descending else tuple_(*keys) > tuple_(*after))
+    stmt = stmt.order_by(*(key.desc() if descending else key for key in keys)).limit(limit + 1)
+    rows = session.execute(stmt).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]._mapping
+    return rows, encode_cursor([last[key] for key in keys])
@@ -0,0 +1,231 @@
+import io
+import os
+import logging
+import time
+import signal
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from dotenv import load_dotenv
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Worker processes used for PDF pages and OCR tiles (0 disables the pool)
+EXTRACT_MAX_WORKERS = int(os.getenv("EXTRACT_MAX_WORKERS", str(os.cpu_count() or 1)))
+# Address-space cap per worker process, in MB (0 = unlimited)
+EXTRACT_WORKER_MEMORY_MB = int(os.getenv("EXTRACT_WORKER_MEMORY_MB", "1024"))
+# Seconds one page (or one OCR tile) may take before it is skipped
+EXTRACT_PAGE_TIMEOUT = float(os.getenv("EXTRACT_PAGE_TIMEOUT", "30"))
+# Pages per task: larger ranges amortise re-opening the PDF in the worker
+EXTRACT_PAGES_PER_TASK = int(os.getenv("EXTRACT_PAGES_PER_TASK", "8"))
+# Documents smaller than this are extracted in-process
+EXTRACT_PARALLEL_MIN_PAGES = int(os.getenv("EXTRACT_PARALLEL_MIN_PAGES", "16"))
+# Images taller than this are OCRed as horizontal tiles in parallel
+EXTRACT_OCR_TILE_HEIGHT = int(os.getenv("EXTRACT_OCR_TILE_HEIGHT", "2000"))
+# OCR the embedded images of PDF pages that have no text layer
+EXTRACT_OCR_SCANNED_PAGES = os.getenv("EXTRACT_OCR_SCANNED_PAGES", "true").lower() in ("1", "true", "yes")
+# Worker processes are replaced after this many tasks to return leaked memory
+EXTRACT_TASKS_PER_CHILD = 50
+
+class PageTimeout(Exception):
+    pass
+
+def _init_worker(memory_mb):
+    if memory_mb:
+        try:
+            import resource
+            limit = memory_mb * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+        except (ImportError, ValueError, OSError):
+            pass
+
+def _raise_timeout(signum, frame):
+    raise PageTimeout()
+
+def _with_timeout(fn, *args):
+    # SIGALRM interrupts a runaway text layer inside a pool worker (main thread of the process).
+    # Ingestion threads cannot use it; OCR, the slow part, has its own timeout (_ocr_image)
+    if not EXTRACT_PAGE_TIMEOUT or threading.current_thread() is not threading.main_thread():
+        return fn(*args)
+    previous = signal.signal(signal.SIGALRM, _raise_timeout)
+    signal.setitimer(signal.ITIMER_REAL, EXTRACT_PAGE_TIMEOUT)
+    try:
+        return fn(*args)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+def _ocr_image(image, timeout=EXTRACT_PAGE_TIMEOUT):
+    # pytesseract kills the tesseract process when it overruns, in any thread
+    import pytesseract
+    try:
+        return pytesseract.image_to_string(image, timeout=timeout or 0)
+    except RuntimeError as e:
+        if 'timeout' in str(e).lower():
+            raise PageTimeout() from e
+        raise
+
+def _ocr_page_images(page):
+    from PIL import Image
+    texts = []
+    deadline = time.monotonic() + EXTRACT_PAGE_TIMEOUT
+    for image_file in page.images:
+        remaining = deadline - time.monotonic()
+        if EXTRACT_PAGE_TIMEOUT and remaining <= 0:
+            raise PageTimeout()
+        with Image.open(io.BytesIO(image_file.data)) as image:
+            texts.append(_ocr_image(image, remaining if EXTRACT_PAGE_TIMEOUT else 0))
+    return '\n'.join(texts)
+
+def _extract_page(page):
+    text = _with_timeout(page.extract_text) or ''
+    if not text.strip() and EXTRACT_OCR_SCANNED_PAGES:
+        # Scanned page: no text layer, read the page image instead
+        text = _ocr_page_images(page)
+    return text
+
+def extract_pdf_pages(pdf_path, start, stop):
+    """Worker task: text of pages [start, stop) of a PDF, one string per page."""
+    import PyPDF2
+    results = []
+    with open(pdf_path, 'rb') as file:
+        reader = PyPDF2.PdfReader(file)
+        for number in range(start, stop):
+            try:
+                results.append(_extract_page(reader.pages[number]))
+            except PageTimeout:
+                logger.warning("Page %d of %s timed out after %ss, skipped", number + 1, pdf_path, EXTRACT_PAGE_TIMEOUT)
+                results.append('')
+            except Exception as e:
+                logger.error("Error processing page %d of %s: %s", number + 1, pdf_path, e)
+                results.append('')
+    return results
+
+def ocr_image_tile(image_path, box):
+    """Worker task: OCR text of one (left, upper, right, lower) tile of an image."""
+    from PIL import Image
+    try:
+        with Image.open(image_path) as image:
+            return _ocr_image(image.crop(box))
+    except PageTimeout:
+        logger.warning("OCR tile %s of %s timed out after %ss, skipped", box, image_path, EXTRACT_PAGE_TIMEOUT)
+        return ''
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    # Spawned (not forked) workers: the web process runs threads, and fork would copy their locks
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=EXTRACT_MAX_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(EXTRACT_WORKER_MEMORY_MB,),
+                max_tasks_per_child=EXTRACT_TASKS_PER_CHILD,
+            )
+        return _pool
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+def _kill_pool(pool):
+    # cancel() cannot stop a running task: kill the workers so a stuck one does not stay busy.
+    # Tasks of other callers fail with BrokenProcessPool and are submitted again (_gather)
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    if hasattr(pool, 'terminate_workers'):  # Python 3.14+
+        pool.terminate_workers()
+        return
+    for process in list((getattr(pool, '_processes', None) or {}).values()):
+        process.terminate()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def _gather(tasks, label):
+    """Run (fn, args, size) tasks on the pool and collect their results in order.
+
+    Pages and tiles time out inside the workers; a task that still overruns its
+    deadline yields empty text and the pool is replaced to stop it.
+    """
+    pool = get_pool()
+    futures = [pool.submit(fn, *args) for fn, args, _ in tasks]
+
+    def resubmit(start):
+        # Tasks from ``start`` on that have no result yet go to the current pool
+        nonlocal pool
+        pool = get_pool()
+        for index in range(start, len(tasks)):
+            future = futures[index]
+            if not future.done() or future.cancelled() or future.exception() is not None:
+                fn, args, _ = tasks[index]
+                futures[index] = pool.submit(fn, *args)
+
+    results = []
+    for index, (_, _, size) in enumerate(tasks):
+        for attempt in range(2):
+            try:
+                results.append(futures[index].result(timeout=EXTRACT_PAGE_TIMEOUT * size + 30 if EXTRACT_PAGE_TIMEOUT else None))
+            except FutureTimeoutError:
+                logger.warning("%s: task timed out, skipped", label)
+                results.append([''] * size if size > 1 else '')
+                _kill_pool(pool)
+                resubmit(index + 1)
+            except BrokenProcessPool:
+                if attempt:
+                    raise
+                # The pool was replaced while this task waited (another caller's task got stuck)
+                resubmit(index)
+                continue
+            break
+    return results
+
+def iter_pdf_pages(pdf_path, page_count):
+    """Page texts of a PDF in order, fanned out over the process pool in page ranges."""
+    ranges = [
+        (start, min(start + EXTRACT_PAGES_PER_TASK, page_count))
+        for start in range(0, page_count, EXTRACT_PAGES_PER_TASK)
+    ]
+    tasks = [(extract_pdf_pages, (pdf_path, start, stop), stop - start) for start, stop in ranges]
+    for pages in _gather(tasks, pdf_path):
+        yield from (pages if isinstance(pages, list) else [pages])
+
+def image_tiles(image_path):
+    """Horizontal strips of a tall image, cut on the lightest row near each boundary."""
+    from PIL import Image, ImageStat
+    with Image.open(image_path) as image:
+        width, height = image.size
+        if height <= EXTRACT_OCR_TILE_HEIGHT:
+            return [(0, 0, width, height)]
+        gray = image.convert('L')
+        boxes = []
+        top = 0
+        window = EXTRACT_OCR_TILE_HEIGHT // 10
+        while top < height:
+            bottom = top + EXTRACT_OCR_TILE_HEIGHT
+            if bottom >= height - window:
+                bottom = height
+            else:
+                # Move the cut to a blank line so no text row is split between tiles
+                candidates = range(bottom - window, bottom + window, 4)
+                bottom = max(candidates, key=lambda y: ImageStat.Stat(gray.crop((0, y, width, y + 1))).mean[0])
+            boxes.append((0, top, width, bottom))
+            top = bottom
+        return boxes
+
+def ocr_image(image_path):
+    """OCR an image, splitting tall scans into tiles that are recognised in parallel."""
+    boxes = image_tiles(image_path)
+    if len(boxes) == 1 or EXTRACT_MAX_WORKERS <= 1:
+        return '\n'.join(ocr_image_tile(image_path, box) for box in boxes)
+    return '\n'.join(_gather([(ocr_image_tile, (image_path, box), 1) for box in boxes], image_path))
@@ -0,0 +1,270 @@
+import os
+import re
+
+from dotenv import load_dotenv
+load_dotenv()
+
+# Rule sets applied to every answer (comma-separated keys of RULES)
+POSTPROCESS_LANGUAGES = [language.strip() for language in os.getenv("POSTPROCESS_LANGUAGES", "vi,en").split(',') if language.strip()]
+# Answers are cut after the last whole sentence that fits in this many characters
+ANSWER_MAX_LENGTH = int(os.getenv("ANSWER_MAX_LENGTH", "700"))
+
+# Filler the LLM wraps answers in, per language. Phrases are literal and case-insensitive:
+#   "line"   removes the phrase and the rest of its line
+#   "prefix" removes the phrase, an optional colon and the spaces after it
+#   "word"   removes the phrase up to the next space
+# "*" applies to every language: "stop" ends the answer (chat template leftovers), "cleanup"
+# patterns (regular expressions) are removed after the phrases
+RULES = {
+    "*": {
+        "stop": [r"\|\s*assistant"],
+        "cleanup": [r"\|\s*\|"],
+    },
+    "vi": {
+        "line": [
+            "Tôi luôn sẵn", "Xin chào", "Xin cảm ơn", "Nếu bạn cần thêm", "Chúc bạn thành công", "Tôi hy vọng",
+            "Tôi sẵn sàng", "Hãy cho tôi biết", "Tôi chúc bạn",
+        ],
+        "prefix": ["Tóm tắt thông tin bạn đang có"],
+        "word": ["Tôi xin lỗi, nhưng", "Tuy nhiên,", "Nếu bạn cần"],
+    },
+    "en": {
+        "prefix": ["Here is the response", "Here is the rewritten response"],
+    },
+}
+
+# Sentence boundary: whitespace after ., ! or ?
+SENTENCE_BREAK = re.compile(r'(?<=[.!?])\s+')
+
+class RuleSet:
+    """The rules of some languages compiled into three patterns.
+
+    All phrases go into one alternation (longest first within a scope, and "line"
+    before "prefix" before "word", so "Nếu bạn cần thêm" wins over "Nếu bạn cần"),
+    which finds every phrase of a sentence in a single scan.
+    """
+
+    SCOPES = {"line": r"[^\n]*", "prefix": r":?\s*", "word": r"\S*"}
+
+    def __init__(self, languages):
+        rules = [RULES[language] for language in ("*", *languages)]
+        groups = []
+        for scope, tail in self.SCOPES.items():
+            phrases = sorted({phrase for rule in rules for phrase in rule.get(scope, ())}, key=len, reverse=True)
+            if phrases:
+                groups.append(f"(?P<{scope}>(?:{'|'.join(re.escape(phrase) for phrase in phrases)}){tail})")
+        self.phrases = re.compile('|'.join(groups), re.IGNORECASE) if groups else None
+        stop = [pattern for rule in rules for pattern in rule.get("stop", ())]
+        self.stop = re.compile('|'.join(stop), re.IGNORECASE) if stop else None
+        cleanup = [pattern for rule in rules for pattern in rule.get("cleanup", ())]
+        self.cleanup = re.compile('|'.join(cleanup), re.IGNORECASE) if cleanup else None
+
+_rule_sets = {}
+
+def rule_set(languages=None):
+    languages = tuple(languages or POSTPROCESS_LANGUAGES)
+    if languages not in _rule_sets:
+        _rule_sets[languages] = RuleSet(languages)
+    return _rule_sets[languages]
+
+class SentenceSplitter:
+    """re.split(SENTENCE_BREAK) over text that arrives in pieces.
+
+    ``feed`` returns the (sentence, separator) pairs completed so far; a break is
+    only final once a non-space character follows it. ``finish`` returns the rest,
+    ending with the last sentence and an empty separator.
+    """
+
+    def __init__(self):
+        self.buffer = ''
+        self.scan = 0
+
+    def feed(self, text, final=False):
+        self.buffer += text
+        pairs, start = [], 0
+        for match in SENTENCE_BREAK.finditer(self.buffer, self.scan):
+            if match.end() == len(self.buffer) and not final:
+                # The break may go on in the next piece
+                self.scan = match.start()
+                break
+            pairs.append((self.buffer[start:match.start()], match.group()))
+            start = match.end()
+        else:
+            self.scan = len(self.buffer)
+        if start:
+            self.buffer = self.buffer[start:]
+            self.scan -= start
+        return pairs
+
+    def finish(self):
+        pairs = self.feed('', final=True)
+        pairs.append((self.buffer, ''))
+        self.buffer, self.scan = '', 0
+        return pairs
+
+class AnswerCleaner:
+    """Cleans an LLM answer in one pass, from a complete string or token by token.
+
+    Each raw sentence is checked once: the answer ends at a stop marker, a first
+    sentence repeating the question is dropped and the filler phrases are removed.
+    The cleaned text is split into sentences again (a removal can join two), exact
+    repeats are dropped and sentences are released until ``max_length`` characters.
+    The result matches the regex pipeline this replaced (clean_redundant followed by
+    trim_to_last_sentence): removals reach to the end of the line, and once the question
+    has been dropped the rest of the answer counts as a single line. Where the old
+    patterns were inconsistent it does not copy them: "Tôi luôn sẵn" is removed to the
+    end of its line wherever that line is, and phrases must be separated by spaces.
+
+    ``feed`` returns the sentences released by a piece, ``finish`` the last ones and
+    ``result()`` the final answer (ending with a period, first letter capitalised).
+    """
+
+    def __init__(self, question, max_length=None, rules=None):
+        self.question = question.strip()
+        self.max_length = ANSWER_MAX_LENGTH if max_length is None else max_length
+        self.rules = rules or rule_set()
+        self.raw = SentenceSplitter()
+        self.cleaned = SentenceSplitter()
+        self.first_raw = True
+        self.single_line = False
+        self.skipping = False  # inside text removed up to the end of its line
+        self.chained = False  # the removals ran to the end of the sentence right behind a prefix
+        self.seen = set()
+        self.accepted = []
+        self.length = 0
+        self.done = False  # nothing fed from now on can change the answer
+
+    def feed(self, piece):
+        if self.done:
+            return []
+        if self.rules.stop is not None and ('|' in piece or '|' in self.raw.buffer):
+            # Everything from a stop marker on is ignored; it can only be in the unfinished sentence
+            buffer = self.raw.buffer + piece
+            match = self.rules.stop.search(buffer)
+            if match is not None:
+                self.raw = SentenceSplitter()
+                return self._feed_raw(buffer[:match.start()]) + self.finish()
+        return self._feed_raw(piece)
+
+    def finish(self):
+        if self.done:
+            return []
+        released = []
+        for sentence, separator in self.raw.finish():
+            released += self._raw_sentence(sentence, separator)
+            if self.done:
+                return released
+        pairs = self.cleaned.finish()
+        for i, (sentence, _) in enumerate(pairs):
+            released += self._cleaned_sentence(sentence, last=(i == len(pairs) - 1))
+            if self.done:
+                break
+        self.done = True
+        return released
+
+    def result(self):
+        answer = ' '.join(self.accepted)
+        if not answer:
+            return ''
+        answer = answer.rstrip('.!?') + '.'
+        return answer[0].upper() + answer[1:]
+
+    def _feed_raw(self, text):
+        released = []
+        for sentence, separator in self.raw.feed(text):
+            released += self._raw_sentence(sentence, separator)
+            if self.done:
+                break
+        return released
+
+    def _raw_sentence(self, sentence, separator):
+        if self.first_raw:
+            self.first_raw = False
+            if sentence.strip() == self.question:
+                # The answer repeats the question; the rest is re-joined with spaces, so a
+                # removal that reaches the end of the line now reaches the end of the answer
+                self.single_line = True
+                return []
+        if self.single_line and separator:
+            separator = ' '
+        text = self._remove_phrases(sentence)
+        if self.skipping:
+            newline = separator.find('\n')
+            if newline < 0:
+                separator = ''
+            else:
+                # Behind a prefix the spaces from the end of the line on go as well
+                separator = '' if self.chained else separator[newline:]
+                self.skipping = False
+        elif self.chained:
+            separator = ''
+        released = []
+        for cleaned, _ in self.cleaned.feed(text + separator):
+            released += self._cleaned_sentence(cleaned)
+            if self.done:
+                break
+        return released
+
+    def _remove_phrases(self, sentence):
+        if self.skipping:
+            newline = sentence.find('\n')
+            if newline < 0:
+                return ''
+            sentence = sentence[newline:].lstrip() if self.chained else sentence[newline:]
+            self.skipping = False
+        # A prefix whose removals reached the end of the previous sentence also takes
+        # the spaces behind a phrase that starts this one
+        after_prefix, self.chained = self.chained, False
+        if self.rules.phrases is None:
+            return sentence
+        pieces, start = [], 0
+        for match in self.rules.phrases.finditer(sentence):
+            adjacent = after_prefix and match.start() == start
+            pieces.append(sentence[start:match.start()])
+            start = match.end()
+            if match.lastgroup == "prefix":
+                after_prefix = True
+            elif adjacent:
+                # Prefixes used to be removed after the other phrases, so the spaces they take
+                # include those behind a phrase that directly follows them
+                while start < len(sentence) and sentence[start].isspace():
+                    start += 1
+            else:
+                after_prefix = False
+        if not start:
+            text = sentence
+        else:
+            pieces.append(sentence[start:])
+            text = ''.join(pieces)
+            # A line removal that ran to the end of the sentence goes on into the next ones
+            self.skipping = match.lastgroup == "line" and start == len(sentence)
+            self.chained = after_prefix and start == len(sentence)
+        if self.rules.cleanup is not None and '|' in text:
+            text = self.rules.cleanup.sub('', text)
+        return text
+
+    def _cleaned_sentence(self, sentence, last=False):
+        if sentence in self.seen:
+            return []
+        self.seen.add(sentence)
+        if not self.accepted and not self.length:
+            sentence = sentence.lstrip()
+        if last:
+            sentence = sentence.rstrip()
+            if not sentence and (self.accepted or self.length):
+                return []
+        if self.length + len(sentence) > self.max_length:
+            self.done = True
+            return []
+        self.length += len(sentence) + 1
+        if not self.accepted and sentence:
+            # The final answer starts with a capital letter; stream it that way too
+            sentence = sentence[0].upper() + sentence[1:]
+        self.accepted.append(sentence)
+        return [sentence + ' ']
+
+def clean_answer(text, question, max_length=None, rules=None):
+    cleaner = AnswerCleaner(question, max_length, rules)
+    cleaner.feed(text)
+    cleaner.finish()
+    return cleaner.result()
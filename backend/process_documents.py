@@ -1,121 +1,180 @@
 import os
-import pyheif # For .HEIC
-import PyPDF2 # For .pdf
-import openpyxl # For .xlsx
+import hashlib
+import functools
+import logging
+import requests
 import subprocess # For .doc
-import pytesseract # For image
-import trafilatura # For url
-from PIL import Image # For image
+from collections import defaultdict, deque
 from database import db
-from docx import Document # For .docx
-from pptx import Presentation # For .pptx
-from langchain_together import TogetherEmbeddings  # Add to create embeddings
-from models import DBDocument, Link, DocumentChunk 
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from sqlalchemy import insert, update, select, exists, or_, bindparam
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from concurrent.futures import ThreadPoolExecutor
+from providers import registry  # Shared embedding backend
+from admission import embedding_limiter
+from context_packing import chunk_terms
+from metrics import stage, TimedIterator, INGEST_EMBEDDED
+from parallel_extract import extract_pdf_pages, iter_pdf_pages, ocr_image, EXTRACT_MAX_WORKERS, EXTRACT_PARALLEL_MIN_PAGES
+from models import DBDocument, Link, DocumentChunk, ChunkContent, IngestionJob
 from dotenv import load_dotenv
 load_dotenv()
 
-# Initialize embeddings model
-embeddings_model = TogetherEmbeddings(
-    api_key=os.getenv("TOGETHER_AI_API_KEY"),
-    model="togethercomputer/m2-bert-80M-32k-retrieval"
-)
+logger = logging.getLogger(__name__)
 
+# Embedding batching: chunks per request, parallel requests
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "32"))
+EMBED_MAX_WORKERS = int(os.getenv("EMBED_MAX_WORKERS", "4"))
+
+# Chunking (characters); segments are buffered up to SPLIT_WINDOW_CHUNKS chunks at a time
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 150
+SPLIT_WINDOW_CHUNKS = 16
+# Chunks embedded and inserted per round, so memory stays flat for any document size
+STORE_GROUP_SIZE = int(os.getenv("STORE_GROUP_SIZE", "256"))
+# Seconds to wait for a web page
+LINK_FETCH_TIMEOUT = float(os.getenv("LINK_FETCH_TIMEOUT", "30"))
+# Replacement uploads wait in <session folder>/.staging/<document id>/ until their refresh succeeds
+STAGING_FOLDER = '.staging'
+
+class _PrintableTable(dict):
+    # str.translate table that drops non-printable characters; each code point is
+    # classified once and then looked up in C
+    def __missing__(self, code):
+        if code in (9, 10, 13):
+            value = ' '  # keep words on either side of a line break apart
+        else:
+            value = code if chr(code).isprintable() else None
+        self[code] = value
+        return value
+
+_PRINTABLE = _PrintableTable()
+
+def sanitize(text):
+    # Eliminate NUL character and invalid character
+    return text.translate(_PRINTABLE) if text else ''
+
+# Parsing libraries (PyPDF2, python-docx, openpyxl, python-pptx, trafilatura, PIL) are imported
+# by their extractor on first use, so starting a worker does not load all of them
+
+def all_or_nothing(extractor):
+    """A file that cannot be opened is logged and yields nothing, as before extraction streamed.
+
+    An error after the first segment is raised instead: the job fails (a refresh keeps the
+    previous version) rather than storing the document cut off at the failure.
+    """
+    @functools.wraps(extractor)
+    def extract(path):
+        started = False
+        try:
+            for segment in extractor(path):
+                started = True
+                yield segment
+        except Exception as e:
+            if started:
+                raise
+            logger.error("Error processing %s: %s", path, e)
+    return extract
+
+@all_or_nothing
 def extract_text_from_pdf(pdf_path):
-    try:
-        with open(pdf_path, 'rb') as file:
-            reader = PyPDF2.PdfReader(file)
-            text = ''
-            for page in reader.pages:
-                page_text = page.extract_text() or ''
-                # Eliminate NUL character and invalid character
-                page_text = ''.join(c for c in page_text if c.isprintable())
-                text += page_text
-            return text
-    except Exception as e:
-        print(f"Error processing {pdf_path}: {e}")
-        return ""
+    import PyPDF2
+    with open(pdf_path, 'rb') as file:
+        reader = PyPDF2.PdfReader(file)
+        page_count = len(reader.pages)
+    if page_count >= EXTRACT_PARALLEL_MIN_PAGES and EXTRACT_MAX_WORKERS > 1:
+        # Large PDF: extract page ranges in worker processes
+        page_texts = iter_pdf_pages(pdf_path, page_count)
+    else:
+        page_texts = extract_pdf_pages(pdf_path, 0, page_count)
+    for page_text in page_texts:
+        yield sanitize(page_text)
+
+def fetch_page(url, etag=None, last_modified=None):
+    """Fetch the main text of a web page, conditionally when validators are known.
 
-def extract_text_from_url(url):
+    Returns (page_text, etag, last_modified); page_text is None when the server
+    answered 304 Not Modified and '' when the page could not be fetched.
+    """
+    headers = {'User-Agent': 'Mozilla/5.0 (compatible; ChatbotFastReading)'}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
     try:
-        downloaded = trafilatura.fetch_url(url)
-        if downloaded:
-            result = trafilatura.extract(downloaded)
-            # Eliminate NUL character and invalid character
-            result = ''.join(c for c in result if c.isprintable())
-            return result if result else ""
-        else:
-            print(f"Failed to download content from {url}")
-            return ""
+        with stage("ingest", "fetch"):
+            response = requests.get(url, headers=headers, timeout=LINK_FETCH_TIMEOUT)
+        if response.status_code == 304:
+            return None, etag, last_modified
+        if response.status_code != 200:
+            logger.warning("Failed to download content from %s: HTTP %s", url, response.status_code)
+            return '', None, None
+        # trafilatura detects the encoding from the raw bytes
+        with stage("ingest", "extract"):
+            import trafilatura
+            page_text = trafilatura.extract(response.content) or ''
+        return page_text, response.headers.get('ETag'), response.headers.get('Last-Modified')
     except Exception as e:
-        print(f"Error processing {url}: {e}")
-        return ""
+        logger.error("Error processing %s: %s", url, e)
+        return '', None, None
+
+def fetch_url_text(url):
+    # Main text of a web page, '' if it cannot be fetched
+    return fetch_page(url)[0]
+
+def extract_text_from_url(url, page_text=None):
+    if page_text is None:
+        page_text = fetch_url_text(url)
+    for line in page_text.splitlines():
+        yield sanitize(line)
 
+@all_or_nothing
 def extract_text_from_docx(docx_path):
-    try:
-        doc = Document(docx_path)
-        text = '\n'.join([para.text for para in doc.paragraphs])
-        # Eliminate NUL character and invalid character
-        text = ''.join(c for c in text if c.isprintable())
-        return text
-    except Exception as e:
-        print(f"Error processing {docx_path}: {e}")
-        return ""
+    from docx import Document
+    doc = Document(docx_path)
+    for para in doc.paragraphs:
+        yield sanitize(para.text)
 
+@all_or_nothing
 def extract_text_from_doc(doc_path):
-    try:
-        result = subprocess.run(['antiword', doc_path], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        text = result.stdout.decode('utf-8')
-        if not text.strip():
-            raise ValueError("antiword returned empty")
-        # Eliminate NUL character and invalid character
-        text = ''.join(c for c in text if c.isprintable())
-        return text
-    except Exception as e:
-        print(f"Error processing {doc_path}: {e}")
-        return ""
-    
+    # Read antiword's output as it is produced instead of buffering it all
+    with subprocess.Popen(['antiword', doc_path], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL) as process:
+        empty = True
+        for line in process.stdout:
+            line = sanitize(line.decode('utf-8', errors='replace'))
+            if line.strip():
+                empty = False
+            yield line
+    if empty:
+        logger.error("Error processing %s: antiword returned empty", doc_path)
+
+@all_or_nothing
 def extract_text_from_excel(xlsx_path):
+    import openpyxl
+    # read_only streams rows from the sheet XML instead of building every cell object
+    workbook = openpyxl.load_workbook(xlsx_path, read_only=True, data_only=True)
     try:
-        workbook = openpyxl.load_workbook(xlsx_path)
-        text = ''
         for sheet in workbook:
             for row in sheet.iter_rows(values_only=True):
-                text += ' '.join([str(cell) for cell in row if cell is not None]) + '\n'
-        # Eliminate NUL character and invalid character
-        text = ''.join(c for c in text if c.isprintable())
-        return text
-    except Exception as e:
-        print(f"Error processing {xlsx_path}: {e}")
-        return ""
+                yield sanitize(' '.join([str(cell) for cell in row if cell is not None]))
+    finally:
+        workbook.close()
 
+@all_or_nothing
 def extract_text_from_pptx(pptx_path):
-    try:
-        prs = Presentation(pptx_path)
-        text = ''
-        for slide in prs.slides:
-            for shape in slide.shapes:
-                if hasattr(shape, "text"):
-                    text += shape.text + '\n'
-        # Eliminate NUL character and invalid character
-        text = ''.join(c for c in text if c.isprintable())
-        return text
-    except Exception as e:
-        print(f"Error processing {pptx_path}: {e}")
-        return ""
-    
+    from pptx import Presentation
+    prs = Presentation(pptx_path)
+    for slide in prs.slides:
+        for shape in slide.shapes:
+            if hasattr(shape, "text"):
+                yield sanitize(shape.text)
+
+@all_or_nothing
 def extract_text_from_image(image_path):
-    try:
-        img = Image.open(image_path)
-        text = pytesseract.image_to_string(img)
-        # Eliminate NUL character and invalid character
-        text = ''.join(c for c in text if c.isprintable())
-        return text
-    except Exception as e:
-        print(f"Error processing {image_path}: {e}")
-        return ""
-    
+    # Tall scans are split into tiles and OCRed in worker processes
+    yield sanitize(ocr_image(image_path))
+
 # def convert_heic_to_jpeg(heic_path):
+#     import pyheif
+#     from PIL import Image
 #     heic_file = pyheif.read(heic_path)
 #     image = Image.frombytes(
 #         heic_file.mode,
@@ -129,51 +188,461 @@ def extract_text_from_image(image_path):
 #     image.save(jpeg_path, "JPEG")
 #     return jpeg_path
 
-def process_and_store_chunks(source, source_type, session_id):
+def embed_batch(texts):
+    # One call per batch: a single API request, or one slot in the local model's batcher.
+    # Ingestion queues behind questions for an embedding slot but is never rejected
+    with embedding_limiter.slot("ingest", background=True):
+        return registry.embedding_backend.embed_documents(texts)
+
+def embed_chunks(chunks, batch_size=None, max_workers=None, on_progress=None):
+    batch_size = batch_size or EMBED_BATCH_SIZE
+    max_workers = max_workers or EMBED_MAX_WORKERS
+    batches = [chunks[i:i + batch_size] for i in range(0, len(chunks), batch_size)]
+    embeddings = []
+    # map() keeps the batch order, so embeddings line up with chunks
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(batches)))) as executor:
+        for batch_embeddings in executor.map(embed_batch, batches):
+            embeddings.extend(batch_embeddings)
+            if on_progress:
+                on_progress(len(embeddings), len(chunks))
+    return embeddings
+
+# File extension -> extractor returning an iterator of text segments
+EXTRACTORS = {
+    '.pdf': extract_text_from_pdf,
+    '.docx': extract_text_from_docx,
+    '.doc': extract_text_from_doc,
+    '.xlsx': extract_text_from_excel,
+    '.pptx': extract_text_from_pptx,
+    '.png': extract_text_from_image,
+    '.jpg': extract_text_from_image,
+    '.jpeg': extract_text_from_image,
+    # '.heic': lambda path: extract_text_from_image(convert_heic_to_jpeg(path)),
+}
+
+def extract_text(source, source_type):
+    # Returns an iterator of text segments (pages, paragraphs, rows, slides), or None
     if source_type == 'file':
-        ext = os.path.splitext(source)[1].lower()
-        if ext == '.pdf':
-            text = extract_text_from_pdf(source)
-        elif ext == '.docx':
-            text = extract_text_from_docx(source)
-        elif ext == '.doc':
-            text = extract_text_from_doc(source)
-        elif ext == '.xlsx':
-            text = extract_text_from_excel(source)
-        elif ext == '.pptx':
-            text = extract_text_from_pptx(source)
-        elif ext in ['.png', '.jpg', '.jpeg']:
-            text = extract_text_from_image(source)
-        # elif ext == '.heic':
-        #     jpeg_path = convert_heic_to_jpeg(source)
-        #     text = extract_text_from_image(jpeg_path)
-        else:
-            print(f"Unsupported file type: {source}")
-            return
+        extractor = EXTRACTORS.get(os.path.splitext(source)[1].lower())
+        if extractor is None:
+            logger.error("Unsupported file type: %s", source)
+            return None
+        return extractor(source)
     elif source_type == 'link':
-        text = extract_text_from_url(source)
-    else:
-        print("Invalid source type")
-        return
-    
-    # Split into chunks
+        return extract_text_from_url(source)
+    logger.error("Invalid source type")
+    return None
+
+def iter_chunks(segments, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
+    """Split a stream of text segments into chunks while holding only a small window.
+
+    The buffer is split once it holds SPLIT_WINDOW_CHUNKS chunks' worth of text;
+    every chunk except the last is emitted and the last one (which may continue in
+    the next segment) starts the next window, so overlap is kept across windows.
+    Every chunk fits chunk_size and the chunks cover the text in order, but the
+    boundaries after the first window usually differ from splitting the whole text at
+    once: the next window is split again from the start of the carried chunk.
+    """
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
     text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000,
-        chunk_overlap=150,
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
     )
-    chunks = text_splitter.split_text(text)
-    
-    # Save chunks into database
-    for chunk in chunks:
-        # Create embedding for chunk
-        embedding = embeddings_model.embed_query(chunk)
-        
-        chunk_entry = DocumentChunk(
+    window = chunk_size * SPLIT_WINDOW_CHUNKS
+    parts = []
+    size = 0
+    for segment in segments:
+        if not segment:
+            continue
+        parts.append(segment)
+        size += len(segment) + 1
+        if size < window:
+            continue
+        chunks = text_splitter.split_text('\n'.join(parts))
+        yield from chunks[:-1]
+        parts = chunks[-1:]
+        size = sum(len(part) + 1 for part in parts)
+    if parts:
+        yield from text_splitter.split_text('\n'.join(parts))
+
+def timed_chunks(segments):
+    # Extraction and splitting run interleaved; time each step separately
+    segments = TimedIterator(segments, "ingest", "extract")
+    return TimedIterator(iter_chunks(segments), "ingest", "split", inner=segments)
+
+def _groups(items, size):
+    group = []
+    for item in items:
+        group.append(item)
+        if len(group) == size:
+            yield group
+            group = []
+    if group:
+        yield group
+
+def content_hash(data):
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return hashlib.sha256(data).hexdigest()
+
+def file_hash(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def chunk_hash(chunk):
+    # The model is part of the key: a different embedding model must not reuse vectors
+    return content_hash(f"{registry.embedding_backend.model_name}\n{chunk}")
+
+def find_duplicate_source(source_type, digest, document_id=None, link_id=None):
+    """Id of an already ingested file/link with the same content hash, or None."""
+    if source_type == 'file':
+        model, own_id, column = DBDocument, document_id, DocumentChunk.document_id
+    else:
+        model, own_id, column = Link, link_id, DocumentChunk.link_id
+    return db.session.scalar(
+        select(model.id)
+        .where(model.content_hash == digest, model.status == 'ready', model.id != own_id)
+        # Its vectors are only reusable if the current model made them
+        .where(exists().where(column == model.id, DocumentChunk.content_id == ChunkContent.id,
+                              ChunkContent.embedding_model == registry.embedding_backend.model_name))
+        .order_by(model.id)
+        .limit(1)
+    )
+
+def source_contents(source_type, source_id):
+    # (content ids, texts, embeddings) of an ingested source, in chunk order
+    column = DocumentChunk.document_id if source_type == 'file' else DocumentChunk.link_id
+    rows = db.session.execute(
+        select(ChunkContent.id, ChunkContent.chunk_text, ChunkContent.embedding)
+        .join(DocumentChunk, DocumentChunk.content_id == ChunkContent.id)
+        .where(column == source_id)
+        .order_by(DocumentChunk.position, DocumentChunk.id)
+    ).all()
+    return [row.id for row in rows], [row.chunk_text for row in rows], [row.embedding for row in rows]
+
+def resolve_contents(chunks, on_progress=None):
+    """Content ids and embeddings for chunks, embedding only text that was never seen before."""
+    with stage("ingest", "dedup_lookup"):
+        hashes = [chunk_hash(chunk) for chunk in chunks]
+        known = {
+            row.content_hash: (row.id, row.embedding)
+            for row in db.session.execute(
+                select(ChunkContent.content_hash, ChunkContent.id, ChunkContent.embedding)
+                .where(ChunkContent.content_hash.in_(set(hashes)))
+            )
+        }
+    # Repeated chunks inside the group are embedded once
+    missing = {}
+    for digest, chunk in zip(hashes, chunks):
+        if digest not in known:
+            missing.setdefault(digest, chunk)
+    if missing:
+        with stage("ingest", "embed"):
+            embeddings = embed_chunks(list(missing.values()), on_progress=on_progress)
+        INGEST_EMBEDDED.inc(len(missing))
+        # Another worker may insert the same text concurrently; the unique hash keeps one row
+        with stage("ingest", "store"):
+            db.session.execute(
+                pg_insert(ChunkContent).on_conflict_do_nothing(index_elements=['content_hash']),
+                [
+                    {"content_hash": digest, "chunk_text": chunk, "embedding": embedding, "terms": sorted(chunk_terms(chunk)),
+                     "embedding_model": registry.embedding_backend.model_name}
+                    for (digest, chunk), embedding in zip(missing.items(), embeddings)
+                ],
+            )
+            known.update(
+                (row.content_hash, (row.id, row.embedding))
+                for row in db.session.execute(
+                    select(ChunkContent.content_hash, ChunkContent.id, ChunkContent.embedding)
+                    .where(ChunkContent.content_hash.in_(list(missing)))
+                )
+            )
+    return [known[digest][0] for digest in hashes], [known[digest][1] for digest in hashes]
+
+def store_chunks(session_id, document_id, link_id, content_ids, start=0):
+    # Save chunks into database with a single bulk insert; ``start`` is the position of the first one
+    rows = [
+        {
+            "session_id": session_id,
+            "document_id": document_id,
+            "link_id": link_id,
+            "content_id": content_id,
+            "position": start + i,
+        }
+        for i, content_id in enumerate(content_ids)
+    ]
+    with stage("ingest", "store"):
+        db.session.execute(insert(DocumentChunk), rows)
+        db.session.commit()
+    # Cached session indexes load the source once it is ready (see chat_service.search_faiss_cache)
+    return len(rows)
+
+def purge_unused_contents(content_ids=None):
+    # Drop shared contents that no chunk references any more (e.g. after a session is deleted);
+    # content_ids limits the check to the contents whose chunks were just deleted
+    query = ChunkContent.query.filter(~exists().where(DocumentChunk.content_id == ChunkContent.id))
+    if content_ids is not None:
+        query = query.filter(ChunkContent.id.in_(content_ids))
+    query.delete(synchronize_session=False)
+
+def reembed_sources(on_source=None):
+    """Embed the chunks of sources that another embedding model embedded again with the current one.
+
+    Sources are converted one at a time. Pointing the chunks at the new contents and
+    recording a finished 'reembed' job share a transaction, so cached session indexes
+    and answers see a new version of the source. Returns the number of sources converted.
+    """
+    model = registry.embedding_backend.model_name
+    stale = or_(ChunkContent.embedding_model != model, ChunkContent.embedding_model.is_(None))
+    sources = db.session.execute(
+        select(DocumentChunk.document_id, DocumentChunk.link_id, DocumentChunk.session_id)
+        .join(ChunkContent, ChunkContent.id == DocumentChunk.content_id)
+        .where(stale)
+        .distinct()
+    ).all()
+    chunks = DocumentChunk.__table__
+    for document_id, link_id, session_id in sources:
+        parent = db.session.get(DBDocument, document_id) if document_id else db.session.get(Link, link_id)
+        if parent is None:
+            continue
+        # Waits for a refresh of the same source to commit (refresh_source locks the row too)
+        db.session.refresh(parent, with_for_update=True)
+        source_column = chunks.c.document_id if document_id else chunks.c.link_id
+        source_id = document_id or link_id
+        rows = db.session.execute(
+            select(ChunkContent.id, ChunkContent.chunk_text)
+            .join(DocumentChunk, DocumentChunk.content_id == ChunkContent.id)
+            .where(source_column == source_id, stale)
+            .distinct()
+        ).all()
+        content_ids, _ = resolve_contents([row.chunk_text for row in rows])
+        moves = [{'old_id': row.id, 'new_id': new_id} for row, new_id in zip(rows, content_ids) if new_id != row.id]
+        if moves:
+            db.session.execute(
+                update(chunks)
+                .where(chunks.c.content_id == bindparam('old_id'), source_column == source_id)
+                .values(content_id=bindparam('new_id')),
+                moves,
+            )
+        # A row whose hash already carries the current model only lacked its label
+        kept = [row.id for row, new_id in zip(rows, content_ids) if new_id == row.id]
+        if kept:
+            ChunkContent.query.filter(ChunkContent.id.in_(kept)).update({'embedding_model': model}, synchronize_session=False)
+        purge_unused_contents([row.id for row in rows])
+        db.session.add(IngestionJob(
             session_id=session_id,
-            document_id=DBDocument.query.filter_by(filepath=source).first().id if source_type == 'file' else None,
-            link_id=Link.query.filter_by(url=source).first().id if source_type == 'link' else None,
-            chunk_text=chunk,
-            embedding=embedding
-        )
-        db.session.add(chunk_entry)
-    db.session.commit()
\ No newline at end of file
+            document_id=document_id,
+            link_id=link_id,
+            source=parent.filepath if document_id else parent.url,
+            source_type='file' if document_id else 'link',
+            kind='reembed',
+            status='done',
+            attempts=1,
+            chunks_processed=len(rows),
+            chunks_total=len(rows),
+            started_at=db.func.current_timestamp(),
+            finished_at=db.func.current_timestamp(),
+        ))
+        db.session.commit()
+        if on_source:
+            on_source('file' if document_id else 'link', source_id, len(rows))
+    return len(sources)
+
+def staging_path(filepath, document_id):
+    # Where a replacement for the document's file waits until its refresh succeeds
+    folder, name = os.path.split(filepath)
+    return os.path.join(folder, STAGING_FOLDER, str(document_id), name)
+
+def staged_target(source):
+    # The path a staged upload moves to once its refresh succeeds; None for other paths
+    staging = os.path.dirname(os.path.dirname(source))
+    if os.path.basename(staging) != STAGING_FOLDER:
+        return None
+    return os.path.join(os.path.dirname(staging), os.path.basename(source))
+
+def discard_staged(source):
+    # A staged upload whose refresh did not succeed: the document keeps its previous file
+    if staged_target(source) is not None and os.path.exists(source):
+        os.remove(source)
+
+def resolve_parent(source, source_type, session_id, document_id=None, link_id=None):
+    # Resolve the parent row once instead of once per chunk; None (logged) when there is none
+    if source_type == 'file':
+        if document_id is None:
+            parent = DBDocument.query.filter_by(session_id=session_id, filepath=source).first()
+        else:
+            parent = db.session.get(DBDocument, document_id)
+    elif source_type == 'link':
+        if link_id is None:
+            parent = Link.query.filter_by(session_id=session_id, url=source).first()
+        else:
+            parent = db.session.get(Link, link_id)
+    else:
+        logger.error("Invalid source type: %s", source_type)
+        return None
+    if parent is None:
+        # e.g. the source was deleted while its job waited in the queue
+        logger.error("Source row not found: %s %s", source_type, document_id or link_id or source)
+    return parent
+
+def process_and_store_chunks(source, source_type, session_id, document_id=None, link_id=None, on_progress=None):
+    parent = resolve_parent(source, source_type, session_id, document_id, link_id)
+    if parent is None:
+        return 0
+    if source_type == 'file':
+        document_id = parent.id
+    else:
+        link_id = parent.id
+
+    # Hash the content so a file or page that was already ingested is not extracted again
+    page_text = None
+    if source_type == 'file':
+        if not parent.content_hash:
+            with stage("ingest", "hash"):
+                parent.content_hash = file_hash(source)
+    else:
+        page_text, parent.etag, parent.last_modified = fetch_page(source)
+        parent.content_hash = content_hash(page_text)
+    db.session.commit()
+
+    duplicate_id = find_duplicate_source(source_type, parent.content_hash, document_id, link_id)
+    if duplicate_id is not None:
+        # Same bytes as an ingested source: point new chunks at its contents, no extraction or embedding
+        content_ids, _, _ = source_contents(source_type, duplicate_id)
+        stored = store_chunks(session_id, document_id, link_id, content_ids)
+        if on_progress:
+            on_progress(stored, stored)
+        return stored
+
+    segments = extract_text_from_url(source, page_text) if source_type == 'link' else extract_text(source, source_type)
+    if segments is None:
+        return 0
+
+    # Extraction, splitting, embedding and inserts are pipelined group by group; the
+    # total chunk count is unknown until the document has been read to the end
+    stored = 0
+    for chunks in _groups(timed_chunks(segments), STORE_GROUP_SIZE):
+        # Create embeddings in batches, only for chunk text not seen before
+        def group_progress(done, total):
+            on_progress(stored + done, None)
+        content_ids, _ = resolve_contents(chunks, on_progress=group_progress if on_progress else None)
+        stored += store_chunks(session_id, document_id, link_id, content_ids, start=stored)
+        if on_progress:
+            on_progress(stored, None)
+    return stored
+
+def refresh_source(source, source_type, session_id, document_id=None, link_id=None, on_progress=None):
+    """Bring the chunks of an ingested file or link up to date with its current content.
+
+    The new text is split as usual and compared with the stored chunks by content:
+    unchanged chunks keep their rows (and embeddings), removed ones are deleted and
+    only added or edited chunks are embedded. Returns the number of chunks.
+    Raises ValueError when the new version cannot be fetched or yields no text; the
+    stored chunks and content hash are then left as they were. A staged file (see
+    staging_path) replaces the document's file, name and path only with the new chunks.
+    """
+    parent = resolve_parent(source, source_type, session_id, document_id, link_id)
+    if parent is None:
+        return 0
+    if source_type == 'file':
+        document_id, column = parent.id, DocumentChunk.document_id
+    else:
+        link_id, column = parent.id, DocumentChunk.link_id
+
+    def stored_chunks():
+        return db.session.execute(
+            select(DocumentChunk.id, DocumentChunk.content_id, DocumentChunk.position)
+            .where(column == parent.id)
+            .order_by(DocumentChunk.position, DocumentChunk.id)
+        ).all()
+    existing = stored_chunks()
+
+    if source_type == 'link':
+        page_text, etag, last_modified = fetch_page(source, parent.etag, parent.last_modified)
+        if page_text == '':
+            # Network error, non-200 answer or no main text: keep the stored version
+            raise ValueError(f"Could not fetch {source}; the previous version is kept")
+        if page_text is None or (existing and content_hash(page_text) == parent.content_hash):
+            # 304, or the same text behind new validators: nothing to re-embed
+            parent.etag, parent.last_modified = etag, last_modified
+            db.session.commit()
+            logger.info("Refreshed %s: unchanged", source)
+            return len(existing)
+        validators = {'content_hash': content_hash(page_text), 'etag': etag, 'last_modified': last_modified}
+        segments = extract_text_from_url(source, page_text)
+    else:
+        validators = {'content_hash': file_hash(source)}
+        segments = extract_text(source, source_type)
+    if segments is None:
+        return len(existing)
+
+    # Content ids of the new version in order; chunk text seen before is not embedded again
+    new_contents = []
+    for chunks in _groups(timed_chunks(segments), STORE_GROUP_SIZE):
+        def group_progress(done, total):
+            on_progress(len(new_contents) + done, None)
+        content_ids, _ = resolve_contents(chunks, on_progress=group_progress if on_progress else None)
+        new_contents.extend(content_ids)
+    if not new_contents:
+        # The extractors log and swallow their errors; an empty result must not wipe the source
+        raise ValueError(f"No text could be extracted from {source}; the previous version is kept")
+
+    # Progress updates committed along the way; lock the source until the swap and diff
+    # against the chunks stored now, in case another refresh of it finished meanwhile
+    db.session.refresh(parent, with_for_update=True)
+    existing = stored_chunks()
+    existing_contents = {row.content_id for row in existing}
+    added = set(new_contents) - existing_contents  # content ids the source did not have before
+
+    # Keep one stored row per unchanged chunk (renumbered to its new position), delete the
+    # rest and insert what is new
+    stored_rows = defaultdict(deque)  # content id -> stored rows, in their old order
+    for row in existing:
+        stored_rows[row.content_id].append(row)
+    moved = {}  # chunk id -> new position
+    inserted = []  # (position, content id) without a stored row yet
+    for position, content_id in enumerate(new_contents):
+        if stored_rows[content_id]:
+            row = stored_rows[content_id].popleft()
+            if row.position != position:
+                moved[row.id] = position
+        else:
+            inserted.append((position, content_id))
+    removed_ids = [row.id for rows in stored_rows.values() for row in rows]
+    removed_contents = {row.content_id for rows in stored_rows.values() for row in rows}
+
+    with stage("ingest", "store"):
+        if removed_ids:
+            DocumentChunk.query.filter(DocumentChunk.id.in_(removed_ids)).delete(synchronize_session=False)
+        if moved:
+            db.session.execute(update(DocumentChunk), [{"id": chunk_id, "position": position} for chunk_id, position in moved.items()])
+        if inserted:
+            db.session.execute(
+                insert(DocumentChunk),
+                [
+                    {"session_id": session_id, "document_id": document_id, "link_id": link_id,
+                     "content_id": content_id, "position": position}
+                    for position, content_id in inserted
+                ],
+            )
+        if removed_contents:
+            purge_unused_contents(removed_contents)
+        # Progress updates commit the session, so the new hash is only recorded with the swap
+        for name, value in validators.items():
+            setattr(parent, name, value)
+        target = staged_target(source) if source_type == 'file' else None
+        if target is not None:
+            os.replace(source, target)
+            if parent.filepath != target and os.path.exists(parent.filepath):
+                os.remove(parent.filepath)
+            parent.filepath, parent.filename = target, os.path.basename(target)
+        # Old and new chunks are swapped in one transaction, so questions never see half a refresh
+        db.session.commit()
+
+    # Cached session indexes see the new job version and load the source again
+    logger.info("Refreshed %s: %d kept (%d moved), %d added, %d removed, %d new contents",
+                source, len(existing) - len(removed_ids), len(moved), len(inserted), len(removed_ids), len(added))
+    return len(new_contents)
@@ -0,0 +1,207 @@
+import os
+import httpx
+import logging
+import requests
+import threading
+from functools import cache
+from requests.adapters import HTTPAdapter
+from langchain_core.prompts import PromptTemplate
+from embedding_backends import EMBEDDING_BACKEND, TogetherEmbeddingBackend, LocalEmbeddingBackend
+
+from dotenv import load_dotenv
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Together endpoints (TOGETHER_API_BASE can point at a local stand-in for benchmarks)
+TOGETHER_API_BASE = os.getenv("TOGETHER_API_BASE", "https://api.together.xyz/v1/")
+EMBEDDING_MODEL = "togethercomputer/m2-bert-80M-32k-retrieval"
+LLM_MODEL = "meta-llama/Llama-3.3-70B-Instruct-Turbo-Free"
+LLM_TEMPERATURE = 0.2  # slight creativity but mostly deterministic
+LLM_MAX_TOKENS = 800  # faster response with tighter focus
+
+# Connection pool per backend and request timeouts (seconds)
+PROVIDER_POOL_SIZE = int(os.getenv("PROVIDER_POOL_SIZE", "16"))
+PROVIDER_CONNECT_TIMEOUT = float(os.getenv("PROVIDER_CONNECT_TIMEOUT", "10"))
+PROVIDER_READ_TIMEOUT = float(os.getenv("PROVIDER_READ_TIMEOUT", "120"))
+# Open connections to the providers when the app starts
+PROVIDER_WARMUP = os.getenv("PROVIDER_WARMUP", "false").lower() in ("1", "true", "yes")
+
+def api_url(path):
+    return TOGETHER_API_BASE.rstrip('/') + '/' + path.lstrip('/')
+
+def auth_headers():
+    return {
+        "Authorization": f"Bearer {os.getenv('TOGETHER_AI_API_KEY')}",
+        "Content-Type": "application/json",
+    }
+
+# Define a specific prompt to restrict LLM to provided documents
+prompt_template = PromptTemplate(
+    input_variables=["question", "context"],
+    template= (
+        "Answer the question '{question}' based only on the information from the following text: {context}. "
+        "If the question asks for a summary or overview (e.g., 'File hiện tại chứa thông tin gì?'), provide a concise and brief summary of the main topics in the text. "
+
+        "If no relevant information is found in the text, reply with: 'Thông tin bạn hỏi không được đề cập trong file.' "
+        "if the question is in Vietnamese, or 'The information you asked for is not mentioned in the file.' if the question is in English. "
+        "Ensure the entire response, including this message, is in the same language as the question '{question}'."
+        "Keep answers short, 600 tokens max, and end naturally so as not to be cut off within the 600 token limit."
+    )
+)
+
+# Map-reduce summaries of whole sources (summaries.py): one per part, then one of the parts
+summary_map_template = PromptTemplate(
+    input_variables=["text"],
+    template=(
+        "Summarize the following part of a document: {text}. "
+        "List its main topics and key facts (names, numbers, dates) in a few short sentences. "
+        "Write the summary in the same language as the text and do not add information that is not in it."
+    )
+)
+summary_reduce_template = PromptTemplate(
+    input_variables=["summaries"],
+    template=(
+        "The following are summaries of consecutive parts of one document: {summaries}. "
+        "Combine them into a single concise summary of the whole document that covers its main topics "
+        "in order. Write it in the same language as the summaries and do not add information that is not in them."
+    )
+)
+
+@cache
+def pooled_together_class():
+    # Defined on first use: langchain_together pulls in langchain_openai and openai, which
+    # take longer to import than the rest of the app together
+    from langchain_together import Together
+
+    class PooledTogether(Together):
+        """Together completions LLM that reuses the registry's pooled HTTP session.
+
+        langchain_together.Together posts with a bare ``requests.post``, which opens a
+        new connection (and TLS handshake) for every question.
+        """
+
+        def _call(self, prompt, stop=None, run_manager=None, **kwargs):
+            stop_to_use = stop[0] if stop and len(stop) == 1 else stop
+            payload = {
+                **self.default_params,
+                "prompt": prompt,
+                "stop": stop_to_use,
+                **kwargs,
+            }
+            # filter None values to not pass them to the http payload
+            payload = {k: v for k, v in payload.items() if v is not None}
+            response = registry.http_session.post(
+                self.base_url,
+                json=payload,
+                headers=auth_headers(),
+                timeout=(PROVIDER_CONNECT_TIMEOUT, PROVIDER_READ_TIMEOUT),
+            )
+            if response.status_code >= 500:
+                raise Exception(f"Together Server: Error {response.status_code}")
+            elif response.status_code >= 400:
+                raise ValueError(f"Together received an invalid payload: {response.text}")
+            elif response.status_code != 200:
+                raise Exception(
+                    f"Together returned an unexpected response with status "
+                    f"{response.status_code}: {response.text}"
+                )
+            return self._format_output(response.json())
+
+    return PooledTogether
+
+class ProviderRegistry:
+    """Long-lived LLM/embedding clients shared by every request in the process.
+
+    Everything is created on first use and then reused, so a question no longer pays
+    for client construction or a fresh connection to the provider.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._http_session = None
+        self._embeddings = None
+        self._embedding_backend = None
+        self._llm = None
+        self._qa_chain = None
+
+    @property
+    def http_session(self):
+        if self._http_session is None:
+            with self._lock:
+                if self._http_session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=PROVIDER_POOL_SIZE, pool_maxsize=PROVIDER_POOL_SIZE)
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    self._http_session = session
+        return self._http_session
+
+    @property
+    def embeddings(self):
+        if self._embeddings is None:
+            with self._lock:
+                if self._embeddings is None:
+                    from langchain_together import TogetherEmbeddings
+                    self._embeddings = TogetherEmbeddings(
+                        api_key=os.getenv("TOGETHER_AI_API_KEY"),
+                        base_url=TOGETHER_API_BASE,
+                        model=EMBEDDING_MODEL,
+                        http_client=httpx.Client(
+                            limits=httpx.Limits(
+                                max_connections=PROVIDER_POOL_SIZE,
+                                max_keepalive_connections=PROVIDER_POOL_SIZE,
+                            ),
+                            timeout=httpx.Timeout(PROVIDER_READ_TIMEOUT, connect=PROVIDER_CONNECT_TIMEOUT),
+                        ),
+                    )
+        return self._embeddings
+
+    @property
+    def embedding_backend(self):
+        # What ingestion and questions embed with (EMBEDDING_BACKEND), always through this object
+        if self._embedding_backend is None:
+            with self._lock:
+                if self._embedding_backend is None:
+                    if EMBEDDING_BACKEND == "local":
+                        self._embedding_backend = LocalEmbeddingBackend()
+                    else:
+                        self._embedding_backend = TogetherEmbeddingBackend(lambda: self.embeddings, EMBEDDING_MODEL)
+        return self._embedding_backend
+
+    @property
+    def llm(self):
+        if self._llm is None:
+            with self._lock:
+                if self._llm is None:
+                    self._llm = pooled_together_class()(
+                        api_key=os.getenv("TOGETHER_AI_API_KEY"),
+                        base_url=api_url('completions'),
+                        model=LLM_MODEL,
+                        temperature=LLM_TEMPERATURE,
+                        max_tokens=LLM_MAX_TOKENS,
+                    )
+        return self._llm
+
+    @property
+    def qa_chain(self):
+        # Create QA chain with the custom prompt (stateless, safe to share between requests)
+        if self._qa_chain is None:
+            llm = self.llm
+            with self._lock:
+                if self._qa_chain is None:
+                    from langchain.chains.question_answering import load_qa_chain
+                    self._qa_chain = load_qa_chain(llm, chain_type="stuff", prompt=prompt_template)
+        return self._qa_chain
+
+    def warm_up(self):
+        # Build the clients and open one connection to each backend
+        try:
+            self.embedding_backend.warm_up()
+            self.qa_chain
+            self.http_session.get(api_url('models'), headers=auth_headers(),
+                                  timeout=(PROVIDER_CONNECT_TIMEOUT, PROVIDER_READ_TIMEOUT))
+        except Exception as e:
+            logger.warning("Provider warm-up failed: %s", e)
+
+registry = ProviderRegistry()
@@ -0,0 +1,187 @@
+import os
+import re
+import logging
+from database import db
+from sqlalchemy import select, exists
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from concurrent.futures import ThreadPoolExecutor
+from admission import llm_limiter
+from context_packing import count_tokens, overlap_length
+from metrics import stage
+from models import DBDocument, Link, DocumentChunk, ChunkContent, SourceSummary
+from providers import registry, summary_map_template, summary_reduce_template
+
+from dotenv import load_dotenv
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Summarise every ingested source in the background and answer overview questions from the summaries
+SUMMARIES_ENABLED = os.getenv("SUMMARIES_ENABLED", "true").lower() in ("1", "true", "yes")
+# Tokens of text per map (or reduce) call; longer documents are summarised part by part, then the parts
+SUMMARY_GROUP_TOKENS = int(os.getenv("SUMMARY_GROUP_TOKENS", "3000"))
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", "300"))
+# Parallel LLM calls per summary job (each still takes a slot of the LLM limiter)
+SUMMARY_MAX_WORKERS = int(os.getenv("SUMMARY_MAX_WORKERS", "2"))
+
+# "What is in this file?"-style phrases, in Vietnamese and English
+OVERVIEW_PATTERNS = re.compile(
+    r"tóm tắt|tổng quan|tổng quát|chủ đề|nói về|đề cập|nội dung|chứa|bao gồm|gồm"
+    r"|summar\w*|overview|main (topics|points|ideas)|tl;?dr|about|contain\w*|cover\w*|say\w*|talk\w*"
+)
+# Words that do not narrow an overview question down to a specific part of the source
+OVERVIEW_FILLER = set("""
+    này đó đây kia hiện tại đang là gì những các của về cho tôi mình giúp hãy bạn có thể lại biết xem được
+    ở trong và với đến tới vấn đề thông tin chính file tài liệu văn bản trang link bài viết web nào ra sao như thế
+    what is are the this these that a an of in me please can could you give tell it does do which
+    file files document documents page pages text link links
+""".split())
+
+def is_overview_question(question):
+    # Questions about the whole source: an overview phrase and nothing but filler words
+    # ("tóm tắt file này" is, "tóm tắt điều 5" or "what does it say about pricing" are not)
+    text = ' '.join(re.findall(r"[\w;']+", question.lower()))
+    if not OVERVIEW_PATTERNS.search(text):
+        return False
+    rest = [word for word in OVERVIEW_PATTERNS.sub(' ', text).split() if word not in OVERVIEW_FILLER]
+    return not rest
+
+def source_text_parts(column, source_id, max_tokens=SUMMARY_GROUP_TOKENS):
+    """The source's chunks in order, stitched back together (overlaps removed) into parts of ~max_tokens."""
+    texts = db.session.scalars(
+        select(ChunkContent.chunk_text)
+        .join(DocumentChunk, DocumentChunk.content_id == ChunkContent.id)
+        .where(column == source_id)
+        .order_by(DocumentChunk.position, DocumentChunk.id)
+    ).all()
+    parts, current, tokens, previous = [], [], 0, ''
+    for text in texts:
+        piece = text[overlap_length(previous, text):]
+        previous = text
+        size = count_tokens(piece)
+        if current and tokens + size > max_tokens:
+            parts.append(''.join(current))
+            current, tokens = [], 0
+        current.append(piece if not current else ' ' + piece.lstrip())
+        tokens += size
+    if current:
+        parts.append(''.join(current))
+    return parts, len(texts)
+
+def complete(prompt):
+    # Background work: waits for an LLM slot behind interactive questions instead of being rejected
+    with llm_limiter.slot("summary", background=True):
+        return registry.llm.invoke(prompt, max_tokens=SUMMARY_MAX_TOKENS).strip()
+
+def map_reduce(parts, on_progress=None):
+    """Summary of the concatenation of ``parts`` and the number of summarisation rounds.
+
+    Each part is summarised on its own (map); the summaries are then grouped into
+    parts of the same size and summarised again until a single summary is left
+    (reduce), so the tree is as deep as the document needs. ``on_progress(done, total)``
+    is called after every LLM call, from the calling thread; total grows with each round.
+    """
+    levels = 0
+    done, total = 0, len(parts)
+
+    def collect(results):
+        nonlocal done
+        summaries = []
+        for summary in results:
+            summaries.append(summary)
+            done += 1
+            if on_progress:
+                on_progress(done, total)
+        return summaries
+
+    with ThreadPoolExecutor(max_workers=max(1, SUMMARY_MAX_WORKERS)) as executor:
+        with stage("summary", "map"):
+            summaries = collect(executor.map(lambda text: complete(summary_map_template.format(text=text)), parts))
+        levels += 1
+        while len(summaries) > 1:
+            groups, current, tokens = [], [], 0
+            for summary in summaries:
+                size = count_tokens(summary)
+                if current and tokens + size > SUMMARY_GROUP_TOKENS:
+                    groups.append(current)
+                    current, tokens = [], 0
+                current.append(summary)
+                tokens += size
+            groups.append(current)
+            if len(groups) == len(summaries) and len(groups) > 1:
+                # Summaries too long to pair up: merge two at a time so the rounds still converge
+                groups = [summaries[i:i + 2] for i in range(0, len(summaries), 2)]
+            total += len(groups)
+            with stage("summary", "reduce"):
+                summaries = collect(executor.map(
+                    lambda group: complete(summary_reduce_template.format(summaries="\n\n".join(group))), groups
+                ))
+            levels += 1
+    return summaries[0], levels
+
+def summarize_source(document_id=None, link_id=None, on_progress=None):
+    """Store the summary of an ingested file or link unless its content already has one. Returns it.
+
+    ``on_progress`` is passed to map_reduce; the job queue uses it to keep a long job from looking stale.
+    """
+    if document_id is not None:
+        parent, column = db.session.get(DBDocument, document_id), DocumentChunk.document_id
+    else:
+        parent, column = db.session.get(Link, link_id), DocumentChunk.link_id
+    if parent is None or not parent.content_hash:
+        return None
+    existing = SourceSummary.query.filter_by(content_hash=parent.content_hash).first()
+    if existing is not None:
+        return existing.summary
+    parts, chunk_count = source_text_parts(column, parent.id)
+    if not parts:
+        return None
+    summary, levels = map_reduce(parts, on_progress=on_progress)
+    # Another worker may have summarised the same content meanwhile; keep the first
+    db.session.execute(
+        pg_insert(SourceSummary).on_conflict_do_nothing(index_elements=['content_hash']),
+        [{"content_hash": parent.content_hash, "summary": summary, "levels": levels, "chunks": chunk_count}],
+    )
+    summary = db.session.scalar(select(SourceSummary.summary).where(SourceSummary.content_hash == parent.content_hash))
+    purge_unused_summaries()
+    db.session.commit()
+    logger.info("Summarised %s %s: %d chunks, %d parts, %d levels",
+                "file" if document_id is not None else "link", parent.id, chunk_count, len(parts), levels)
+    return summary
+
+def needs_summary(document_id=None, link_id=None):
+    model, source_id = (DBDocument, document_id) if document_id is not None else (Link, link_id)
+    content_hash = db.session.scalar(select(model.content_hash).where(model.id == source_id))
+    return bool(content_hash) and not db.session.scalar(
+        select(exists().where(SourceSummary.content_hash == content_hash))
+    )
+
+def load_summaries(session_id, file_ids, link_ids):
+    """[(type, id, summary)] for the session's selected sources, or None unless every one of them has a summary."""
+    file_ids = {int(i) for i in file_ids}
+    link_ids = {int(i) for i in link_ids}
+    rows = []
+    if file_ids:
+        rows += [("file", row.id, row.summary) for row in db.session.execute(
+            select(DBDocument.id, SourceSummary.summary)
+            .join(SourceSummary, SourceSummary.content_hash == DBDocument.content_hash)
+            .where(DBDocument.session_id == session_id, DBDocument.id.in_(file_ids), DBDocument.status == 'ready')
+            .order_by(DBDocument.id)
+        )]
+    if link_ids:
+        rows += [("link", row.id, row.summary) for row in db.session.execute(
+            select(Link.id, SourceSummary.summary)
+            .join(SourceSummary, SourceSummary.content_hash == Link.content_hash)
+            .where(Link.session_id == session_id, Link.id.in_(link_ids), Link.status == 'ready')
+            .order_by(Link.id)
+        )]
+    if not rows or len(rows) < len(file_ids) + len(link_ids):
+        return None
+    return rows
+
+def purge_unused_summaries():
+    # Summaries of content no file or link has any more (deleted, or replaced by a refresh)
+    SourceSummary.query.filter(
+        ~exists().where(DBDocument.content_hash == SourceSummary.content_hash),
+        ~exists().where(Link.content_hash == SourceSummary.content_hash),
+    ).delete(synchronize_session=False)
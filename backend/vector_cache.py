@@ -0,0 +1,193 @@
+import os
+import threading
+import numpy as np
+from collections import OrderedDict, defaultdict
+from context_packing import chunk_terms
+from metrics import Gauge, CollectedCounter
+
+from dotenv import load_dotenv
+load_dotenv()
+
+# Memory budget for all cached session indexes (vectors + chunk texts)
+VECTOR_CACHE_MAX_MB = float(os.getenv("VECTOR_CACHE_MAX_MB", "512"))
+# "float32" or "float16" (half the memory per vector; ranking is practically unchanged)
+VECTOR_CACHE_STORAGE = os.getenv("VECTOR_CACHE_STORAGE", "float32")
+EMBEDDING_DIM = 768
+
+class SessionIndex:
+    """FAISS index over the chunks of one chat session.
+
+    Vectors are L2-normalised and searched by inner product, which ranks like the
+    cosine distance used by pgvector. Chunk ids are the ``DocumentChunk`` ids and
+    ``sources`` maps ("file", id) / ("link", id) to those ids for filtering.
+
+    Each loaded source is tagged with the version it was read at (the newest finished
+    ingestion or refresh job). The database is shared by every worker process, so a
+    source another worker refreshed shows up as a version change and is loaded again.
+    """
+
+    def __init__(self, dim=EMBEDDING_DIM, storage=None):
+        import faiss  # loaded with the first session index, not when the app starts
+        storage = storage or VECTOR_CACHE_STORAGE
+        if storage == "float16":
+            vectors = faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_INNER_PRODUCT)
+        else:
+            vectors = faiss.IndexFlatIP(dim)
+        self.vector_bytes = vectors.code_size
+        self.index = faiss.IndexIDMap2(vectors)
+        self.chunks = {}  # chunk id -> (text, document_id, link_id, term set, position)
+        self.sources = defaultdict(set)  # (type, id) -> chunk ids
+        self.loaded_sources = {}  # source -> version of the chunks in the index
+        self.text_bytes = 0
+        self.lock = threading.RLock()
+
+    @property
+    def nbytes(self):
+        return self.index.ntotal * self.vector_bytes + self.text_bytes
+
+    def missing(self, versions):
+        # Sources not loaded yet, or loaded at another version than {source: version}
+        with self.lock:
+            return [source for source, version in versions.items()
+                    if source not in self.loaded_sources or self.loaded_sources[source] != version]
+
+    def add(self, chunk_ids, texts, embeddings, document_ids, link_ids, positions, terms=None):
+        if not chunk_ids:
+            return
+        import faiss
+        vectors = np.asarray(embeddings, dtype='float32')
+        faiss.normalize_L2(vectors)
+        with self.lock:
+            new = [i for i, chunk_id in enumerate(chunk_ids) if chunk_id not in self.chunks]
+            if not new:
+                return
+            self.index.add_with_ids(vectors[new], np.asarray([chunk_ids[i] for i in new], dtype='int64'))
+            for i in new:
+                chunk_id = chunk_ids[i]
+                chunk_term_set = frozenset(terms[i]) if terms and terms[i] is not None else frozenset(chunk_terms(texts[i]))
+                self.chunks[chunk_id] = (texts[i], document_ids[i], link_ids[i], chunk_term_set, positions[i])
+                self.text_bytes += len(texts[i].encode('utf-8'))
+                source = ("file", document_ids[i]) if document_ids[i] else ("link", link_ids[i])
+                self.sources[source].add(chunk_id)
+
+    def remove(self, chunk_ids):
+        with self.lock:
+            gone = [chunk_id for chunk_id in chunk_ids if chunk_id in self.chunks]
+            if not gone:
+                return
+            self.index.remove_ids(np.asarray(gone, dtype='int64'))
+            for chunk_id in gone:
+                text, document_id, link_id, _, _ = self.chunks.pop(chunk_id)
+                self.text_bytes -= len(text.encode('utf-8'))
+                source = ("file", document_id) if document_id else ("link", link_id)
+                self.sources[source].discard(chunk_id)
+
+    def drop(self, sources):
+        # Forget sources before loading them again at a new version
+        with self.lock:
+            chunk_ids = [chunk_id for source in sources for chunk_id in self.sources.get(source, ())]
+            self.remove(chunk_ids)
+            for source in sources:
+                self.sources.pop(source, None)
+                self.loaded_sources.pop(source, None)
+
+    def mark_loaded(self, versions):
+        with self.lock:
+            self.loaded_sources.update(versions)
+
+    def search(self, query_embedding, sources, k, candidates=None):
+        with self.lock:
+            allowed = [chunk_id for source in sources for chunk_id in self.sources.get(source, ())]
+            if candidates is not None:
+                allowed = list(set(allowed).intersection(candidates))
+            if not allowed:
+                return []
+            import faiss
+            query = np.asarray([query_embedding], dtype='float32')
+            faiss.normalize_L2(query)
+            params = faiss.SearchParameters(sel=faiss.IDSelectorBatch(np.asarray(allowed, dtype='int64')))
+            scores, ids = self.index.search(query, min(k, len(allowed)), params=params)
+            return [
+                (int(chunk_id), float(score), *self.chunks[int(chunk_id)])
+                for chunk_id, score in zip(ids[0], scores[0])
+                if chunk_id != -1
+            ]
+
+class VectorIndexCache:
+    """Process-wide LRU cache of SessionIndex objects bounded by a memory budget."""
+
+    def __init__(self, max_bytes=VECTOR_CACHE_MAX_MB * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.reloads = 0
+
+    def get(self, session_id):
+        # Returns the session index (creating an empty one if needed), most recent last
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                entry = self._entries[session_id] = SessionIndex()
+            self._entries.move_to_end(session_id)
+            return entry
+
+    def record(self, hit, reloads=0):
+        # reloads: sources loaded again because their version changed
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+            self.reloads += reloads
+
+    def invalidate(self, session_id):
+        with self._lock:
+            self._entries.pop(session_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def evict(self):
+        with self._lock:
+            total = sum(entry.nbytes for entry in self._entries.values())
+            # Keep at least the most recently used entry even if it exceeds the budget
+            while total > self.max_bytes and len(self._entries) > 1:
+                _, entry = self._entries.popitem(last=False)
+                total -= entry.nbytes
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'sessions': len(self._entries),
+                'vectors': sum(entry.index.ntotal for entry in self._entries.values()),
+                'bytes': sum(entry.nbytes for entry in self._entries.values()),
+                'max_bytes': int(self.max_bytes),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'reloads': self.reloads,
+            }
+
+vector_cache = VectorIndexCache()
+
+# Read from the cache statistics at scrape time
+VECTOR_CACHE_LOOKUPS = CollectedCounter(
+    'vector_cache_lookups_total', 'Session index lookups by result', ('result',),
+    collect=lambda: {('hit',): vector_cache.hits, ('miss',): vector_cache.misses},
+)
+VECTOR_CACHE_EVENTS = CollectedCounter(
+    'vector_cache_events_total', 'Session index evictions and sources reloaded after a change', ('event',),
+    collect=lambda: {('eviction',): vector_cache.evictions, ('reload',): vector_cache.reloads},
+)
+VECTOR_CACHE_SIZE = Gauge(
+    'vector_cache_size', 'Cached sessions, vectors, bytes and hit rate', ('measure',),
+    collect=lambda: {(name,): value for name, value in vector_cache.stats().items()
+                     if name in ('sessions', 'vectors', 'bytes', 'max_bytes', 'hit_rate')},
+)
@@ -0,0 +1,119 @@
+import os
+import click
+from database import db
+from flask.cli import AppGroup
+from sqlalchemy import cast, func, literal, text
+from pgvector.sqlalchemy import Vector, HALFVEC, BIT
+from models import ChunkContent
+
+from dotenv import load_dotenv
+load_dotenv()
+
+EMBEDDING_DIM = 768
+# How the pgvector engine ranks: "full" (float32 HNSW index), "halfvec" (float16 index)
+# or "binary" (1 bit per dimension); compact modes rescore a shortlist at full precision
+VECTOR_STORAGE = os.getenv("VECTOR_STORAGE", "full")
+# Shortlist size = k * factor; binary codes lose more ranking detail than halfvec
+DEFAULT_RESCORE_FACTORS = {"halfvec": 2, "binary": 8}
+VECTOR_RESCORE_FACTOR = os.getenv("VECTOR_RESCORE_FACTOR")
+
+# Expression indexes: the compact vectors are computed from chunk_content.embedding,
+# so ingestion writes nothing extra and the index build is the backfill
+INDEXES = {
+    "full": ("ix_chunk_content_embedding_hnsw", "embedding", "vector_cosine_ops"),
+    "halfvec": ("ix_chunk_content_embedding_halfvec_hnsw", f"(embedding::halfvec({EMBEDDING_DIM}))", "halfvec_cosine_ops"),
+    "binary": ("ix_chunk_content_embedding_binary_hnsw", f"(binary_quantize(embedding)::bit({EMBEDDING_DIM}))", "bit_hamming_ops"),
+}
+# halfvec and binary_quantize need pgvector 0.7
+COMPACT_MIN_VERSION = (0, 7, 0)
+
+def rescore_factor(storage=None):
+    storage = storage or VECTOR_STORAGE
+    if VECTOR_RESCORE_FACTOR:
+        return max(1, int(VECTOR_RESCORE_FACTOR))
+    return DEFAULT_RESCORE_FACTORS.get(storage, 1)
+
+def compact_distance(query_embedding, storage=None):
+    """Distance expression on the compact representation, matching the index expression."""
+    storage = storage or VECTOR_STORAGE
+    query = cast(literal(query_embedding, type_=Vector(EMBEDDING_DIM)), Vector(EMBEDDING_DIM))
+    if storage == "halfvec":
+        return cast(ChunkContent.embedding, HALFVEC(EMBEDDING_DIM)).cosine_distance(cast(query, HALFVEC(EMBEDDING_DIM)))
+    if storage == "binary":
+        codes = cast(func.binary_quantize(ChunkContent.embedding), BIT(EMBEDDING_DIM))
+        return codes.hamming_distance(cast(func.binary_quantize(query), BIT(EMBEDDING_DIM)))
+    return ChunkContent.embedding.cosine_distance(query_embedding)
+
+def pgvector_version(connection):
+    version = connection.execute(text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")).scalar()
+    return tuple(int(part) for part in version.split('.')) if version else None
+
+def index_exists(connection, name):
+    return connection.execute(text("SELECT to_regclass(:name) IS NOT NULL"), {'name': name}).scalar()
+
+# flask vectors status | build <storage> | drop <storage> | reembed
+vectors_cli = AppGroup('vectors', help="Compact vector indexes for the pgvector engine and re-embedding.")
+
+@vectors_cli.command('status')
+def status():
+    """Show the pgvector version and the size of the table and of each vector index."""
+    connection = db.session.connection()
+    version = pgvector_version(connection)
+    click.echo(f"pgvector {'.'.join(map(str, version)) if version else 'not installed'}, VECTOR_STORAGE={VECTOR_STORAGE}")
+    rows = connection.execute(text(
+        "SELECT count(*) AS chunks, pg_total_relation_size('chunk_content') AS total, "
+        "pg_relation_size('chunk_content') AS heap FROM chunk_content"
+    )).one()
+    click.echo(f"chunk_content: {rows.chunks} rows, {rows.total / 2**20:.1f} MB total, {rows.heap / 2**20:.1f} MB heap")
+    for model, count in connection.execute(text(
+        "SELECT embedding_model, count(*) FROM chunk_content GROUP BY embedding_model ORDER BY count(*) DESC"
+    )):
+        click.echo(f"  embedded by {model or 'unknown model'}: {count}")
+    for storage, (name, _, _) in INDEXES.items():
+        if index_exists(connection, name):
+            size = connection.execute(text("SELECT pg_relation_size(:name)"), {'name': name}).scalar()
+            click.echo(f"  {storage:8} {name}: {size / 2**20:.1f} MB")
+        else:
+            click.echo(f"  {storage:8} {name}: missing")
+
+@vectors_cli.command('build')
+@click.argument('storage', type=click.Choice(list(INDEXES)))
+@click.option('--maintenance-work-mem', default='1GB', help="Memory for the HNSW build; larger builds faster.")
+def build(storage, maintenance_work_mem):
+    """Build the HNSW index for STORAGE without blocking writes."""
+    name, expression, opclass = INDEXES[storage]
+    engine = db.engine.execution_options(isolation_level="AUTOCOMMIT")
+    with engine.connect() as connection:
+        version = pgvector_version(connection)
+        if storage != "full" and (version is None or version < COMPACT_MIN_VERSION):
+            raise click.ClickException(f"{storage} needs pgvector >= 0.7 (installed: {version})")
+        connection.execute(text(f"SET maintenance_work_mem = '{maintenance_work_mem}'"))
+        click.echo(f"Building {name}...")
+        connection.execute(text(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON chunk_content "
+            f"USING hnsw ({expression} {opclass}) WITH (m = 16, ef_construction = 64)"
+        ))
+    click.echo(f"Done. Set VECTOR_STORAGE={storage} to search with it.")
+
+@vectors_cli.command('drop')
+@click.argument('storage', type=click.Choice(list(INDEXES)))
+def drop(storage):
+    """Drop the HNSW index for STORAGE (e.g. the float32 one once a compact mode is in use)."""
+    if storage == VECTOR_STORAGE:
+        raise click.ClickException(f"VECTOR_STORAGE is {storage}; switch modes before dropping its index")
+    name = INDEXES[storage][0]
+    engine = db.engine.execution_options(isolation_level="AUTOCOMMIT")
+    with engine.connect() as connection:
+        connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+    click.echo(f"Dropped {name}.")
+
+@vectors_cli.command('reembed')
+def reembed():
+    """Embed chunks stored by another embedding model again with the current one (EMBEDDING_BACKEND)."""
+    from providers import registry
+    from process_documents import reembed_sources
+    click.echo(f"Embedding with {registry.embedding_backend.model_name}...")
+    converted = reembed_sources(
+        on_source=lambda source_type, source_id, contents: click.echo(f"  {source_type} {source_id}: {contents} contents")
+    )
+    click.echo(f"Done. {converted} sources re-embedded.")
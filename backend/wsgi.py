@@ -0,0 +1,6 @@
+# WSGI entry point for production servers; see gunicorn.conf.py
+#   cd backend && gunicorn -c gunicorn.conf.py wsgi:app
+from app import app, start_services
+
+# Imported by each worker after the fork (no preload), so every worker gets its own threads and pool
+start_services()
@@ -43,19 +43,38 @@ document.addEventListener("DOMContentLoaded", function () {
     }
   }
 
+  // Fetch one page of a list endpoint; next is the cursor of the following page (or null)
+  async function fetchPage(url, cursor) {
+    const res = await fetch(
+      cursor ? `${url}?cursor=${encodeURIComponent(cursor)}` : url
+    );
+    if (!res.ok) {
+      if (res.status === 403) {
+        throw new Error(
+          "Backend từ chối yêu cầu (403 Forbidden). Kiểm tra cấu hình CORS hoặc trạng thái backend."
+        );
+      }
+      throw new Error(`Failed to fetch ${url}: ${res.statusText}`);
+    }
+    return { items: await res.json(), next: res.headers.get("X-Next-Cursor") };
+  }
+
+  async function fetchAll(url) {
+    let items = [];
+    let cursor = null;
+    do {
+      const page = await fetchPage(url, cursor);
+      items = items.concat(page.items);
+      cursor = page.next;
+    } while (cursor);
+    return items;
+  }
+
   // Load chat sessions & Check default initialization
   async function loadSessions() {
     try {
-      const res = await fetch("http://127.0.0.1:5000/sessions");
-      if (!res.ok) {
-        if (res.status === 403) {
-          throw new Error(
-            "Backend từ chối yêu cầu (403 Forbidden). Kiểm tra cấu hình CORS hoặc trạng thái backend."
-          );
-        }
-        throw new Error("Failed to fetch sessions: " + res.statusText);
-      }
-      let sessions = await res.json();
+      // Sessions are sorted by name below, so all pages are needed
+      let sessions = await fetchAll("http://127.0.0.1:5000/sessions");
       console.log("Sessions fetched:", sessions);
 
       // If there is no session, create the 6 default groups
@@ -69,8 +88,7 @@ document.addEventListener("DOMContentLoaded", function () {
           });
         }
         // Call again to get the new list
-        const newRes = await fetch("http://127.0.0.1:5000/sessions");
-        sessions = await newRes.json();
+        sessions = await fetchAll("http://127.0.0.1:5000/sessions");
         console.log("New sessions created:", sessions);
       }
 
@@ -108,80 +126,169 @@ document.addEventListener("DOMContentLoaded", function () {
     });
   }
 
-  // Load files, links, chats for a session
+  // Load files, links, chats for a session (first page of each; the rest on demand)
   let fileMap = {};
   let linkMap = {};
+  let files = [];
+  let links = [];
+  let filesCursor = null;
+  let linksCursor = null;
+  let historyCursor = null;
+  let loadingHistory = false;
   async function loadSessionData(sessionId) {
     try {
       currentSessionId = sessionId;
-      // Get files
-      const filesRes = await fetch(
-        `http://127.0.0.1:5000/sessions/${sessionId}/files`
-      );
-      if (!filesRes.ok) throw new Error("Failed to fetch files");
-      const files = await filesRes.json();
-      fileMap = files.reduce((map, file) => {
-        map[file.id] = file.filename;
-        return map;
-      }, {});
-
-      // Get links
-      const linksRes = await fetch(
-        `http://127.0.0.1:5000/sessions/${sessionId}/links`
-      );
-      if (!linksRes.ok) throw new Error("Failed to fetch links");
-      const links = await linksRes.json();
-      linkMap = links.reduce((map, link) => {
-        map[link.id] = link.name || link.url;
-        return map;
-      }, {});
-
-      // Get chat history
-      const chatsRes = await fetch(
-        `http://127.0.0.1:5000/chat_history/${sessionId}`
-      );
-      if (!chatsRes.ok) throw new Error("Failed to fetch session data");
-      const chats = await chatsRes.json();
+      const [filesPage, linksPage, chatsPage] = await Promise.all([
+        fetchPage(`http://127.0.0.1:5000/sessions/${sessionId}/files`),
+        fetchPage(`http://127.0.0.1:5000/sessions/${sessionId}/links`),
+        // Newest messages first; older ones load when scrolling up
+        fetchPage(`http://127.0.0.1:5000/chat_history/${sessionId}`),
+      ]);
+      if (currentSessionId !== sessionId) return;
+      files = [];
+      links = [];
+      fileMap = {};
+      linkMap = {};
+      addFiles(filesPage);
+      addLinks(linksPage);
+      historyCursor = chatsPage.next;
 
       renderFiles(files);
       renderLinks(links);
-      renderChatHistory(chats);
+      renderChatHistory(chatsPage.items);
+      // A short first page cannot be scrolled, so fetch the previous one right away
+      if (chatMessages.scrollHeight <= chatMessages.clientHeight)
+        loadOlderMessages();
     } catch (error) {
       console.error("Error loading session data:", error);
       alert("Failed to load session data. Please try again.");
     }
   }
 
+  function addFiles(page) {
+    files = files.concat(page.items);
+    filesCursor = page.next;
+    page.items.forEach((file) => (fileMap[file.id] = file.filename));
+  }
+
+  function addLinks(page) {
+    links = links.concat(page.items);
+    linksCursor = page.next;
+    page.items.forEach((link) => (linkMap[link.id] = link.name || link.url));
+  }
+
+  async function loadMoreFiles() {
+    const sessionId = currentSessionId;
+    const page = await fetchPage(
+      `http://127.0.0.1:5000/sessions/${sessionId}/files`,
+      filesCursor
+    );
+    if (currentSessionId !== sessionId) return;
+    addFiles(page);
+    renderFiles(files);
+  }
+
+  async function loadMoreLinks() {
+    const sessionId = currentSessionId;
+    const page = await fetchPage(
+      `http://127.0.0.1:5000/sessions/${sessionId}/links`,
+      linksCursor
+    );
+    if (currentSessionId !== sessionId) return;
+    addLinks(page);
+    renderLinks(links);
+  }
+
+  // Prepend the previous page of messages, keeping the visible ones in place
+  async function loadOlderMessages() {
+    if (!historyCursor || loadingHistory) return;
+    loadingHistory = true;
+    const sessionId = currentSessionId;
+    try {
+      const page = await fetchPage(
+        `http://127.0.0.1:5000/chat_history/${sessionId}`,
+        historyCursor
+      );
+      if (currentSessionId !== sessionId) return;
+      historyCursor = page.next;
+      const previousHeight = chatMessages.scrollHeight;
+      const fragment = document.createDocumentFragment();
+      page.items.forEach((msg) =>
+        fragment.appendChild(messageElement(msg.message, msg.is_user))
+      );
+      chatMessages.prepend(fragment);
+      chatMessages.scrollTop += chatMessages.scrollHeight - previousHeight;
+    } catch (error) {
+      console.error("Error loading older messages:", error);
+    } finally {
+      loadingHistory = false;
+    }
+  }
+
+  // Poll an ingestion job until it finishes
+  async function waitForJob(jobId, onProgress) {
+    while (true) {
+      const res = await fetch(`http://127.0.0.1:5000/jobs/${jobId}`);
+      if (!res.ok) throw new Error("Failed to fetch job status");
+      const job = await res.json();
+      if (onProgress) onProgress(job);
+      if (job.status === "done") return job;
+      if (job.status === "failed")
+        throw new Error(job.error || "Processing failed");
+      await new Promise((resolve) => setTimeout(resolve, 1000));
+    }
+  }
+
+  function statusLabel(status) {
+    if (status === "processing")
+      return '<span class="text-muted small ms-1">(processing)</span>';
+    if (status === "failed")
+      return '<span class="text-danger small ms-1">(failed)</span>';
+    return "";
+  }
+
+  function loadMoreButton(cursor) {
+    return cursor
+      ? '<button class="btn btn-link btn-sm w-100 load-more">Load more</button>'
+      : "";
+  }
+
   function renderFiles(files) {
     if (!currentSessionId) return;
-    fileList.innerHTML = files.length
+    fileList.innerHTML = (files.length
       ? files
           .map(
             (f) => `
         <div class="file-item d-flex align-items-center" data-id="${f.id}">
           <div class="file-icon"><i class="fas fa-file"></i></div>
-          <div class="file-name">${f.filename}</div>
-          <div class="file-checkbox"><input type="checkbox" class="form-check-input"></div>
+          <div class="file-name">${f.filename}${statusLabel(f.status)}</div>
+          <div class="source-refresh" title="Upload a new version"><i class="fas fa-sync-alt"></i></div>
+          <div class="file-checkbox"><input type="checkbox" class="form-check-input"${
+            f.status === "ready" ? "" : " disabled"
+          }></div>
         </div>`
           )
           .join("")
-      : '<p class="text-muted text-center">No files</p>';
+      : '<p class="text-muted text-center">No files</p>') + loadMoreButton(filesCursor);
   }
 
   function renderLinks(links) {
     if (!currentSessionId) return;
-    linkList.innerHTML = links.length
+    linkList.innerHTML = (links.length
       ? links
           .map(
             (l) => `
       <div class="link-item d-flex align-items-center" data-id="${l.id}">
         <div class="link-icon"><i class="fas fa-link"></i></div>
-        <div class="link-name">${l.name || l.url}</div>
-        <div class="link-checkbox"><input type="checkbox" class="form-check-input"></div>
+        <div class="link-name">${l.name || l.url}${statusLabel(l.status)}</div>
+        <div class="source-refresh" title="Refresh"><i class="fas fa-sync-alt"></i></div>
+        <div class="link-checkbox"><input type="checkbox" class="form-check-input"${
+          l.status === "ready" ? "" : " disabled"
+        }></div>
       </div>`
           )
           .join("")
-      : '<p class="text-muted text-center">No links</p>';
+      : '<p class="text-muted text-center">No links</p>') + loadMoreButton(linksCursor);
   }
 
   function renderChatHistory(chats) {
@@ -189,18 +296,98 @@ document.addEventListener("DOMContentLoaded", function () {
     chats.forEach((msg) => addMessage(msg.message, msg.is_user));
   }
 
-  function addMessage(message, isUser = false) {
+  function messageElement(message, isUser) {
     const div = document.createElement("div");
     div.className = `message ${isUser ? "user-message" : "bot-message"}`;
     const content = document.createElement("div");
     content.className = "message-content";
     content.innerHTML = message;
     div.appendChild(content);
+    return div;
+  }
+
+  function addMessage(message, isUser = false) {
+    const div = messageElement(message, isUser);
     chatMessages.appendChild(div);
     chatMessages.scrollTop = chatMessages.scrollHeight;
+    return div.firstChild;
+  }
+
+  // Read a Server-Sent Events response body, calling onEvent(event, data) per event
+  async function readEventStream(res, onEvent) {
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+      const events = buffer.split("\n\n");
+      buffer = events.pop();
+      for (const raw of events) {
+        let event = "message";
+        let data = "";
+        raw.split("\n").forEach((line) => {
+          if (line.startsWith("event:")) event = line.slice(6).trim();
+          else if (line.startsWith("data:")) data += line.slice(5).trim();
+        });
+        if (data) onEvent(event, JSON.parse(data));
+      }
+    }
+  }
+
+  // Refresh a file (new revision) or a link; only changed chunks are re-embedded
+  async function refreshSource(type, id, file) {
+    const sessionId = currentSessionId;
+    let res;
+    if (type === "file") {
+      const formData = new FormData();
+      formData.append("file", file);
+      res = await fetch(
+        `http://127.0.0.1:5000/sessions/${sessionId}/files/${id}`,
+        { method: "PUT", body: formData }
+      );
+    } else {
+      res = await fetch(
+        `http://127.0.0.1:5000/sessions/${sessionId}/links/${id}/refresh`,
+        { method: "POST" }
+      );
+    }
+    if (!res.ok) return alert("Refresh failed");
+    const { job_id } = await res.json();
+    try {
+      if (job_id) await waitForJob(job_id);
+    } catch (error) {
+      alert(error.message);
+    }
+    if (currentSessionId === sessionId) await loadSessionData(sessionId);
   }
 
   function addEventListeners() {
+    fileList.addEventListener("click", (e) => {
+      if (e.target.closest(".load-more")) return loadMoreFiles();
+      const button = e.target.closest(".source-refresh");
+      if (!button) return;
+      const id = button.closest(".file-item").dataset.id;
+      const input = document.createElement("input");
+      input.type = "file";
+      input.addEventListener("change", () => {
+        if (input.files.length) refreshSource("file", id, input.files[0]);
+      });
+      input.click();
+    });
+
+    linkList.addEventListener("click", (e) => {
+      if (e.target.closest(".load-more")) return loadMoreLinks();
+      const button = e.target.closest(".source-refresh");
+      if (!button) return;
+      refreshSource("link", button.closest(".link-item").dataset.id);
+    });
+
+    chatMessages.addEventListener("scroll", () => {
+      if (chatMessages.scrollTop < 50) loadOlderMessages();
+    });
+
     // Session select
     sessionList.addEventListener("click", async (e) => {
       const li = e.target.closest(".list-group-item");
@@ -333,12 +520,24 @@ document.addEventListener("DOMContentLoaded", function () {
           { method: "POST", body: fd }
         );
         if (!res.ok) return alert("Upload failed");
-        await loadSessionData(currentSessionId);
+        const { job_id } = await res.json();
+        const sessionId = currentSessionId;
+        await loadSessionData(sessionId);
+        // Embedding runs in the background, show its progress
+        await waitForJob(job_id, (job) => {
+          loadingElement.textContent = job.chunks_total
+            ? `Processing... ${job.chunks_processed}/${job.chunks_total}`
+            : job.chunks_processed
+              ? `Processing... ${job.chunks_processed} chunks`
+              : "Processing...";
+        });
+        if (currentSessionId === sessionId) await loadSessionData(sessionId);
       } catch (error) {
         console.error("Error uploading file:", error);
         alert("Failed to upload file. Please try again.");
       } finally {
         loadingElement.style.display = "none"; // hide loading
+        loadingElement.textContent = "Uploading...";
       }
     });
 
@@ -371,8 +570,12 @@ document.addEventListener("DOMContentLoaded", function () {
             }
           );
           if (!res.ok) throw new Error("Failed to add link");
+          const { job_id } = await res.json();
+          const sessionId = currentSessionId;
           linkModal.hide();
-          await loadSessionData(currentSessionId);
+          await loadSessionData(sessionId);
+          await waitForJob(job_id);
+          if (currentSessionId === sessionId) await loadSessionData(sessionId);
         } catch (error) {
           console.error("Error adding link:", error);
           alert("Failed to add link. Please try again.");
@@ -414,9 +617,13 @@ document.addEventListener("DOMContentLoaded", function () {
 
       addMessage(text, true);
       chatInput.value = "";
+      // Render the answer progressively as sentences are streamed
+      const answerContent = addMessage("", false);
+      answerContent.textContent = "...";
+      let streamed = "";
       try {
         const res = await fetch(
-          `http://127.0.0.1:5000/sessions/${currentSessionId}/ask`,
+          `http://127.0.0.1:5000/sessions/${currentSessionId}/ask/stream`,
           {
             method: "POST",
             headers: { "Content-Type": "application/json" },
@@ -427,16 +634,39 @@ document.addEventListener("DOMContentLoaded", function () {
             }),
           }
         );
-        if (!res.ok) throw new Error("Failed to send message");
-        const { answer, source_text } = await res.json();
-        addMessage(answer, false);
-        if (source_text) {
-          const italicSourceText = `<i>${source_text}</i>`;
-          addMessage(italicSourceText, false);
+        if (!res.ok) {
+          // 429/503: the server is at its LLM capacity and says when to retry
+          const errorData = await res.json().catch(() => ({}));
+          const error = new Error(errorData.error || "Failed to send message");
+          error.retryAfter = errorData.retry_after || res.headers.get("Retry-After");
+          throw error;
         }
+        await readEventStream(res, (event, data) => {
+          if (event === "token") {
+            streamed += data.text;
+            answerContent.textContent = streamed;
+            chatMessages.scrollTop = chatMessages.scrollHeight;
+          } else if (event === "done") {
+            // The final answer is the cleaned, persisted version
+            answerContent.innerHTML = data.answer;
+            if (data.source_text) {
+              const italicSourceText = `<i>${data.source_text}</i>`;
+              addMessage(italicSourceText, false);
+            }
+          } else if (event === "error") {
+            const error = new Error(data.error);
+            error.retryAfter = data.retry_after;
+            throw error;
+          }
+        });
       } catch (error) {
+        answerContent.closest(".message").remove();
         console.error("Error sending message:", error);
-        addMessage("An error occurred while sending the message.", false);
+        if (error.retryAfter) {
+          addMessage(`The assistant is busy, please try again in ${error.retryAfter}s.`, false);
+        } else {
+          addMessage("An error occurred while sending the message.", false);
+        }
       }
     }
   }